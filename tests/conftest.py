@@ -0,0 +1,78 @@
+import importlib.resources
+
+import pytest
+from query_collection import TemplateQueryCollection
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import DC, DCTERMS, FOAF, RDF, XSD, Namespace
+
+from wapmh.store import SparqlMetadataStore
+
+BIBO = Namespace("http://purl.org/ontology/bibo/")
+LV = Namespace("http://purl.org/lobid/lv#")
+RDAU = Namespace("http://rdaregistry.info/Elements/u/")
+CARRIER = URIRef("http://rdaregistry.info/termList/RDACarrierType/1018")
+
+
+def archive_graph(count: int) -> Graph:
+    """Create a graph with `count` archived web pages of a single website."""
+    graph = Graph()
+    graph.bind("dc", DC)
+    work = URIRef("https://d-nb.info/1000000000")
+    graph.add((work, DC.identifier, Literal("(DE-101)1000000000")))
+    graph.add((work, DC.title, Literal("Example")))
+    graph.add((work, DCTERMS.medium, CARRIER))
+    graph.add((work, RDF.type, BIBO.Website))
+    graph.add((work, RDAU.P60049, URIRef("https://d-nb.info/gnd/4596172-4")))
+    graph.add((work, FOAF.primaryTopic, URIRef("https://example.org/")))
+    for i in range(count):
+        page = URIRef(f"https://d-nb.info/2{i:09d}")
+        day = f"2012-{1 + i // 28 % 12:02d}-{1 + i % 28:02d}"
+        graph.add((page, RDF.type, LV.ArchivedWebPage))
+        graph.add((page, DC.identifier, Literal(f"2{i:09d}")))
+        graph.add((page, DC.date, Literal(f"{day}T02:00:00Z", datatype=XSD.dateTime)))
+        graph.add((page, BIBO.issue, Literal(day)))
+        graph.add((page, DCTERMS.isPartOf, work))
+        graph.add((page, DCTERMS.medium, CARRIER))
+        graph.add((page, FOAF.primaryTopic, URIRef("https://example.org/")))
+    return graph
+
+
+def example_queries(graph: Graph) -> TemplateQueryCollection:
+    queries = TemplateQueryCollection(initNs=dict(graph.namespaces()))
+    with importlib.resources.path("wapmh", "../example/queries") as query_path:
+        queries.loadFromDirectory(query_path)
+    return queries
+
+
+@pytest.fixture
+def archive_store() -> SparqlMetadataStore:
+    """A store with 25 archived web pages on 25 different days."""
+    graph = archive_graph(25)
+    return SparqlMetadataStore(
+        graph=graph,
+        queries=example_queries(graph),
+        set_queries=["workSetSelect", "contentTypeSetSelect"],
+    )
+
+
+@pytest.fixture
+def executed_queries(monkeypatch):
+    """Record the (template name, bindings) of the queries a store executes.
+
+    `fail` is called with them before the query is executed, it may raise.
+    """
+
+    def record(store: SparqlMetadataStore, fail=None) -> list[tuple[str, dict]]:
+        executed = []
+        execute = store._execute
+
+        def recording_execute(name, **bindings):
+            executed.append((name, bindings))
+            if fail:
+                fail(name, bindings)
+            return execute(name, **bindings)
+
+        monkeypatch.setattr(store, "_execute", recording_execute)
+        return executed
+
+    return record
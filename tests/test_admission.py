@@ -0,0 +1,51 @@
+import asyncio
+
+from wapmh.admission import AdmissionController, AdmissionRejected
+
+
+def test_client_rate_limit():
+    controller = AdmissionController(client_rate=1, client_burst=2)
+    controller.check_rate("harvester")
+    controller.check_rate("harvester")
+    try:
+        controller.check_rate("harvester")
+    except AdmissionRejected as e:
+        assert e.retry_after == 1
+    else:
+        assert False, "the third request was admitted"
+    controller.check_rate("other harvester")
+
+
+def test_list_lane_overflow_does_not_block_fast_lane():
+    async def scenario():
+        controller = AdmissionController(
+            list_concurrency=1, queue_size=1, queue_timeout=0.2
+        )
+        release = asyncio.Event()
+
+        async def harvest():
+            async with controller.admit("ListRecords", "harvester"):
+                await release.wait()
+
+        running = asyncio.create_task(harvest())
+        queued = asyncio.create_task(harvest())
+        await asyncio.sleep(0.01)
+
+        rejected = None
+        try:
+            async with controller.admit("ListIdentifiers", "harvester"):
+                pass
+        except AdmissionRejected as e:
+            rejected = e
+
+        async with controller.admit("GetRecord", "harvester"):
+            fast_lane_admitted = True
+
+        release.set()
+        await running
+        await queued
+        return rejected, fast_lane_admitted
+
+    rejected, fast_lane_admitted = asyncio.run(scenario())
+    assert rejected is not None and rejected.retry_after >= 1
+    assert fast_lane_admitted
@@ -0,0 +1,27 @@
+import time
+
+import pytest
+
+from wapmh.cache import StaleCache
+from wapmh.store import StoreBackendException
+
+
+def test_stale_while_revalidate_and_if_error():
+    cache = StaleCache(10, ttl=0.2, stale_while_revalidate=0.3, stale_if_error=10)
+    values = iter([1, 2])
+    assert cache.get("key", lambda: next(values)) == 1
+    assert cache.get("key", lambda: 0) == 1
+
+    time.sleep(0.25)
+    # the stale value is served while it is recomputed in the background
+    assert cache.get("key", lambda: next(values)) == 1
+    time.sleep(0.05)
+    assert cache.get("key", lambda: 0) == 2
+
+    def fail():
+        raise StoreBackendException("Backend not available.")
+
+    time.sleep(0.6)
+    assert cache.get("key", fail) == 2
+    with pytest.raises(StoreBackendException):
+        cache.get("other", fail)
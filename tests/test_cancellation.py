@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from rdflib import Graph
+
+from wapmh import cancellation
+from wapmh.cancellation import (
+    CancellableSPARQLStore,
+    Cancelled,
+    CancellationToken,
+    abandoned,
+    propagate,
+)
+from wapmh.concurrency import SingleFlight
+
+
+class SlowEndpoint(BaseHTTPRequestHandler):
+    disconnected = threading.Event()
+
+    def do_GET(self):
+        # wait until the client closes the connection
+        if not self.rfile.read(1):
+            SlowEndpoint.disconnected.set()
+
+    def log_message(self, *args):
+        pass
+
+
+def run_with_token(token: CancellationToken, fn):
+    cancellation.current.set(token)
+    return fn()
+
+
+def test_cancel_aborts_sparql_request():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowEndpoint)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    graph = Graph(
+        store=CancellableSPARQLStore(f"http://127.0.0.1:{server.server_port}/sparql")
+    )
+    token = CancellationToken()
+    queries = abandoned.queries
+    try:
+        with ThreadPoolExecutor() as executor:
+            future = executor.submit(
+                run_with_token, token, lambda: graph.query("ASK {}")
+            )
+            time.sleep(0.2)
+            token.cancel()
+            with pytest.raises(Cancelled):
+                future.result(timeout=5)
+        assert SlowEndpoint.disconnected.wait(5)
+        assert abandoned.queries == queries + 1
+    finally:
+        server.shutdown()
+
+
+def test_single_flight_restarts_cancelled_computation():
+    flight = SingleFlight()
+    leader = CancellationToken()
+    started = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(cancellation.current.get())
+        started.set()
+        while cancellation.current.get() is leader:
+            cancellation.check()
+            time.sleep(0.01)
+        return "done"
+
+    with ThreadPoolExecutor() as executor:
+        first = executor.submit(
+            run_with_token, leader, lambda: flight.do("key", compute)
+        )
+        started.wait()
+        second = executor.submit(propagate(lambda: flight.do("key", compute)))
+        time.sleep(0.05)
+        leader.cancel()
+        with pytest.raises(Cancelled):
+            first.result()
+        assert second.result() == "done"
+    assert len(calls) == 2
@@ -0,0 +1,105 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from fastapi.testclient import TestClient
+from rdflib import Literal, URIRef
+from rdflib.namespace import DC, RDF, XSD
+
+from wapmh import repository, streaming
+from wapmh.changes import ADDED, DELETED, UPDATED, ChangeTracker
+from wapmh.model.oai_pmh import StatusType
+
+
+def test_change_tracker_detects_changes(archive_store):
+    graph = archive_store.graph
+    tracker = ChangeTracker(archive_store, full_scan_every=2)
+    received = []
+    tracker.subscribe(received.extend)
+    assert tracker.poll() == []
+    assert len(tracker.known) == 25
+
+    page = URIRef("https://d-nb.info/2000000024")
+    graph.set((page, DC.date, Literal("2012-01-26T03:00:00Z", datatype=XSD.dateTime)))
+    new_page = URIRef("https://d-nb.info/3000000000")
+    for p, o in graph.predicate_objects(page):
+        graph.add((new_page, p, o))
+    graph.set((new_page, DC.identifier, Literal("3000000000")))
+    graph.remove((URIRef("https://d-nb.info/2000000000"), RDF.type, None))
+
+    changes = tracker.poll()
+    assert {(c.kind, c.identifier) for c in changes} == {
+        (UPDATED, "2000000024"),
+        (ADDED, "3000000000"),
+    }
+
+    changes = tracker.poll()
+    assert [(c.kind, c.identifier) for c in changes] == [(DELETED, "2000000000")]
+    assert "2000000000" in tracker.tombstones
+    assert received == tracker.changes()
+    assert tracker.changes(since=changes[0].sequence - 1) == changes
+
+
+def test_deleted_records_are_listed_when_detected(archive_store, monkeypatch):
+    tracker = ChangeTracker(archive_store, full_scan_every=1)
+    tracker.poll()
+    archive_store.graph.remove((URIRef("https://d-nb.info/2000000000"), RDF.type, None))
+    tracker.poll()
+    monkeypatch.setattr(repository, "get_change_tracker", lambda: tracker)
+    monkeypatch.setattr(repository.get_settings(), "limit", 100)
+
+    today = datetime.now(timezone.utc).date().isoformat()
+    assert tracker.tombstones["2000000000"].datestamp.startswith(today)
+    page = repository.list_identifiers(archive_store, "oai_dc", **{"from": today})
+    [header] = page["list_identifiers"].header
+    assert (header.identifier, header.status) == ("2000000000", StatusType.DELETED)
+
+    page = repository.list_records(archive_store, "oai_dc")
+    records = page["list_records"].record
+    assert len(records) == 25
+    assert records[-1].header.status == StatusType.DELETED
+    assert records[0].metadata is not None
+
+
+def test_lookup_returns_deleted_records_like_get_record(archive_store, monkeypatch):
+    tracker = ChangeTracker(archive_store, full_scan_every=1)
+    tracker.poll()
+    archive_store.graph.remove((URIRef("https://d-nb.info/2000000000"), RDF.type, None))
+    tracker.poll()
+    monkeypatch.setattr(repository, "get_metadata_store", lambda: archive_store)
+    monkeypatch.setattr(repository, "get_store_reloader", lambda: None)
+    monkeypatch.setattr(repository, "get_change_tracker", lambda: tracker)
+
+    record = repository.get_record(archive_store, "oai_dc", "2000000000")
+    assert record["get_record"].record.header.status == StatusType.DELETED
+
+    with TestClient(repository.app) as client:
+        response = client.post("/records", json=["2000000000", "unknown"])
+    xml = response.text
+    assert '<header status="deleted"><identifier>2000000000</identifier>' in xml
+    # the unknown identifier is reported outside of the OAI-PMH elements
+    assert "</ListRecords><missing " in xml
+    assert f'xmlns="{streaming.LOOKUP_NAMESPACE}"><identifier>unknown<' in xml
+    assert "<error" not in xml
+
+
+def test_tombstones_are_read_while_the_store_is_scanned(archive_store, monkeypatch):
+    tracker = ChangeTracker(archive_store)
+    scanning, resume = threading.Event(), threading.Event()
+    identifiers = archive_store.identifiers
+
+    def slow_identifiers(**kwargs):
+        scanning.set()
+        resume.wait(5)
+        return identifiers(**kwargs)
+
+    monkeypatch.setattr(archive_store, "identifiers", slow_identifiers)
+    poll = threading.Thread(target=tracker.poll)
+    poll.start()
+    assert scanning.wait(5)
+    started = time.monotonic()
+    assert tracker.deleted_headers() == []
+    assert time.monotonic() - started < 1
+    resume.set()
+    poll.join()
+    assert len(tracker.known) == 25
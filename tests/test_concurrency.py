@@ -0,0 +1,78 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from wapmh.concurrency import SingleFlight
+from wapmh.store import MockSparqlMetadataStore
+
+
+def run_concurrently(flight: SingleFlight, fn, release: threading.Event, count=4):
+    """Start a leader call, let followers join it and then release the leader."""
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        futures = [executor.submit(fn)]
+        while flight.in_flight() == 0:
+            time.sleep(0.001)
+        futures += [executor.submit(fn) for _ in range(count - 1)]
+        time.sleep(0.1)
+        release.set()
+        return [future.result() for future in futures]
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(timeout=5)
+        return "result"
+
+    results = run_concurrently(flight, lambda: flight.do("key", compute), release)
+
+    assert results == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.in_flight() == 0
+
+
+def test_single_flight_propagates_errors():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("backend down")
+
+    try:
+        flight.do("key", fail)
+    except ValueError as e:
+        assert str(e) == "backend down"
+    else:
+        assert False, "the exception was not raised"
+    assert flight.in_flight() == 0
+
+
+def test_store_query_is_shared_between_callers():
+    store = MockSparqlMetadataStore()
+    release = threading.Event()
+    executed = []
+    execute = store._execute
+
+    def blocking_execute(name, **bindings):
+        executed.append(name)
+        release.wait(timeout=5)
+        return execute(name, **bindings)
+
+    store._execute = blocking_execute
+    results = run_concurrently(store.flight, lambda: list(store.identifiers()), release)
+
+    for headers in results:
+        assert [str(header["identifier"]) for header in headers] == ["1234567802"]
+    assert executed == ["allHeadersSelect"]
+
+
+def test_concurrent_queries_on_local_graph(archive_store):
+    def get_headers(i):
+        return list(archive_store.identifiers(identifier=f"2{i % 25:09d}"))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(get_headers, range(100)))
+    assert all(len(headers) == 1 for headers in results)
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import archive_graph, example_queries
+from rdflib import Graph, URIRef
+from rdflib.namespace import RDF
+
+from wapmh.changes import DELETED, Change
+from wapmh.federation import FederatedMetadataStore
+from wapmh.store import MetadataStore, SparqlMetadataStore
+
+
+def shard_store(graph: Graph, shard: int, shards: int) -> SparqlMetadataStore:
+    """A store with every `shards`-th page of the graph and all other triples."""
+    shard_graph = Graph()
+    for s, p, o in graph:
+        if (
+            not str(s).startswith("https://d-nb.info/2")
+            or int(str(s)[-2:]) % shards == shard
+        ):
+            shard_graph.add((s, p, o))
+    return SparqlMetadataStore(graph=shard_graph, queries=example_queries(graph))
+
+
+def test_federated_paging_and_routing():
+    graph = archive_graph(10)
+    single = SparqlMetadataStore(graph=graph, queries=example_queries(graph))
+    federated = FederatedMetadataStore([shard_store(graph, i, 3) for i in range(3)])
+
+    expected = [str(h["identifier"]) for h in single.identifiers(offset=0)]
+    pages = [
+        [str(h["identifier"]) for h in federated.identifiers(offset=offset, limit=4)]
+        for offset in (0, 4, 8)
+    ]
+    assert sum(pages, []) == expected
+    assert len(list(federated.identifiers())) == 10
+
+    federated.routes.clear()
+    record = next(federated.records(identifier="2000000005"))
+    assert str(record["identifier"]) == "2000000005"
+    assert federated.routes.get("2000000005") == 2
+    assert list(federated.records(identifier="2999999999")) == []
+
+    headers = list(federated.identifiers(offset=3, limit=3))
+    records = list(federated.records(headers=headers))
+    assert [r["identifier"] for r in records] == [h["identifier"] for h in headers]
+
+
+class BarrierStore(MetadataStore):
+    """A shard that answers only when all shards of all requests are queried."""
+
+    def __init__(self, barrier: threading.Barrier):
+        self.barrier = barrier
+
+    def identifiers(self, **kwargs):
+        self.barrier.wait()
+        return iter([])
+
+    def records(self, **kwargs):
+        return iter([])
+
+
+def test_federated_requests_query_the_shards_concurrently():
+    barrier = threading.Barrier(3 * 2, timeout=5)
+    federated = FederatedMetadataStore(
+        [BarrierStore(barrier) for _ in range(3)], concurrency=2
+    )
+    with ThreadPoolExecutor(max_workers=2) as requests:
+        results = list(
+            requests.map(lambda _: list(federated.identifiers(limit=10)), range(2))
+        )
+    assert results == [[], []]
+
+
+def test_changes_are_applied_to_the_shards():
+    graph = archive_graph(10)
+    shards = [shard_store(graph, i, 2) for i in range(2)]
+    for shard in shards:
+        shard.set_queries = ["workSetSelect"]
+    federated = FederatedMetadataStore(shards)
+    assert len(list(federated.identifiers(set="work:1000000000"))) == 10
+
+    page = URIRef("https://d-nb.info/2000000003")
+    shards[1].graph.remove((page, RDF.type, None))
+    federated.apply_changes([Change(1, DELETED, "2000000003", "2012-01-04")])
+    assert federated.routes.get("2000000003") is None
+    headers = list(federated.identifiers(set="work:1000000000"))
+    assert len(headers) == 9
+    # the set indexes of the shards are refreshed
+    assert not any(shard.set_index().contains("work", "2000000003") for shard in shards)
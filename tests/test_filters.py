@@ -0,0 +1,57 @@
+from wapmh.filters import BloomFilter, IdentifierFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    values = [f"{i:010d}" for i in range(10000)]
+    bloom = BloomFilter.from_values(values, error_rate=0.01)
+    assert all(value in bloom for value in values)
+    false_positives = sum(f"x{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_get_record_of_unknown_identifier_skips_backend(
+    archive_store, executed_queries
+):
+    executed = executed_queries(archive_store)
+    archive_store.start_identifier_filter()
+    archive_store.identifier_filter.stop()
+    archive_store.identifier_filter._thread.join()
+    assert [name for name, _ in executed] == ["allHeadersSelect"]
+
+    assert list(archive_store.identifiers(identifier="unknown")) == []
+    assert "identifiedHeaderSelect" not in [name for name, _ in executed]
+
+    headers = list(archive_store.identifiers(identifier="2000000003"))
+    assert executed[-1][0] == "identifiedHeaderSelect"
+    assert headers
+
+
+def test_delayed_start_keeps_the_filter_until_the_refresh(
+    archive_store, executed_queries
+):
+    archive_store.start_identifier_filter()
+    identifier_filter = archive_store.identifier_filter
+    identifier_filter.stop(wait=True)
+    bloom = identifier_filter.bloom
+    assert bloom is not None
+
+    executed = executed_queries(archive_store)
+    identifier_filter.start(delay=60)
+    identifier_filter.stop(wait=True)
+    assert identifier_filter.bloom is bloom
+    assert executed == []
+
+
+def test_identifiers_added_during_build_are_kept():
+    def source():
+        # an identifier is created after the source was read
+        identifier_filter.add("added")
+        return ["existing"]
+
+    identifier_filter = IdentifierFilter(source, refresh_interval=0)
+    identifier_filter.build()
+    assert identifier_filter.might_contain("existing")
+    assert identifier_filter.might_contain("added")
+
+    identifier_filter.build()
+    assert identifier_filter.might_contain("added")
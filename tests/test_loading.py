@@ -0,0 +1,46 @@
+from conftest import BIBO, archive_graph
+from rdflib import BNode, Literal, URIRef
+from rdflib.compare import isomorphic
+from rdflib.namespace import DC
+
+from wapmh.loading import chunk_ranges, load_graph
+
+
+def example_graph():
+    graph = archive_graph(50)
+    creator = BNode()
+    graph.add((creator, DC.title, Literal("Creator")))
+    graph.add((creator, DC.identifier, Literal("creator")))
+    return graph
+
+
+def test_chunk_ranges_split_at_line_ends(tmp_path):
+    path = tmp_path / "data.nt"
+    example_graph().serialize(path, format="nt", encoding="utf-8")
+    ranges = chunk_ranges(str(path), 0, 1000)
+    data = path.read_bytes()
+    assert len(ranges) > 1
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[end - 1 : end] == b"\n"
+
+
+def test_parallel_n_triples_loading(tmp_path):
+    path = tmp_path / "data.nt"
+    graph = example_graph()
+    graph.serialize(path, format="nt", encoding="utf-8")
+
+    loaded = load_graph(str(path), workers=2, chunk_bytes=2000)
+    assert len(loaded) == len(graph)
+    assert isomorphic(loaded, graph)
+
+
+def test_parallel_turtle_loading(tmp_path):
+    path = tmp_path / "data.ttl"
+    graph = archive_graph(50)
+    graph.bind("bibo", BIBO)
+    graph.serialize(path, format="turtle")
+
+    loaded = load_graph(str(path), workers=2, chunk_bytes=2000, splittable_turtle=True)
+    assert isomorphic(loaded, graph)
+    assert ("bibo", URIRef(BIBO)) in set(loaded.namespaces())
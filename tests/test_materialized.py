@@ -0,0 +1,54 @@
+from rdflib import URIRef
+from rdflib.namespace import RDF
+
+from wapmh import repository
+from wapmh.materialized import MaterializedMetadataStore, materialize
+
+
+def test_materialized_store_serves_converted_records(archive_store, tmp_path):
+    path = str(tmp_path / "records.sqlite")
+    registry = repository.get_record_adapter_registry()
+    assert materialize(archive_store, registry, path) == 25
+
+    store = MaterializedMetadataStore(path)
+    headers = list(store.identifiers(offset=5, limit=3))
+    expected = list(archive_store.identifiers(offset=5, limit=3))
+    assert [h["identifier"] for h in headers] == [
+        str(h["identifier"]) for h in expected
+    ]
+    assert len(list(store.identifiers(set="work"))) == 25
+    assert len(list(store.identifiers(**{"from": "2012-01-10", "until": "2012-01-12"})))
+    assert {"setSpec": "work:1000000000", "setName": "Example"} in store.sets()
+
+    for prefix in ["oai_dc", "rdf"]:
+        adapter = registry.adapter(store, prefix)
+        record = adapter.record(identifier="2000000003")
+        assert record.header.identifier == "2000000003"
+        assert record.metadata.other_element is not None
+
+
+def test_materialization_is_incremental(archive_store, tmp_path):
+    path = str(tmp_path / "records.sqlite")
+    registry = repository.get_record_adapter_registry()
+    materialize(archive_store, registry, path)
+    # only the records since the day of the latest datestamp are converted again
+    assert materialize(archive_store, registry, path) == 1
+    assert materialize(archive_store, registry, path, full=True) == 25
+
+
+def test_full_materialization_removes_records_that_are_gone(archive_store, tmp_path):
+    path = str(tmp_path / "records.sqlite")
+    registry = repository.get_record_adapter_registry()
+    materialize(archive_store, registry, path)
+    archive_store.graph.remove((URIRef("https://d-nb.info/2000000003"), RDF.type, None))
+
+    # an incremental run does not see deletions
+    materialize(archive_store, registry, path)
+    store = MaterializedMetadataStore(path)
+    assert len(list(store.identifiers())) == 25
+
+    assert materialize(archive_store, registry, path, full=True) == 24
+    assert len(list(store.identifiers())) == 24
+    assert list(store.identifiers(identifier="2000000003")) == []
+    assert list(store.records(identifier="2000000003")) == []
+    assert len(list(store.identifiers(set="work"))) == 24
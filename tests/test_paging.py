@@ -0,0 +1,194 @@
+from conftest import LV
+from rdflib import Literal, URIRef
+from rdflib.namespace import DC, RDF, XSD
+
+from wapmh import repository
+from wapmh.paging import BadResumptionToken, Prefetcher, ResumptionToken, page_size
+
+
+def test_resumption_token_round_trip():
+    token = ResumptionToken.start(metadataPrefix="oai_dc", **{"from": "2012-01-01"})
+    next_token = ResumptionToken.decode(token.next(10).encode())
+    assert next_token.arguments == {"metadataPrefix": "oai_dc", "from": "2012-01-01"}
+    assert next_token.cursor == 10
+
+    for value in ["", "invalid", ResumptionToken({"verb": "x"}).encode()]:
+        try:
+            ResumptionToken.decode(value)
+        except BadResumptionToken:
+            pass
+        else:
+            assert False, f"{value} was accepted"
+
+
+def test_list_identifiers_follows_resumption_tokens(archive_store, monkeypatch):
+    monkeypatch.setattr(repository.get_settings(), "limit", 10)
+    identifiers = []
+    response = repository.list_identifiers(archive_store, "oai_dc")
+    while True:
+        page = response["list_identifiers"]
+        identifiers += [header.identifier for header in page.header]
+        if not page.resumption_token or not page.resumption_token.value:
+            break
+        response = repository.list_identifiers(
+            archive_store, "oai_dc", resumptionToken=page.resumption_token.value
+        )
+
+    assert page.resumption_token.cursor == 20
+    assert len(identifiers) == 25
+    assert identifiers == sorted(identifiers)
+
+    for value in [
+        "invalid",
+        ResumptionToken({}, cursor=0).encode(),
+        ResumptionToken({"metadataPrefix": "nope"}, cursor=0).encode(),
+    ]:
+        response = repository.list_records(
+            archive_store, "oai_dc", resumptionToken=value
+        )
+        assert response["error"].code.value == "badResumptionToken"
+
+
+def test_pages_are_queried_after_the_last_header(
+    archive_store, executed_queries, monkeypatch
+):
+    monkeypatch.setattr(repository.get_settings(), "limit", 10)
+    executed = executed_queries(archive_store)
+    identifiers = []
+    token = None
+    while True:
+        response = repository.list_identifiers(
+            archive_store, "oai_dc", resumptionToken=token, set="work:1000000000"
+        )
+        page = response["list_identifiers"]
+        identifiers += [str(header.identifier) for header in page.header]
+        if not page.resumption_token or not page.resumption_token.value:
+            break
+        token = page.resumption_token.value
+        assert ResumptionToken.decode(token).after[1] == identifiers[-1]
+
+    assert identifiers == [f"2{i:09d}" for i in range(25)]
+    headers = [b for name, b in executed if name.endswith("HeadersSelect")]
+    assert all(name != "allHeadersSelect" for name, _ in executed)
+    assert len(headers) == 3 and all(b["limit"] == 1000 for b in headers)
+    assert "afterDatestamp" not in headers[0] and "afterDatestamp" in headers[1]
+
+
+def test_prefetched_page_is_served_from_cache():
+    prefetcher = Prefetcher(workers=1, max_bytes=100000, ttl=60)
+    computed = []
+
+    def compute():
+        computed.append(1)
+        return {}, None
+
+    prefetcher.prefetch("token", compute)
+    prefetcher.executor.shutdown(wait=True)
+    assert prefetcher.get("token", compute) == ({}, None)
+    assert len(computed) == 1
+
+
+def test_list_records_page_is_cut_by_byte_budget(archive_store, monkeypatch):
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "limit", 10)
+    monkeypatch.setattr(settings, "page_bytes", 1)
+    response = repository.list_records(archive_store, "rdf")
+    page = response["list_records"]
+    assert len(page.record) == 1
+    assert ResumptionToken.decode(page.resumption_token.value).cursor == 1
+
+    monkeypatch.setattr(settings, "page_bytes", 100000)
+    response = repository.list_records(archive_store, "rdf")
+    assert len(response["list_records"].record) == 10
+
+    # without a byte budget the records are not measured
+    monkeypatch.setattr(settings, "page_bytes", 0)
+    monkeypatch.setattr(repository, "record_size", None)
+    response = repository.list_records(archive_store, "rdf")
+    assert len(response["list_records"].record) == 10
+
+
+def test_budget_cut_continues_after_missing_records(archive_store, monkeypatch):
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "limit", 10)
+    monkeypatch.setattr(settings, "page_bytes", 1)
+    response = repository.list_identifiers(archive_store, "oai_dc")
+    headers = response["list_identifiers"].header
+
+    # the record of the first header is removed after the headers were queried
+    records = archive_store.records
+
+    def without_first(**kwargs):
+        for record in records(**kwargs):
+            if str(record["identifier"]) != str(headers[0].identifier):
+                yield record
+
+    monkeypatch.setattr(archive_store, "records", without_first)
+    response = repository.list_records(archive_store, "rdf")
+    page = response["list_records"]
+    assert [record.header.identifier for record in page.record] == [
+        headers[1].identifier
+    ]
+    token = ResumptionToken.decode(page.resumption_token.value)
+    assert token.cursor == 2
+    assert token.after[1] == str(headers[1].identifier)
+
+
+def test_result_set_keeps_pages_consistent(archive_store, monkeypatch, tmp_path):
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "limit", 10)
+    monkeypatch.setattr(settings, "result_set_path", str(tmp_path))
+    repository.get_result_sets.cache_clear()
+    try:
+        identifiers = []
+        response = repository.list_identifiers(archive_store, "oai_dc")
+        page = response["list_identifiers"]
+        assert page.resumption_token.complete_list_size == 25
+        token = ResumptionToken.decode(page.resumption_token.value)
+        assert token.result_set and token.cursor == 10 and not token.arguments
+
+        # a record that sorts before all others is added during the harvest
+        graph = archive_store.graph
+        page_iri = URIRef("https://d-nb.info/2999999999")
+        graph.add((page_iri, RDF.type, LV.ArchivedWebPage))
+        graph.add((page_iri, DC.identifier, Literal("2999999999")))
+        graph.add(
+            (page_iri, DC.date, Literal("2000-01-01T00:00:00Z", datatype=XSD.dateTime))
+        )
+        while True:
+            identifiers += [header.identifier for header in page.header]
+            if not page.resumption_token.value:
+                break
+            response = repository.list_identifiers(
+                archive_store, "oai_dc", resumptionToken=page.resumption_token.value
+            )
+            page = response["list_identifiers"]
+
+        assert len(identifiers) == len(set(identifiers)) == 25
+        assert "2999999999" not in identifiers
+
+        for path in tmp_path.iterdir():
+            path.unlink()
+        repository.get_result_sets.cache_clear()
+        response = repository.list_identifiers(
+            archive_store, "oai_dc", resumptionToken=token.encode()
+        )
+        assert response["error"].code.value == "badResumptionToken"
+    finally:
+        monkeypatch.undo()
+        repository.get_result_sets.cache_clear()
+
+
+def test_prefetched_pages_are_sized_in_bytes(archive_store, monkeypatch):
+    monkeypatch.setattr(repository.get_settings(), "limit", 10)
+    headers = repository.list_identifiers(archive_store, "oai_dc")
+    records = repository.list_records(archive_store, "rdf")
+    assert page_size((headers, None)) == 11 * 256
+    # the same number of records with their metadata is much larger
+    assert page_size((records, None)) > 2 * page_size((headers, None))
+
+    prefetcher = Prefetcher(workers=0, max_bytes=page_size((records, None)), ttl=60)
+    prefetcher.cache.set("records", (records, None))
+    prefetcher.cache.set("headers", (headers, None))
+    # the large page is evicted for the small one
+    assert "records" not in prefetcher.cache and "headers" in prefetcher.cache
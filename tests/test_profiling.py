@@ -0,0 +1,55 @@
+import tracemalloc
+
+from fastapi.testclient import TestClient
+
+from wapmh import benchmark, repository
+from wapmh.profiling import MemoryProfiler, stage, stages
+
+
+def test_stages_account_allocations():
+    profiler = MemoryProfiler()
+    profiler.start()
+    try:
+        with profiler.request("ListRecords") as profile:
+            kept = [bytearray(100_000) for _ in stages(range(10), "store")]
+            with stage("convert"):
+                temporary = bytearray(2_000_000)
+                del temporary
+    finally:
+        profiler.stop()
+
+    assert profile.stages["store"].calls == 11
+    assert profile.stages["store"].retained < 10_000
+    assert profile.stages["convert"].peak >= 3_000_000
+    assert profile.stages["convert"].retained < 10_000
+    assert profile.peak >= 3_000_000
+    assert profiler.summary()["ListRecords"]["requests"] == 1
+    assert len(kept) == 10
+
+
+def test_stages_without_profiling():
+    assert not tracemalloc.is_tracing()
+    with stage("store"):
+        pass
+    assert list(stages(range(3), "store")) == [0, 1, 2]
+
+
+def test_allocations_benchmark(monkeypatch):
+    monkeypatch.setenv("LIMIT", "10")
+    try:
+        assert benchmark.allocations([30], verb="ListIdentifiers", pages=2)
+        assert not benchmark.allocations(
+            [30], verb="ListIdentifiers", pages=2, max_peak_per_page=1
+        )
+    finally:
+        monkeypatch.undo()
+        repository.get_settings.cache_clear()
+
+
+def test_memory_profile_requires_the_admin_token(monkeypatch):
+    monkeypatch.setattr(repository.get_settings(), "admin_token", "secret")
+    monkeypatch.setattr(repository, "get_memory_profiler", lambda: MemoryProfiler())
+    client = TestClient(repository.app)
+    assert client.get("/memory", params={"top": 5}).status_code == 401
+    response = client.get("/memory", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200 and "verbs" in response.json()
@@ -0,0 +1,80 @@
+import os
+
+from conftest import archive_graph, example_queries
+from fastapi.testclient import TestClient
+from rdflib import Graph
+
+from wapmh import repository
+from wapmh.reload import StoreReloader
+from wapmh.store import SparqlMetadataStore
+
+
+def test_reload_swaps_store(tmp_path):
+    path = tmp_path / "data.ttl"
+    archive_graph(3).serialize(path, format="turtle")
+
+    def factory():
+        graph = Graph().parse(path, format="turtle")
+        return SparqlMetadataStore(graph=graph, queries=example_queries(graph))
+
+    reloader = StoreReloader(factory, str(path))
+    assert not reloader.changed()
+    # a running request keeps its snapshot of the store
+    snapshot = reloader.store
+    assert len(list(snapshot.identifiers())) == 3
+
+    archive_graph(5).serialize(path, format="turtle")
+    os.utime(path, (0, 0))
+    assert reloader.reload_if_changed()
+    assert reloader.store is not snapshot
+    assert len(list(reloader.store.identifiers())) == 5
+    assert len(list(snapshot.identifiers())) == 3
+
+    # the snapshot is still in use, so a third store is not loaded
+    assert not reloader.reload()
+    del snapshot
+    assert reloader.reload()
+    assert reloader.reloads == 2
+
+
+def test_app_reloads_repeatedly(tmp_path, monkeypatch):
+    path = tmp_path / "data.ttl"
+    archive_graph(3).serialize(path, format="turtle")
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "graph_path", str(path))
+    monkeypatch.setattr(settings, "set_queries", [])
+    monkeypatch.setattr(settings, "limit", 100)
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    getters = [
+        repository.get_store_reloader,
+        repository.get_metadata_store,
+        repository.get_change_tracker,
+    ]
+    for getter in getters:
+        getter.cache_clear()
+    try:
+        with TestClient(repository.app) as client:
+            for count in (4, 5, 6):
+                archive_graph(count).serialize(path, format="turtle")
+                response = client.post(
+                    "/reload", headers={"Authorization": "Bearer secret"}
+                )
+                assert response.json()["reloaded"] is True
+                response = client.get(
+                    "/",
+                    params={"verb": "ListIdentifiers", "metadataPrefix": "oai_dc"},
+                )
+                assert response.text.count("<identifier>") == count
+            assert response.status_code == 200
+            assert client.post("/reload").status_code == 401
+            assert (
+                client.post(
+                    "/reload", headers={"Authorization": "Bearer x"}
+                ).status_code
+                == 401
+            )
+            monkeypatch.setattr(settings, "admin_token", "")
+            assert client.post("/reload").status_code == 404
+    finally:
+        for getter in getters:
+            getter.cache_clear()
@@ -0,0 +1,119 @@
+import threading
+import time
+from urllib.error import HTTPError
+
+import pytest
+
+from wapmh.cancellation import Cancelled, EndpointError, on_cancel
+from wapmh.replicas import (
+    CLOSED,
+    OPEN,
+    CircuitBreaker,
+    ReplicaPool,
+    ReplicasUnavailable,
+    is_transport_error,
+)
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+    time.sleep(0.06)
+    # a single probe is allowed
+    assert breaker.allow() and not breaker.allow()
+    breaker.success()
+    assert breaker.allow()
+
+
+def test_failover():
+    calls = []
+
+    def fn(backend):
+        calls.append(backend)
+        if backend == "down":
+            raise OSError("connection refused")
+        return backend
+
+    pool = ReplicaPool({"a": "down", "b": "up"}, failure_threshold=1)
+    assert pool.call(fn) == "up"
+    assert pool.call(fn) == "up"
+    # the failing replica is not asked again while its breaker is open
+    assert calls == ["down", "up", "up"]
+
+    pool = ReplicaPool({"a": "down"}, failure_threshold=1, reset_timeout=60)
+    with pytest.raises(OSError):
+        pool.call(fn)
+    with pytest.raises(ReplicasUnavailable):
+        pool.call(fn)
+
+
+def test_hedged_call():
+    def fn(backend):
+        time.sleep(backend)
+        return backend
+
+    pool = ReplicaPool({"slow": 0.5, "fast": 0.01}, hedge_after=0.05)
+    # both replicas are unknown, so the first one is tried first
+    started = time.monotonic()
+    assert pool.call(fn, hedge=True) == 0.01
+    assert time.monotonic() - started < 0.4
+    assert pool.hedges == 1
+
+
+def test_query_errors_are_not_replica_failures():
+    calls = []
+
+    def fn(backend):
+        calls.append(backend)
+        raise ValueError("Expected SelectQuery")
+
+    pool = ReplicaPool({"a": "a", "b": "b"}, failure_threshold=1)
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            pool.call(fn)
+    # the query would fail with every replica, so it is not repeated
+    assert calls == ["a", "a"]
+    assert all(replica.breaker.state == CLOSED for replica in pool.replicas)
+
+    assert is_transport_error(TimeoutError())
+    assert is_transport_error(EndpointError(503))
+    assert not is_transport_error(EndpointError(400))
+    assert not is_transport_error(HTTPError("http://a", 400, "Bad Request", {}, None))
+    assert is_transport_error(HTTPError("http://a", 502, "Bad Gateway", {}, None))
+
+
+def test_slower_hedged_call_is_cancelled():
+    cancelled = threading.Event()
+
+    def fn(backend):
+        if backend == "fast":
+            return backend
+        with on_cancel(cancelled.set):
+            cancelled.wait(2)
+        return backend
+
+    pool = ReplicaPool({"slow": "slow", "fast": "fast"}, hedge_after=0.05)
+    pool.replicas[1].latency = 1
+    assert pool.call(fn, hedge=True) == "fast"
+    assert cancelled.wait(1)
+
+
+def test_cancelled_probe_is_released():
+    def fn(backend):
+        if backend.pop(0) == "cancelled":
+            raise Cancelled()
+        return "up"
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.failure()
+    time.sleep(0.06)
+    pool = ReplicaPool({"a": ["cancelled", "up"]})
+    pool.replicas[0].breaker = breaker
+    # the probe is cancelled, it neither closes nor opens the breaker again
+    with pytest.raises(Cancelled):
+        pool.call(fn)
+    assert pool.call(fn) == "up"
+    assert breaker.state == CLOSED
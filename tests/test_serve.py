@@ -0,0 +1,40 @@
+import gc
+import os
+
+import pytest
+from conftest import archive_graph
+from fastapi.testclient import TestClient
+
+from wapmh import repository
+from wapmh.serve import load, memory_usage
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps_rollup"), reason="no procfs")
+def test_memory_usage():
+    usage = memory_usage(os.getpid())
+    assert usage["rss"] > 0
+    assert usage["rss"] == usage["shared"] + usage["private"]
+
+
+def test_background_work_starts_with_the_app(tmp_path, monkeypatch):
+    path = tmp_path / "data.ttl"
+    archive_graph(3).serialize(path, format="turtle")
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "graph_path", str(path))
+    monkeypatch.setattr(settings, "set_queries", [])
+    monkeypatch.setattr(settings, "reload_interval", 60)
+    getters = [repository.get_store_reloader, repository.get_metadata_store]
+    for getter in getters:
+        getter.cache_clear()
+    try:
+        # the parent only loads the store, threads are not inherited by the workers
+        store = load()
+        reloader = repository.get_store_reloader()
+        assert reloader.store is store and reloader._thread is None
+        with TestClient(repository.app):
+            assert reloader._thread.is_alive()
+        reloader.stop()
+    finally:
+        gc.unfreeze()
+        for getter in getters:
+            getter.cache_clear()
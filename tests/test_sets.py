@@ -0,0 +1,54 @@
+from wapmh import repository
+from wapmh.sets import Bitmap, SetIndex
+
+
+def test_bitmap():
+    values = [5, 70000, 3, 70000 + 2**16]
+    bitmap = Bitmap(values)
+    assert list(bitmap) == sorted(values)
+    assert 70000 in bitmap and 4 not in bitmap
+
+    dense = Bitmap(range(0, 20000, 2))
+    assert isinstance(dense.containers[0], bytearray)
+    assert len(dense) == 10000
+    assert 19998 in dense and 19999 not in dense
+    assert list(dense)[:3] == [0, 2, 4]
+
+
+def test_set_index_hierarchy():
+    index = SetIndex()
+    index.add("work:1", "a", "Website 1")
+    index.add("work:2", "b")
+    index.add("contentType:1020", "a")
+
+    assert index.contains("work", "a") and index.contains("work", "b")
+    assert not index.contains("work:1", "b")
+    assert index.sets_of("a") == ["contentType:1020", "work:1"]
+    index.add("contentType:1020", "b")
+    index.add("work:1", "c")
+    index.add("contentType:1020", "c")
+    # records with the same sets share their combination
+    assert index.leaves[index.ordinals["a"]] == index.leaves[index.ordinals["c"]]
+    assert len(index.combinations) == 5
+    assert {"setSpec": "work:1", "setName": "Website 1"} in index.sets()
+
+
+def test_set_filtered_list_identifiers(archive_store, monkeypatch):
+    monkeypatch.setattr(repository.get_settings(), "limit", 100)
+    response = repository.list_sets(archive_store)
+    specs = [s.set_spec for s in response["list_sets"].set]
+    assert "work:1000000000" in specs
+
+    response = repository.list_identifiers(
+        archive_store, "oai_dc", set="work:1000000000"
+    )
+    headers = response["list_identifiers"].header
+    assert len(headers) == 25
+    assert "work:1000000000" in headers[0].set_spec
+
+    response = repository.list_identifiers(archive_store, "oai_dc", set="work:0")
+    assert response["error"].code.value == "noRecordsMatch"
+    monkeypatch.setattr(archive_store, "set_queries", [])
+    monkeypatch.setattr(archive_store, "_set_index", None)
+    response = repository.list_records(archive_store, "oai_dc", set="work")
+    assert response["error"].code.value == "noSetHierarchy"
@@ -0,0 +1,132 @@
+import os
+import pickle
+import socket
+import threading
+import time
+
+from xsdata.formats.dataclass.etree import etree
+
+from wapmh.cache import Cache, StaleCache
+from wapmh.model.oai_pmh import HeaderType, ListRecordsType, MetadataType, RecordType
+from wapmh.paging import ResumptionToken
+from wapmh.shared_cache import (
+    MmapBackend,
+    RedisBackend,
+    TieredCache,
+    digest,
+    dumps,
+    loads,
+)
+
+
+def serve_resp(sock, store):
+    """A minimal server for the commands used by RedisBackend."""
+    reader = sock.makefile("rb")
+    while line := reader.readline():
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(reader.readline()[1:])
+            args.append(reader.read(length + 2)[:-2])
+        command = args[0].upper()
+        if command == b"GET":
+            value = store.get(args[1])
+            reply = (
+                b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            )
+        elif command == b"SET":
+            store[args[1]] = args[2]
+            reply = b"+OK\r\n"
+        elif command == b"INCR":
+            store[args[1]] = b"%d" % (int(store.get(args[1], 0)) + 1)
+            reply = b":%s\r\n" % store[args[1]]
+        else:
+            reply = b"-ERR unknown command\r\n"
+        sock.sendall(reply)
+
+
+def resp_server():
+    server = socket.create_server(("127.0.0.1", 0))
+    store = {}
+
+    def accept():
+        while True:
+            connection, _ = server.accept()
+            threading.Thread(
+                target=serve_resp, args=(connection, store), daemon=True
+            ).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return server.getsockname()[1], store
+
+
+def test_mmap_backend_is_shared_and_evicts_oldest(tmp_path):
+    path = str(tmp_path / "cache")
+    worker, other_worker = MmapBackend(path, 4096), MmapBackend(path, 4096)
+    worker.set(digest("a"), b"a" * 1000, ttl=60)
+    assert other_worker.get(digest("a")) == b"a" * 1000
+    assert other_worker.get(digest("b")) is None
+
+    for key in "bcde":
+        other_worker.set(digest(key), key.encode() * 1000, ttl=60)
+    # the ring buffer wrapped, the oldest values are overwritten
+    assert worker.get(digest("a")) is None
+    assert worker.get(digest("e")) == b"e" * 1000
+
+    other_worker.clear()
+    assert worker.get(digest("e")) is None
+
+
+def test_tiered_cache_shares_values_over_resp():
+    port, store = resp_server()
+    worker = TieredCache(Cache(10, 60), RedisBackend("127.0.0.1", port), "pages")
+    other_worker = TieredCache(Cache(10, 60), RedisBackend("127.0.0.1", port), "pages")
+
+    worker.set(("page", "token"), {"headers": [1, 2, 3]})
+    assert other_worker.get(("page", "token")) == {"headers": [1, 2, 3]}
+    assert other_worker.hits == 1
+
+    worker.clear()
+    time.sleep(1.1)
+    assert other_worker.get(("page", "token")) == {"headers": [1, 2, 3]}  # local
+    other_worker.local.clear()
+    assert other_worker.get(("page", "token")) is None
+
+
+def test_tiered_cache_falls_back_to_local_cache():
+    unused = socket.create_server(("127.0.0.1", 0))
+    port = unused.getsockname()[1]
+    unused.close()
+    cache = StaleCache(max_size=10, ttl=60)
+    cache.cache = TieredCache(
+        cache.cache, RedisBackend("127.0.0.1", port, timeout=0.1), "responses"
+    )
+
+    assert cache.get("key", lambda: "value") == "value"
+    assert cache.get("key", lambda: "other") == "value"
+    assert not cache.cache.available
+    assert cache.cache.errors == 1
+
+
+def test_shared_values_are_not_pickled():
+    record = RecordType(
+        header=HeaderType(identifier="a", datestamp="2012-01-01", set_spec=["x"]),
+        metadata=MetadataType(other_element=etree.fromstring("<dc>a</dc>")),
+    )
+    page = ({"list_records": ListRecordsType(record=[record])}, None)
+    value = loads(dumps(page))
+    assert value[0]["list_records"].record[0].header == record.header
+    element = value[0]["list_records"].record[0].metadata.other_element
+    assert etree.tostring(element) == b"<dc>a</dc>"
+    token = ResumptionToken({"metadataPrefix": "oai_dc"}, 10, after=("2012", "a"))
+    assert loads(dumps(token)) == token
+
+    port, store = resp_server()
+    cache = TieredCache(Cache(10, 60), RedisBackend("127.0.0.1", port), "pages")
+    cache.set("key", "value")
+    [key] = [
+        key for key in store if key.endswith(digest(("pages", "key")).hex().encode())
+    ]
+    store[key] = pickle.dumps(os.getpid)
+    cache.local.clear()
+    assert cache.get("key") is None
+    assert cache.misses == 1
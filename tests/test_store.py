@@ -0,0 +1,224 @@
+import threading
+from datetime import date
+
+from fastapi.testclient import TestClient
+from conftest import LV
+from rdflib import Graph, Literal, URIRef
+from rdflib.namespace import DC, RDF, XSD
+from rdflib.compare import isomorphic
+from rdflib.plugins.stores.sparqlstore import SPARQLStore
+
+from wapmh import repository
+from wapmh.cache import Cache
+from wapmh.store import (
+    SparqlMetadataStore,
+    StoreBackendException,
+    encoded_size,
+    header_key,
+    prepare,
+)
+
+
+def test_partitioned_identifiers_match_single_query(archive_store, executed_queries):
+    # a page on the boundary of two sub-ranges is selected by both
+    page = URIRef("https://d-nb.info/2999999999")
+    archive_store.graph.add((page, RDF.type, LV.ArchivedWebPage))
+    archive_store.graph.add((page, DC.identifier, Literal("2999999999")))
+    archive_store.graph.add(
+        (page, DC.date, Literal("2012-01-08T00:00:00Z", datatype=XSD.dateTime))
+    )
+    dates = {"from": "2012-01-01", "until": "2012-01-26"}
+    expected = sorted(archive_store.identifiers(**dates), key=header_key)
+    assert len(expected) == 26
+
+    archive_store.partition_workers = 4
+    executed = executed_queries(archive_store)
+    headers = list(archive_store.identifiers(**dates))
+    ranges = [(str(b.get("from")), str(b.get("until"))) for _, b in executed]
+    # the sub-ranges are queried concurrently
+    assert sorted(ranges) == [
+        ("2012-01-01", "2012-01-08"),
+        ("2012-01-08", "2012-01-15"),
+        ("2012-01-15", "2012-01-22"),
+        ("2012-01-22", "2012-01-26"),
+    ]
+    assert [h["identifier"] for h in headers] == [h["identifier"] for h in expected]
+
+    # the number of sub-ranges follows from the observed rows per day, it counts
+    # the page on the boundary twice
+    assert archive_store.rows_per_day == 27 / 25
+    archive_store.partition_rows = 5
+    executed.clear()
+    headers = list(archive_store.identifiers(**dates))
+    # 27 rows in 5 row sub-ranges of whole days, i.e. 5 days each
+    assert len(executed) == 5
+    assert [h["identifier"] for h in headers] == [h["identifier"] for h in expected]
+
+
+def test_partition_is_split_on_backend_failure(archive_store, executed_queries):
+    dates = {"from": "2012-01-01", "until": "2012-01-26"}
+    expected = sorted(archive_store.identifiers(**dates), key=header_key)
+    archive_store.partition_workers = 1
+
+    def fail(name, bindings):
+        days = (
+            date.fromisoformat(str(bindings["until"]))
+            - date.fromisoformat(str(bindings["from"]))
+        ).days
+        if days > 10:
+            raise StoreBackendException("Timeout")
+
+    executed = executed_queries(archive_store, fail)
+    headers = list(archive_store.identifiers(**dates))
+    # 25 days are split into 12 and 13 days, then into 6, 6, 6 and 7 days
+    assert len(executed) == 7
+    assert [h["identifier"] for h in headers] == [h["identifier"] for h in expected]
+
+
+def test_parsed_queries_are_not_shared_by_threads():
+    query = {"query_object": "select ?s { ?s ?p ?o }"}
+    parsed = prepare(query)["query_object"]
+    assert prepare(query)["query_object"] is parsed
+    other = []
+    thread = threading.Thread(target=lambda: other.append(prepare(query)))
+    thread.start()
+    thread.join()
+    assert other[0]["query_object"] is not parsed
+
+
+def test_query_statistics(archive_store):
+    list(archive_store.records(identifier="2000000003"))
+    top = archive_store.statistics.top()
+    names = [stats["name"] for stats in top]
+    assert "identifiedHeaderSelect" in names and "recordConstruct" in names
+    construct = top[names.index("recordConstruct")]
+    assert construct["count"] == 1 and construct["rows"] > 0 and construct["bytes"] > 0
+    assert construct["slowest_bindings"] == {"identifier": "2000000003"}
+    assert "BGP" in archive_store.explain("recordConstruct")
+
+
+def test_query_statistics_are_for_admins(archive_store, monkeypatch):
+    monkeypatch.setattr(repository.get_settings(), "admin_token", "secret")
+    monkeypatch.setattr(repository, "get_metadata_store", lambda: archive_store)
+    monkeypatch.setattr(repository, "get_store_reloader", lambda: None)
+    monkeypatch.setattr(repository, "get_change_tracker", lambda: None)
+    monkeypatch.setattr(
+        repository, "get_query_statistics", lambda: archive_store.statistics
+    )
+    list(archive_store.records(identifier="2000000003"))
+
+    with TestClient(repository.app) as client:
+        assert client.get("/queries").status_code == 401
+        response = client.get("/queries", headers={"Authorization": "Bearer secret"})
+    plans = {stats["name"]: stats["plan"] for stats in response.json()}
+    assert "BGP" in plans["recordConstruct"]
+
+
+def test_lookup_matches_single_records(archive_store):
+    identifiers = ["2000000007", "unknown", "2000000003", "2000000024"]
+    records = list(archive_store.lookup(identifiers, batch_size=2))
+    assert [str(r["identifier"]) for r in records] == [
+        "2000000007",
+        "2000000003",
+        "2000000024",
+    ]
+    for record in records:
+        single = next(archive_store.records(identifier=str(record["identifier"])))
+        assert isomorphic(record["metadata"], single["metadata"])
+        assert record["setSpec"] == single["setSpec"]
+
+
+def test_result_cache_reuses_backend_answers(archive_store, executed_queries):
+    expected_headers = list(archive_store.identifiers())
+    expected_record = archive_store.metadata("2000000003")
+    archive_store.result_cache = Cache(1024 * 1024, 60, encoded_size)
+    executed = executed_queries(archive_store)
+    for _ in range(2):
+        headers = list(archive_store.identifiers())
+        record = archive_store.metadata("2000000003")
+        assert headers == expected_headers
+        assert isomorphic(record, expected_record)
+    assert [name for name, _ in executed] == ["allHeadersSelect", "recordConstruct"]
+    # every hit is a new graph, changes of callers do not affect the cache
+    record.remove((None, None, None))
+    assert isomorphic(archive_store.metadata("2000000003"), expected_record)
+    stats = {s["name"]: s for s in archive_store.statistics.top()}
+    assert stats["recordConstruct"]["cache_hits"] == 2
+
+    archive_store.apply_changes([])
+    list(archive_store.identifiers())
+    assert executed[-1][0] == "allHeadersSelect"
+
+
+def test_work_cache_assembles_the_same_records(archive_store, executed_queries):
+    identifiers = ["2000000003", "2000000007", "2000000024"]
+    expected = {i: archive_store.metadata(i) for i in identifiers}
+    expected_lookup = list(archive_store.lookup(identifiers))
+    archive_store.work_cache = Cache(1000, 60, lambda triples: len(triples) + 1)
+    queries = executed_queries(archive_store)
+    for identifier in identifiers:
+        assert isomorphic(archive_store.metadata(identifier), expected[identifier])
+    executed = [name for name, _ in queries]
+    assert executed.count("recordPageConstruct") == 3
+    assert executed.count("workConstruct") == 1
+    assert "recordConstruct" not in executed
+
+    archive_store.work_cache.clear()
+    records = list(archive_store.lookup(identifiers))
+    for record, expected_record in zip(records, expected_lookup, strict=True):
+        assert isomorphic(record["metadata"], expected_record["metadata"])
+
+    # the records of a page are queried at once
+    archive_store.work_cache.clear()
+    del queries[:]
+    headers = list(archive_store.identifiers(offset=0, limit=10))
+    records = list(archive_store.records(headers=headers))
+    assert [r["identifier"] for r in records] == [h["identifier"] for h in headers]
+    for record in records:
+        assert isomorphic(
+            record["metadata"], archive_store.metadata(record["identifier"])
+        )
+    assert [name for name, _ in queries[:3]] == [
+        "pagedHeadersSelect",
+        "recordPageConstruct",
+        "workConstruct",
+    ]
+
+
+class LocalSPARQLStore(SPARQLStore):
+    """A SPARQLStore that answers the query strings it gets from a local graph."""
+
+    def __init__(self, graph: Graph):
+        super().__init__()
+        self.local = graph
+        self.received = []
+
+    def query(self, query, initNs=None, initBindings=None, queryGraph=None, **kwargs):
+        self.received.append((query, initBindings))
+        return self.local.query(query, initNs=initNs)
+
+
+def test_remote_queries_are_sent_with_their_bindings(archive_store):
+    remote = LocalSPARQLStore(archive_store.graph)
+    store = SparqlMetadataStore(
+        graph=Graph(store=remote), queries=archive_store.queries, set_queries=[]
+    )
+
+    for kwargs in [
+        {"identifier": "2000000003"},
+        {"from": "2012-01-05", "until": "2012-01-09"},
+        {
+            "from": "2012-01-05",
+            "after": ("2012-01-10T02:00:00", "2000000009"),
+            "limit": 3,
+        },
+    ]:
+        headers = list(store.identifiers(**kwargs))
+        expected = list(archive_store.identifiers(**kwargs))
+        assert headers and [str(h["identifier"]) for h in headers] == [
+            str(h["identifier"]) for h in expected
+        ]
+    # the endpoint gets plain query strings, rdflib does not evaluate them itself
+    assert len(remote.received) == 3
+    assert all(isinstance(q, str) and not b for q, b in remote.received)
+    assert "VALUES (?identifier)" in remote.received[0][0]
@@ -0,0 +1,66 @@
+import json
+import zlib
+
+from fastapi.testclient import TestClient
+from rdflib import Graph
+from rdflib.compare import isomorphic
+
+from wapmh import repository, streaming
+from wapmh.model.oai_pmh import HeaderType, OaiPmherrorcodeType, RecordType
+
+
+def test_streamed_elements():
+    record = RecordType(header=HeaderType(identifier="a", datestamp="2012-01-01"))
+    xml = streaming.record(record)
+    assert xml.startswith("<record ") and "<identifier>a</identifier>" in xml
+    xml = streaming.error("b", OaiPmherrorcodeType.ID_DOES_NOT_EXIST)
+    assert 'code="idDoesNotExist">b</error>' in xml
+
+
+def test_ndjson_records(archive_store):
+    record = next(archive_store.records(identifier="2000000003"))
+
+    line = json.loads(streaming.ndjson_record(record, "jsonld", "http://ctx"))
+    assert line["identifier"] == "2000000003"
+    metadata = line.pop("metadata")
+    assert metadata["@context"] == "http://ctx"
+    metadata["@context"] = streaming.EXPORT_CONTEXT
+    graph = Graph().parse(data=json.dumps(metadata), format="json-ld")
+    assert isomorphic(graph, record["metadata"])
+
+    line = json.loads(streaming.ndjson_record(record, "ntriples", "http://ctx"))
+    graph = Graph().parse(data=line["metadata"], format="nt")
+    assert isomorphic(graph, record["metadata"])
+
+
+def test_gzip_stream_chunks_are_readable_on_arrival():
+    stream = streaming.GzipStream()
+    decompressor = zlib.decompressobj(wbits=31)
+    assert decompressor.decompress(stream.chunk("a\n")) == b"a\n"
+    assert decompressor.decompress(stream.chunk("b\n")) == b"b\n"
+    data = stream.end()
+    decompressor.decompress(data)
+    assert decompressor.eof
+
+
+def test_export_pages_continue_after_the_last_record(
+    archive_store, executed_queries, monkeypatch
+):
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "export_page_size", 10)
+    monkeypatch.setattr(repository, "get_metadata_store", lambda: archive_store)
+    monkeypatch.setattr(repository, "get_store_reloader", lambda: None)
+    monkeypatch.setattr(repository, "get_change_tracker", lambda: None)
+    executed = executed_queries(archive_store)
+
+    with TestClient(repository.app) as client:
+        response = client.get("/export", params={"format": "ntriples"})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 25
+    assert [line["identifier"] for line in lines] == sorted(
+        line["identifier"] for line in lines
+    )
+    pages = [bindings for name, bindings in executed if name == "pagedHeadersSelect"]
+    assert len(pages) == 3
+    assert all(bindings["limit"] == 10 for bindings in pages)
+    assert str(pages[-1]["afterIdentifier"]) == lines[19]["identifier"]
@@ -0,0 +1,67 @@
+import asyncio
+import gzip
+import time
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+
+from wapmh import repository
+from wapmh.warmup import Warmer, frequent_requests, seconds_until
+
+LOG = """\
+INFO:     127.0.0.1:50312 - "GET /?verb=Identify HTTP/1.1" 200 OK
+INFO:     127.0.0.1:50312 - "GET /?verb=GetRecord&identifier=123 HTTP/1.1" 200 OK
+INFO:     127.0.0.1:50312 - "GET /?verb=GetRecord&identifier=123 HTTP/1.1" 200 OK
+INFO:     127.0.0.1:50312 - "GET /?verb=ListRecords&resumptionToken=abc HTTP/1.1" 200 OK
+INFO:     127.0.0.1:50312 - "GET /queries HTTP/1.1" 200 OK
+"""
+
+
+def test_frequent_requests(tmp_path):
+    (tmp_path / "access.log").write_text(LOG)
+    with gzip.open(tmp_path / "access.log.1.gz", "wt") as log:
+        log.write(LOG)
+
+    requests = frequent_requests([str(tmp_path / "access.log*")], count=10)
+    assert requests == [
+        {"verb": "GetRecord", "identifier": "123"},
+        {"verb": "Identify"},
+    ]
+    assert frequent_requests([str(tmp_path / "access.log")], count=1) == [
+        {"verb": "GetRecord", "identifier": "123"}
+    ]
+
+
+def test_seconds_until():
+    now = datetime(2025, 1, 1, 12, 0)
+    assert seconds_until([], now) is None
+    assert seconds_until(["13:30", "06:00"], now) == 5400
+    assert seconds_until(["06:00"], now) == 18 * 3600
+
+
+def test_warmer_replays_at_rate(tmp_path):
+    (tmp_path / "access.log").write_text(LOG)
+    replayed = []
+
+    async def replay(params):
+        replayed.append((time.monotonic(), params))
+        return 200 if params["verb"] == "GetRecord" else 500
+
+    warmer = Warmer(replay, [str(tmp_path / "access.log")], rate=20)
+    summary = asyncio.run(warmer.warm())
+    assert summary["requests"] == 2
+    assert summary["failed"] == 1
+    assert [params["verb"] for _, params in replayed] == ["GetRecord", "Identify"]
+    assert replayed[1][0] - replayed[0][0] >= 0.05
+
+
+def test_warmup_requires_the_admin_token(monkeypatch):
+    settings = repository.get_settings()
+    monkeypatch.setattr(settings, "admin_token", "secret")
+    monkeypatch.setattr(repository, "get_warmer", lambda: None)
+    client = TestClient(repository.app)
+    assert client.post("/warmup").status_code == 401
+    response = client.post("/warmup", headers={"Authorization": "Bearer secret"})
+    # the token is accepted, there are just no logs to replay
+    assert response.status_code == 404
+    assert "WARMUP_LOGS" in response.text
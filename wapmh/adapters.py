@@ -1,6 +1,6 @@
 import dataclasses
 from abc import abstractmethod
-from typing import Any
+from typing import Any, Iterable
 
 from dcxml import simpledc
 from fastapi import Request
@@ -9,13 +9,15 @@ from rdflib.namespace import DC
 from rdflib.resource import Resource
 from xsdata.formats.dataclass.etree import etree
 
+from . import profiling
+from .cancellation import check
 from .model.oai_pmh import (
     HeaderType,
     MetadataType,
     RecordType,
     RequestType,
 )
-from .store import MetadataStore
+from .store import MetadataStore, prepare
 
 
 class RequestAdapter:
@@ -42,10 +44,28 @@ class RequestAdapter:
             value=str(request.base_url),
         )
 
+    @classmethod
+    def key(cls, query_params: dict) -> tuple:
+        """Get a hashable key for the request parameters.
+
+        Requests with the same key are equivalent, parameters that are not part of the
+        OAI-PMH RequestType are ignored and the order of the parameters does not matter.
+        """
+        return tuple(
+            sorted(
+                (key, value) for key, value in query_params.items() if key in cls.fields
+            )
+        )
+
+
+class SerializedMetadata(dict):
+    """Metadata that is already converted, maps a metadataPrefix to the XML bytes."""
+
 
 class MetadataAdapter:
-    def __init__(self, store):
+    def __init__(self, store, metadataPrefix: str = None):
         self.store = store
+        self.metadataPrefix = metadataPrefix
 
     def record(self, **kwargs) -> RecordType:
         """Get a single record according to the metadataPrefix."""
@@ -54,17 +74,35 @@ class MetadataAdapter:
 
     def records(self, **kwargs) -> list[RecordType]:
         """Get records according to the metadataPrefix."""
-        for rec in self.store.records(**kwargs):
-            yield RecordType(
-                header=HeaderType(
-                    identifier=rec.get("identifier"),
-                    datestamp=rec.get("datestamp"),
-                    set_spec=[],
-                ),
-                metadata=self.metadata(
-                    rec.get("metadata"), identifier=rec.get("identifier")
-                ),
-            )
+        return self._convert(self.store.records(**kwargs))
+
+    def lookup(self, identifiers: list[str]) -> list[RecordType]:
+        """Get the records of the identifiers, unknown identifiers are skipped."""
+        return self._convert(self.store.lookup(identifiers))
+
+    def _convert(self, recs: Iterable[dict]) -> Iterable[RecordType]:
+        for rec in profiling.stages(recs, "store"):
+            check()
+            with profiling.stage("convert"):
+                record = RecordType(
+                    header=HeaderType(
+                        identifier=rec.get("identifier"),
+                        datestamp=rec.get("datestamp"),
+                        set_spec=rec.get("setSpec", []),
+                    ),
+                    metadata=self.convert(
+                        rec.get("metadata"), identifier=rec.get("identifier")
+                    ),
+                )
+            yield record
+
+    def convert(self, metadata: Any, identifier: str) -> MetadataType:
+        """Convert the metadata, unless the store provides it already serialized."""
+        if isinstance(metadata, SerializedMetadata):
+            if xml := metadata.get(self.metadataPrefix):
+                return MetadataType(other_element=etree.fromstring(xml))
+            return None
+        return self.metadata(metadata, identifier=identifier)
 
     @abstractmethod
     def metadata(self, metadata: Any, identifier: str) -> MetadataType:
@@ -92,7 +130,7 @@ class OaiDcMetadataAdapter(MetadataAdapter):
         conversion_query = self.store.queries.get("recordOaiDcConstruct").p(
             identifier=Literal(identifier)
         )
-        dc_metadata = metadata.query(**conversion_query).graph
+        dc_metadata = metadata.query(**prepare(conversion_query)).graph
 
         if subject := next(dc_metadata.subjects(), None):
             res = dc_metadata.resource(subject)
@@ -129,6 +167,14 @@ class OaiDcMetadataAdapter(MetadataAdapter):
             return MetadataType(other_element=dc_elements)
 
 
+def record_size(record: RecordType) -> int:
+    """Estimate the size of a serialized record in bytes."""
+    size = 256  # the envelope and the header
+    if record.metadata is not None and record.metadata.other_element is not None:
+        size += len(etree.tostring(record.metadata.other_element))
+    return size
+
+
 class MetadataAdapterRegistry:
     def __init__(self):
         self.registry = {}
@@ -137,7 +183,7 @@ class MetadataAdapterRegistry:
         self.registry[metadataPrefix] = adapterClass
 
     def adapter(self, store: MetadataStore, metadataPrefix) -> MetadataAdapter:
-        return self.registry[metadataPrefix](store)
+        return self.registry[metadataPrefix](store, metadataPrefix)
 
     def listPrefixes(self) -> list[str]:
         return self.registry
@@ -0,0 +1,134 @@
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+
+EXPENSIVE_VERBS = ["ListIdentifiers", "ListRecords"]
+"""Verbs that run through the bounded lane for expensive requests."""
+
+
+class AdmissionRejected(Exception):
+    """Raised if a request is not admitted, `retry_after` is the suggested delay."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """A token bucket that is refilled with `rate` tokens per second up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Take a token and return 0 or return the seconds until a token is available."""
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Lane:
+    """A lane of requests with a bounded concurrency and a bounded waiting queue."""
+
+    def __init__(self, name: str, concurrency: int, queue_size: int, timeout: float):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.semaphore.locked() and self.waiting >= self.queue_size:
+            raise AdmissionRejected(
+                f"Too many waiting requests in the {self.name} lane.",
+                retry_after=math.ceil(self.timeout) or 1,
+            )
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+        except TimeoutError:
+            raise AdmissionRejected(
+                f"Timed out waiting in the {self.name} lane.",
+                retry_after=math.ceil(self.timeout) or 1,
+            )
+        finally:
+            self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.semaphore.release()
+
+
+class AdmissionController:
+    """Decide which requests are admitted to the metadata store.
+
+    Every client has a token bucket that limits its request rate.
+    Expensive verbs (ListIdentifiers and ListRecords) share a lane with a small bounded
+    concurrency, all other verbs use a separate fast lane, so cheap requests like
+    GetRecord or Identify are not queued behind long running harvests.
+    If a lane is saturated, requests wait in a bounded queue; if the queue overflows or
+    the waiting time exceeds the timeout, the request is rejected.
+    """
+
+    max_clients = 10000
+    """Maximum number of token buckets that are kept for clients."""
+
+    def __init__(
+        self,
+        list_concurrency: int = 4,
+        fast_concurrency: int = 16,
+        queue_size: int = 32,
+        queue_timeout: float = 30,
+        client_rate: float = 0,
+        client_burst: int = 10,
+    ):
+        self.list_lane = Lane("list", list_concurrency, queue_size, queue_timeout)
+        self.fast_lane = Lane("fast", fast_concurrency, queue_size, queue_timeout)
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.buckets = {}
+
+    def lane(self, verb: str) -> Lane:
+        if verb in EXPENSIVE_VERBS:
+            return self.list_lane
+        return self.fast_lane
+
+    def check_rate(self, client: str):
+        """Take a token from the client's bucket or raise AdmissionRejected."""
+        if not self.client_rate:
+            return
+        if client not in self.buckets and len(self.buckets) >= self.max_clients:
+            self.prune()
+        bucket = self.buckets.setdefault(
+            client, TokenBucket(self.client_rate, self.client_burst)
+        )
+        if wait := bucket.take():
+            raise AdmissionRejected(
+                "Request rate limit exceeded.", retry_after=math.ceil(wait)
+            )
+
+    def prune(self):
+        """Forget the buckets of clients that are idle, i.e. their bucket is full."""
+        for client, bucket in list(self.buckets.items()):
+            bucket.refill()
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[client]
+
+    @asynccontextmanager
+    async def admit(self, verb: str, client: str):
+        """Wait for a slot for the request or raise AdmissionRejected."""
+        self.check_rate(client)
+        async with self.lane(verb).slot():
+            yield
@@ -0,0 +1,224 @@
+"""Benchmarks of the repository, running as separate server processes or in process."""
+
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from query_collection import TemplateQueryCollection
+from rdflib import Graph, Literal, Namespace, URIRef
+from rdflib.namespace import DC, DCTERMS, FOAF, RDF, XSD
+
+from . import profiling
+from .serve import memory_usage
+
+VERBS = ["Identify", "ListIdentifiers", "ListRecords", "ListSets"]
+
+
+def worker_pids(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as children:
+        pids = [int(child) for child in children.read().split()]
+    # uvicorn starts the multiprocessing resource tracker next to the workers
+    return [pid for pid in pids if b"resource_tracker" not in cmdline(pid)]
+
+
+def cmdline(pid: int) -> bytes:
+    with open(f"/proc/{pid}/cmdline", "rb") as cmdline:
+        return cmdline.read()
+
+
+def wait_until_ready(url: str, timeout: float = 600):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(f"{url}/?verb=Identify").read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+def memory(workers: int = 4, requests: int = 200, shared: bool = True, port=8765):
+    """Start a server with `workers` workers, send requests and report their memory.
+
+    With `shared` the workers are forked after loading the store (see wapmh.serve),
+    otherwise every uvicorn worker loads its own store.
+    """
+    if shared:
+        command = ["-m", "wapmh.serve", "--workers", str(workers)]
+    else:
+        command = ["-m", "uvicorn", "wapmh.repository:app", "--workers", str(workers)]
+    server = subprocess.Popen([sys.executable, *command, "--port", str(port)])
+    url = f"http://127.0.0.1:{port}"
+    try:
+        wait_until_ready(url)
+
+        def request(i: int):
+            try:
+                urllib.request.urlopen(f"{url}/?verb={VERBS[i % len(VERBS)]}").read()
+            except OSError as e:
+                logger.warning(f"Request failed: {e}")
+
+        with ThreadPoolExecutor(max_workers=workers * 2) as executor:
+            list(executor.map(request, range(requests)))
+
+        usages = [memory_usage(pid) for pid in worker_pids(server.pid)]
+        for i, usage in enumerate(usages):
+            print(
+                f"worker {i}: rss {usage['rss']} kB, pss {usage['pss']} kB, "
+                f"shared {usage['shared']} kB, private {usage['private']} kB"
+            )
+        print(
+            f"{'shared' if shared else 'independent'} store, {workers} workers: "
+            f"total rss {sum(u['rss'] for u in usages)} kB, "
+            f"total pss {sum(u['pss'] for u in usages)} kB"
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+BIBO = Namespace("http://purl.org/ontology/bibo/")
+LV = Namespace("http://purl.org/lobid/lv#")
+CARRIER = URIRef("http://rdaregistry.info/termList/RDACarrierType/1018")
+
+
+def synthetic_graph(records: int, websites: int = 10) -> Graph:
+    """Create a graph with `records` archived web pages of `websites` websites."""
+    graph = Graph()
+    for w in range(websites):
+        work = URIRef(f"https://d-nb.info/1{w:09d}")
+        graph.add((work, DC.identifier, Literal(f"(DE-101)1{w:09d}")))
+        graph.add((work, DC.title, Literal(f"Website {w}")))
+        graph.add((work, DCTERMS.medium, CARRIER))
+        graph.add((work, RDF.type, BIBO.Website))
+        graph.add((work, FOAF.primaryTopic, URIRef(f"https://example{w}.org/")))
+    for i in range(records):
+        page = URIRef(f"https://d-nb.info/2{i:09d}")
+        day = f"{2000 + i // 336}-{1 + i // 28 % 12:02d}-{1 + i % 28:02d}"
+        graph.add((page, RDF.type, LV.ArchivedWebPage))
+        graph.add((page, DC.identifier, Literal(f"2{i:09d}")))
+        graph.add((page, DC.date, Literal(f"{day}T02:00:00Z", datatype=XSD.dateTime)))
+        graph.add((page, BIBO.issue, Literal(day)))
+        graph.add(
+            (page, DCTERMS.isPartOf, URIRef(f"https://d-nb.info/1{i % websites:09d}"))
+        )
+        graph.add((page, DCTERMS.medium, CARRIER))
+        graph.add(
+            (page, FOAF.primaryTopic, URIRef(f"https://example{i % websites}.org/"))
+        )
+    return graph
+
+
+def allocations(
+    datasets: list[int],
+    verb: str = "ListRecords",
+    metadata_prefix: str = "oai_dc",
+    page_size: int = 100,
+    pages: int = 5,
+    max_peak_per_page: int = 0,
+) -> bool:
+    """Measure the peak memory allocated per page of a list verb, one page at a time.
+
+    datasets: the numbers of records of the synthetic datasets.
+    max_peak_per_page: the allowed peak in bytes, 0 to not check it.
+    Returns False if the peak of any page exceeds `max_peak_per_page`.
+    """
+    os.environ["LIMIT"] = str(page_size)
+    from . import repository
+
+    repository.get_settings.cache_clear()
+    settings = repository.get_settings()
+    page_function = {
+        "ListIdentifiers": repository.identifiers_page,
+        "ListRecords": repository.records_page,
+    }[verb]
+    profiler = profiling.MemoryProfiler()
+    profiler.start()
+    passed = True
+    try:
+        for records in datasets:
+            graph = synthetic_graph(records)
+            queries = TemplateQueryCollection(initNs=dict(graph.namespaces()))
+            queries.loadFromDirectory(settings.query_path)
+            store = repository.SparqlMetadataStore(graph=graph, queries=queries)
+            token = repository.ResumptionToken.start(metadataPrefix=metadata_prefix)
+            # the first page prepares the queries, that is not measured
+            page_function(store, token)
+            peaks = []
+            for _ in range(pages):
+                with profiler.request(verb) as profile:
+                    response, next_token = page_function(store, token)
+                    with profiling.stage("serialize"):
+                        repository.XmlAppResponse(repository.OaiPmh(**response))
+                peaks.append(profile.peak)
+                stages = ", ".join(f"{n} {s.peak}" for n, s in profile.stages.items())
+                print(
+                    f"{records} records, cursor {token.cursor}: peak {profile.peak} B ({stages})"
+                )
+                if not (token := next_token):
+                    break
+            exceeded = max_peak_per_page and max(peaks) > max_peak_per_page
+            passed = passed and not exceeded
+            print(
+                f"{records} records: max peak per page {max(peaks)} B, "
+                f"{max(peaks) // page_size} B per record"
+                + (f", exceeds {max_peak_per_page} B" if exceeded else "")
+            )
+    finally:
+        profiler.stop()
+    return passed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    memory_parser = subparsers.add_parser(
+        "memory", help="memory usage per worker for N workers"
+    )
+    memory_parser.add_argument("--workers", type=int, default=4)
+    memory_parser.add_argument("--requests", type=int, default=200)
+    memory_parser.add_argument(
+        "--independent",
+        action="store_true",
+        help="let every worker load its own store instead of forking after loading",
+    )
+    allocations_parser = subparsers.add_parser(
+        "allocations", help="peak memory allocated per page over synthetic datasets"
+    )
+    allocations_parser.add_argument(
+        "--records", type=int, nargs="+", default=[1000, 10000]
+    )
+    allocations_parser.add_argument(
+        "--verb", choices=["ListIdentifiers", "ListRecords"], default="ListRecords"
+    )
+    allocations_parser.add_argument("--metadata-prefix", default="oai_dc")
+    allocations_parser.add_argument("--page-size", type=int, default=100)
+    allocations_parser.add_argument("--pages", type=int, default=5)
+    allocations_parser.add_argument(
+        "--max-peak-per-page",
+        type=int,
+        default=0,
+        help="fail if a page allocates more bytes at its peak",
+    )
+    args = parser.parse_args()
+    if args.benchmark == "memory":
+        memory(
+            workers=args.workers, requests=args.requests, shared=not args.independent
+        )
+    elif args.benchmark == "allocations":
+        passed = allocations(
+            datasets=args.records,
+            verb=args.verb,
+            metadata_prefix=args.metadata_prefix,
+            page_size=args.page_size,
+            pages=args.pages,
+            max_peak_per_page=args.max_peak_per_page,
+        )
+        sys.exit(0 if passed else 1)
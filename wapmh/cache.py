@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable
+
+from loguru import logger
+
+from .concurrency import SingleFlight
+
+
+class Cache:
+    """A thread safe LRU cache whose entries expire after `ttl` seconds.
+
+    The cache is bounded by the sum of the sizes of its entries, the size of a value is
+    determined by `sizeof`. If `max_size` is exceeded the least recently used entries
+    are evicted.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        sizeof: Callable[[Any], int] = lambda value: 1,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, size, expires = entry
+            if expires < time.monotonic():
+                self._remove(key)
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.size += size
+            while self.size > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size, expires = self._remove(key)
+            if expires < time.monotonic():
+                return default
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[2] >= time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: Hashable) -> tuple:
+        entry = self._entries.pop(key)
+        self.size -= entry[1]
+        return entry
+
+
+class StaleCache:
+    """A cache that serves stale values while they are refreshed or if refreshing fails.
+
+    A value is fresh for `ttl` seconds. Up to `stale_while_revalidate` seconds after
+    that, it is returned immediately and recomputed in the background. If computing a
+    value fails, a value up to `stale_if_error` seconds past its ttl is returned
+    instead of the error.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        stale_while_revalidate: float = 0,
+        stale_if_error: float = 0,
+        workers: int = 2,
+    ):
+        self.ttl = ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.stale_if_error = stale_if_error
+        self.cache = Cache(max_size, ttl + max(stale_while_revalidate, stale_if_error))
+        self.flight = SingleFlight()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Get the value for `key`, `compute` is called if it is missing or stale."""
+        entry = self.cache.get(key)
+        age = None
+        if entry is not None:
+            value, created = entry
+            age = time.time() - created
+            if age < self.ttl:
+                return value
+            if age < self.ttl + self.stale_while_revalidate:
+                self._refresh(key, compute)
+                return value
+        try:
+            return self.flight.do(key, lambda: self._compute(key, compute))
+        except Exception as e:
+            if age is not None and age < self.ttl + self.stale_if_error:
+                logger.warning(f"Serving a stale value, computing it failed: {e}")
+                return value
+            raise
+
+    def _compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        value = compute()
+        # wall clock time, the value may be shared with other hosts
+        self.cache.set(key, (value, time.time()))
+        return value
+
+    def _refresh(self, key: Hashable, compute: Callable[[], Any]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self.flight.do(key, lambda: self._compute(key, compute))
+            except Exception as e:
+                logger.warning(f"Refreshing a stale value failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self.executor.submit(refresh)
+
+    def clear(self):
+        self.cache.clear()
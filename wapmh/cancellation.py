@@ -0,0 +1,176 @@
+import copy
+import socket
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.client import HTTPConnection, HTTPSConnection
+from io import BytesIO
+from typing import Callable
+from urllib.parse import urlencode, urlsplit
+
+from rdflib import BNode
+from rdflib.plugins.stores.sparqlstore import SPARQLStore
+from rdflib.query import Result
+
+
+class Cancelled(Exception):
+    """The work was cancelled, e.g. because the harvester disconnected."""
+
+
+class EndpointError(ValueError):
+    """The SPARQL endpoint answered with an error status."""
+
+    def __init__(self, status: int):
+        super().__init__(f"SPARQL endpoint answered with status {status}")
+        self.status = status
+
+
+class CancellationToken:
+    """Signal the cancellation of a request to the work done for it."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the work and call the registered callbacks, e.g. to abort requests."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled()
+
+    def add_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+current = ContextVar("cancellation", default=None)
+"""The token of the request that is currently processed."""
+
+
+def check():
+    """Raise Cancelled if the current request was cancelled."""
+    if (token := current.get()) is not None:
+        token.check()
+
+
+@contextmanager
+def on_cancel(callback: Callable[[], None]):
+    """Call `callback` if the current request is cancelled while in the context."""
+    token = current.get()
+    if token is None:
+        yield
+        return
+    token.add_callback(callback)
+    try:
+        yield
+    finally:
+        token.remove_callback(callback)
+
+
+def propagate(fn: Callable, token: CancellationToken = None) -> Callable:
+    """Wrap `fn` to run with the current token, e.g. in the thread of an executor.
+
+    token: run with this token instead, e.g. to cancel only this part of the work.
+    """
+    if token is None:
+        token = current.get()
+
+    def wrapper(*args, **kwargs):
+        reset = current.set(token)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current.reset(reset)
+
+    return wrapper
+
+
+class AbandonedWork:
+    """Count the work that was abandoned due to cancellation."""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self._lock = threading.Lock()
+
+    def count(self, requests: int = 0, queries: int = 0):
+        with self._lock:
+            self.requests += requests
+            self.queries += queries
+
+    def as_dict(self) -> dict:
+        return {"requests": self.requests, "queries": self.queries}
+
+
+abandoned = AbandonedWork()
+
+
+class CancellableSPARQLStore(SPARQLStore):
+    """A SPARQLStore whose requests are aborted if the current request is cancelled.
+
+    The connection to the endpoint is shut down, so the endpoint can stop evaluating
+    the query. Only the GET method is supported, other methods are not cancellable.
+    """
+
+    def _query(self, query: str, default_graph: str = None, named_graph: str = None):
+        if self.method != "GET":
+            return super()._query(query, default_graph, named_graph)
+        check()
+        self._queries += 1
+
+        args = copy.deepcopy(self.kwargs)
+        params = {**args.get("params", {}), "query": query}
+        if default_graph is not None and not isinstance(default_graph, BNode):
+            params["default-graph-uri"] = default_graph
+        headers = {**args.get("headers", {}), "Accept": self.response_mime_types()}
+
+        url = urlsplit(self.query_endpoint)
+        connection_class = HTTPSConnection if url.scheme == "https" else HTTPConnection
+        connection = connection_class(url.netloc, timeout=args.get("timeout"))
+        path = f"{url.path or '/'}?{url.query + '&' if url.query else ''}"
+        path += urlencode(params)
+
+        def abort():
+            abandoned.count(queries=1)
+            if connection.sock is not None:
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        with on_cancel(abort):
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except Exception:
+                check()
+                raise
+            finally:
+                connection.close()
+        check()
+        if response.status >= 400:
+            raise EndpointError(response.status)
+        content_type = response.getheader("Content-Type", "").split(";")[0]
+        return Result.parse(BytesIO(body), content_type=content_type)
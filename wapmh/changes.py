@@ -0,0 +1,188 @@
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable
+
+from loguru import logger
+
+from .store import MetadataStore, header_key
+
+ADDED = "added"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+@dataclass(frozen=True)
+class Change:
+    """A change of a record as detected by the ChangeTracker."""
+
+    sequence: int
+    kind: str
+    identifier: str
+    datestamp: str
+    detected: float = field(default_factory=time.time)
+
+
+class ChangeTracker:
+    """Detect changed records by polling a store and notify subscribers.
+
+    The store is polled for the records with a datestamp since the day of the latest
+    datestamp seen so far (the high-water mark). Records with an unknown identifier are
+    added, records with a changed datestamp are updated.
+    Records that disappear can only be detected by a full scan, which is done every
+    `full_scan_every` polls; they are kept as tombstones, with the time of the
+    detection as datestamp.
+    The first poll is a full scan that only establishes the baseline.
+    """
+
+    def __init__(
+        self,
+        store: MetadataStore,
+        interval: float = 300,
+        full_scan_every: int = 24,
+        log_size: int = 100000,
+    ):
+        self.store = store
+        self.interval = interval
+        self.full_scan_every = full_scan_every
+        self.high_water_mark = None
+        self.known = {}
+        self.tombstones = {}
+        self.log = deque(maxlen=log_size)
+        self.sequence = 0
+        self.polls = 0
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback: Callable[[list[Change]], None]):
+        """Call `callback` with the list of changes of every poll that found some."""
+        self.subscribers.append(callback)
+
+    def poll(self) -> list[Change]:
+        """Poll the store once and notify the subscribers about the changes."""
+        with self._poll_lock:
+            return self._poll()
+
+    def _poll(self) -> list[Change]:
+        full_scan = self.high_water_mark is None or (
+            self.full_scan_every and self.polls % self.full_scan_every == 0
+        )
+        baseline = self.high_water_mark is None
+        # the store is scanned without the lock, so reading the tombstones does not
+        # wait for it
+        if full_scan:
+            headers = list(self.store.identifiers())
+        else:
+            since = self.high_water_mark[:10]
+            headers = list(self.store.identifiers(**{"from": since}))
+
+        with self._lock:
+            self.polls += 1
+            changes = []
+            seen = set()
+            for header in headers:
+                identifier = str(header["identifier"])
+                sort_key = header_key(header)[0]
+                seen.add(identifier)
+                previous = self.known.get(identifier)
+                if previous == sort_key:
+                    continue
+                self.known[identifier] = sort_key
+                self.tombstones.pop(identifier, None)
+                if self.high_water_mark is None or sort_key > self.high_water_mark:
+                    self.high_water_mark = sort_key
+                if not baseline:
+                    kind = ADDED if previous is None else UPDATED
+                    changes.append(self._change(kind, identifier, sort_key))
+            if full_scan and not baseline:
+                detected = time.time()
+                datestamp = datetime.fromtimestamp(detected, timezone.utc).strftime(
+                    "%Y-%m-%dT%H:%M:%SZ"
+                )
+                for identifier in set(self.known) - seen:
+                    del self.known[identifier]
+                    change = self._change(DELETED, identifier, datestamp, detected)
+                    self.tombstones[identifier] = change
+                    changes.append(change)
+            self.log.extend(changes)
+
+        if changes:
+            logger.info(f"Detected {len(changes)} changed records")
+            for callback in self.subscribers:
+                try:
+                    callback(changes)
+                except Exception as e:
+                    logger.warning(f"Change subscriber failed: {e}")
+        return changes
+
+    def _change(
+        self, kind: str, identifier: str, datestamp: str, detected: float = None
+    ) -> Change:
+        self.sequence += 1
+        return Change(
+            self.sequence, kind, identifier, datestamp, detected or time.time()
+        )
+
+    def deleted_headers(
+        self, from_value: str = None, until: str = None, after: tuple = None
+    ) -> list[dict]:
+        """Get the headers of the tombstones in (datestamp, identifier) order.
+
+        from_value, until: restrict the datestamps like the arguments of list requests.
+        after: a `header_key`, only the headers after it are returned.
+        """
+        with self._lock:
+            tombstones = list(self.tombstones.values())
+        headers = sorted(
+            (
+                {
+                    "identifier": t.identifier,
+                    "datestamp": t.datestamp,
+                    "status": DELETED,
+                }
+                for t in tombstones
+            ),
+            key=header_key,
+        )
+        if from_value:
+            lower = _bound(from_value)
+            headers = [h for h in headers if header_key(h)[0] >= lower]
+        if until:
+            upper = _bound(until)
+            headers = [h for h in headers if header_key(h)[0] <= upper]
+        if after is not None:
+            headers = [h for h in headers if header_key(h) > tuple(after)]
+        return headers
+
+    def changes(self, since: int = 0) -> list[Change]:
+        """Get the logged changes with a sequence number greater than `since`."""
+        with self._lock:
+            return [change for change in self.log if change.sequence > since]
+
+    def start(self):
+        """Poll the store in a background thread."""
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Polling for changes failed: {e}")
+            self._stopped.wait(self.interval)
+
+
+def _bound(value: str) -> str:
+    """Convert a from or until argument to a comparable `header_key` datestamp."""
+    if "T" not in value:
+        value = f"{value}T00:00:00Z"
+    return header_key({"datestamp": value})[0]
@@ -0,0 +1,69 @@
+import threading
+from typing import Any, Callable, Hashable
+
+from .cancellation import Cancelled
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _LeaderCancelled(Exception):
+    pass
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single computation.
+
+    The first caller for a key executes the function, every caller that arrives while
+    this computation is still in flight waits for it and receives the same result or
+    exception. Once the computation is done the key is released, so this is no cache.
+    If the computation was cancelled for the request of the first caller, the waiting
+    callers start it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run `fn` for `key` or join an already running call for the same key."""
+        while True:
+            try:
+                return self._do(key, fn)
+            except _LeaderCancelled:
+                continue
+
+    def _do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if isinstance(call.error, Cancelled):
+                raise _LeaderCancelled()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self) -> int:
+        """Get the number of computations that are currently running."""
+        with self._lock:
+            return len(self._calls)
@@ -6,11 +6,74 @@ class Settings(BaseSettings):
     repository_name: str = "Webarchive OAI-PMH Endpoint"
     description: str = "This is the OAI-PMH endpoint of the Webarchive."
     admin_emails: Optional[list[str]] = None
+    admin_token: str = ""
 
     sparql_endpoint: str = ""
+    sparql_replicas: list[str] = []
+    replica_failure_threshold: int = 5
+    replica_reset_timeout: float = 30
+    hedge_after: float = 0
+    health_interval: float = 10
+    slow_query_seconds: float = 5
+    memory_profiling: bool = False
+    memory_profiling_frames: int = 1
     graph_path: str = ""
+    load_workers: int = 0
+    load_chunk_bytes: int = 67108864
+    splittable_turtle: bool = False
     query_path: str = ""
+    shards: list[str] = []
+    set_queries: list[str] = []
+    materialized_path: str = ""
+    reload_interval: float = 0
 
     limit: int = "10"
+    lookup_max_identifiers: int = 10000
+    export_page_size: int = 1000
+    page_bytes: int = 0
+    page_seconds: float = 0
+    result_set_path: str = ""
+    result_set_ttl: float = 86400
+
+    identifier_filter: bool = False
+    identifier_filter_refresh: float = 3600
+    identifier_filter_error_rate: float = 0.001
+
+    change_interval: float = 0
+    change_full_scan_every: int = 24
+
+    partition_workers: int = 0
+    partition_rows: int = 10000
+
+    query_cache_size: int = 0
+    query_cache_ttl: float = 300
+    work_cache_size: int = 0
+    work_cache_ttl: float = 300
+
+    response_cache_size: int = 0
+    response_ttl: float = 60
+    stale_while_revalidate: float = 300
+    stale_if_error: float = 3600
+
+    shared_cache: str = ""
+    shared_cache_size: int = 268435456
+    shared_cache_retry: float = 30
+
+    prefetch_workers: int = 0
+    prefetch_bytes: int = 67108864
+    prefetch_ttl: float = 60
+
+    warmup_logs: list[str] = []
+    warmup_requests: int = 100
+    warmup_rate: float = 10
+    warmup_times: list[str] = []
+    warmup_at_start: bool = True
+
+    list_concurrency: int = 4
+    fast_concurrency: int = 16
+    queue_size: int = 32
+    queue_timeout: float = 30
+    client_rate: float = 0
+    client_burst: int = 10
 
     model_config = SettingsConfigDict(env_file=["default.env", "custom.env"])
@@ -0,0 +1,92 @@
+import threading
+from dataclasses import asdict, dataclass
+
+from loguru import logger
+from rdflib import Graph
+
+
+@dataclass
+class TemplateStatistics:
+    """The execution statistics of a query template."""
+
+    name: str
+    count: int = 0
+    errors: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+    rows: int = 0
+    bytes: int = 0
+    slow: int = 0
+    cache_hits: int = 0
+    slowest_bindings: dict = None
+
+    def as_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "mean_seconds": self.total_seconds / self.count if self.count else 0,
+        }
+
+
+class QueryStatistics:
+    """Collect execution statistics per query template and log slow queries.
+
+    Queries that take longer than `slow_seconds` are logged with their bindings.
+    """
+
+    def __init__(self, slow_seconds: float = 0):
+        self.slow_seconds = slow_seconds
+        self.templates = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        name: str,
+        bindings: dict,
+        seconds: float,
+        result=None,
+        error: Exception = None,
+    ):
+        rows, size = result_size(result)
+        with self._lock:
+            stats = self.templates.setdefault(name, TemplateStatistics(name))
+            stats.count += 1
+            stats.errors += error is not None
+            stats.total_seconds += seconds
+            stats.rows += rows
+            stats.bytes += size
+            if seconds > stats.max_seconds:
+                stats.max_seconds = seconds
+                stats.slowest_bindings = {k: str(v) for k, v in bindings.items()}
+            slow = bool(self.slow_seconds) and seconds > self.slow_seconds
+            stats.slow += slow
+        if slow:
+            logger.warning(
+                f"Slow query {name} took {seconds:.3f}s with {rows} rows, "
+                f"bindings: {bindings}"
+            )
+
+    def hit(self, name: str):
+        """Count a result of the template that was taken from the result cache."""
+        with self._lock:
+            self.templates.setdefault(name, TemplateStatistics(name)).cache_hits += 1
+
+    def top(self, count: int = 10, by: str = "total_seconds") -> list[dict]:
+        """Get the statistics of the `count` templates with the highest `by` value."""
+        with self._lock:
+            templates = [stats.as_dict() for stats in self.templates.values()]
+        return sorted(templates, key=lambda stats: stats[by], reverse=True)[:count]
+
+    def reset(self):
+        with self._lock:
+            self.templates.clear()
+
+
+def result_size(result) -> tuple[int, int]:
+    """Get the number of rows (triples) and the estimated size in bytes of a result."""
+    if result is None:
+        return 0, 0
+    if isinstance(result, Graph):
+        return len(result), sum(len(term) for triple in result for term in triple)
+    return len(result), sum(
+        len(value) for row in result for value in row.values() if value is not None
+    )
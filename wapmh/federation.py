@@ -0,0 +1,143 @@
+import heapq
+import math
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+from typing import Iterator
+
+from .cache import Cache
+from .cancellation import propagate
+from .store import MetadataStore, header_key
+
+
+class FederatedMetadataStore(MetadataStore):
+    """A store over several stores (shards), e.g. one per year of the archive.
+
+    The shards are queried concurrently, their headers are merged in (datestamp,
+    identifier) order, so paging over the federation is consistent. Every record is
+    expected to be in a single shard.
+    Requests for a single identifier are routed to its shard by a lookup index that
+    is filled with every header seen; unknown identifiers are looked up in all shards.
+    """
+
+    def __init__(
+        self,
+        shards: list[MetadataStore],
+        route_size: int = 1000000,
+        concurrency: int = 1,
+    ):
+        """
+        shards: the stores, they all need to use the same queries.
+        route_size: the maximum number of identifiers kept in the lookup index.
+        concurrency: the number of requests that query the shards at the same time,
+            each of them needs a thread per shard.
+        """
+        if not shards:
+            raise ValueError("A federated store needs at least one shard.")
+        self.shards = shards
+        self.queries = getattr(shards[0], "queries", None)
+        self.routes = Cache(max_size=route_size, ttl=math.inf)
+        self.executor = ThreadPoolExecutor(max_workers=len(shards) * concurrency)
+
+    def _map(self, fn, indexes: list[int] = None) -> list:
+        """Call `fn` with each shard index concurrently and get the results in order."""
+        indexes = range(len(self.shards)) if indexes is None else indexes
+        return list(self.executor.map(propagate(fn), indexes))
+
+    def _route(self, index: int, headers: list[dict]):
+        for header in headers:
+            self.routes.set(str(header["identifier"]), index)
+
+    def shard_of(self, identifier: str) -> int | None:
+        """Get the index of the shard that contains the identifier."""
+        if (index := self.routes.get(identifier)) is not None:
+            return index
+        results = self._map(
+            lambda i: list(self.shards[i].identifiers(identifier=identifier))
+        )
+        for index, headers in enumerate(results):
+            if headers:
+                self._route(index, headers)
+                return index
+        return None
+
+    def identifiers(self, **kwargs) -> Iterator[dict]:
+        if identifier := kwargs.get("identifier"):
+            if (index := self.shard_of(identifier)) is not None:
+                yield from self.shards[index].identifiers(identifier=identifier)
+            return
+
+        offset, limit = kwargs.get("offset"), kwargs.get("limit")
+        # the shards continue after the same key as the merged list
+        paged = (
+            offset is not None or limit is not None or kwargs.get("after") is not None
+        )
+        shard_kwargs = dict(kwargs)
+        if paged:
+            # each shard contributes at most offset + limit headers to the page
+            offset = offset or 0
+            end = None if limit is None else offset + limit
+            shard_kwargs.update(offset=0, limit=end)
+
+        results = self._map(lambda i: list(self.shards[i].identifiers(**shard_kwargs)))
+        for index, headers in enumerate(results):
+            self._route(index, headers)
+        if paged:
+            yield from islice(heapq.merge(*results, key=header_key), offset, end)
+        else:
+            yield from chain(*results)
+
+    def records(self, **kwargs) -> Iterator[dict]:
+        if identifier := kwargs.get("identifier"):
+            if (index := self.shard_of(identifier)) is not None:
+                yield from self.shards[index].records(identifier=identifier)
+            return
+
+        headers = kwargs.get("headers")
+        if headers is None:
+            headers = list(self.identifiers(**kwargs))
+
+        groups = {}
+        for header in headers:
+            index = self.shard_of(str(header["identifier"]))
+            if index is not None:
+                groups.setdefault(index, []).append(header)
+        results = self._map(
+            lambda i: list(self.shards[i].records(headers=groups[i])), list(groups)
+        )
+        records = {
+            str(record["identifier"]): record for record in chain.from_iterable(results)
+        }
+        for header in headers:
+            if record := records.get(str(header["identifier"])):
+                yield record
+
+    def lookup(self, identifiers: list[str], batch_size: int = 500) -> Iterator[dict]:
+        for start in range(0, len(identifiers), batch_size):
+            batch = identifiers[start : start + batch_size]
+            results = self._map(lambda i: list(self.shards[i].lookup(batch)))
+            records = {}
+            for index, shard_records in enumerate(results):
+                self._route(index, shard_records)
+                records.update((str(r["identifier"]), r) for r in shard_records)
+            for identifier in batch:
+                if record := records.get(identifier):
+                    yield record
+
+    def apply_changes(self, changes: list):
+        """Update the indexes of the shards with the changes of a ChangeTracker.
+
+        The changes do not tell the shard of a record, so every shard gets all of them.
+        """
+        for change in changes:
+            # an added record may be in another shard than before
+            self.routes.pop(change.identifier)
+        for shard in self.shards:
+            if hasattr(shard, "apply_changes"):
+                shard.apply_changes(changes)
+
+    def sets(self) -> list[dict]:
+        sets = {}
+        for shard_sets in self._map(lambda i: self.shards[i].sets()):
+            for s in shard_sets:
+                sets.setdefault(s["setSpec"], s)
+        return [sets[set_spec] for set_spec in sorted(sets)]
@@ -0,0 +1,128 @@
+import hashlib
+import math
+import threading
+from typing import Callable, Iterable
+
+from loguru import logger
+
+
+class BloomFilter:
+    """A probabilistic set of strings.
+
+    A membership test can yield false positives (with about the given error rate) but no
+    false negatives, so if a value is not contained, it was never added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        capacity = max(capacity, 1)
+        self.size = max(
+            64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    @classmethod
+    def from_values(cls, values: list[str], error_rate: float = 0.001) -> "BloomFilter":
+        bloom = cls(len(values), error_rate)
+        for value in values:
+            bloom.add(value)
+        return bloom
+
+    def _positions(self, value: str) -> Iterable[int]:
+        digest = hashlib.blake2b(value.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, value: str):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value: str) -> bool:
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(value)
+        )
+
+
+class IdentifierFilter:
+    """A Bloom filter over all identifiers of a store that is rebuilt periodically.
+
+    Until the first build is finished every identifier might be contained.
+    Identifiers that are added to the store after a build are not contained until the
+    next build, unless they are added with `add`.
+    """
+
+    def __init__(
+        self,
+        source: Callable[[], list[str]],
+        refresh_interval: float = 3600,
+        error_rate: float = 0.001,
+    ):
+        """
+        source: returns the list of all identifiers.
+        """
+        self.source = source
+        self.refresh_interval = refresh_interval
+        self.error_rate = error_rate
+        self.bloom = None
+        self._lock = threading.Lock()
+        # identifiers added while a build is running
+        self._added = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def might_contain(self, identifier: str) -> bool:
+        bloom = self.bloom
+        return bloom is None or identifier in bloom
+
+    def add(self, identifier: str):
+        with self._lock:
+            if self.bloom is not None:
+                self.bloom.add(identifier)
+            if self._added is not None:
+                # the source of a running build may not contain it yet
+                self._added.append(identifier)
+
+    def build(self):
+        with self._lock:
+            self._added = []
+        try:
+            identifiers = self.source()
+            # reserve capacity for identifiers that are added until the next build
+            bloom = BloomFilter(int(len(identifiers) * 1.1), self.error_rate)
+            for identifier in identifiers:
+                bloom.add(identifier)
+            with self._lock:
+                for identifier in self._added:
+                    bloom.add(identifier)
+                self.bloom = bloom
+        finally:
+            with self._lock:
+                self._added = None
+        logger.info(f"Built identifier filter for {len(identifiers)} identifiers")
+
+    def start(self, delay: float = 0):
+        """Build the filter in a background thread and rebuild it periodically.
+
+        delay: the seconds until the first build, e.g. if it was built already.
+        """
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(delay,), daemon=True)
+        self._thread.start()
+
+    def stop(self, wait: bool = False):
+        self._stopped.set()
+        if wait and self._thread:
+            self._thread.join()
+
+    def _run(self, delay: float = 0):
+        if self._stopped.wait(delay):
+            return
+        while not self._stopped.is_set():
+            try:
+                self.build()
+            except Exception as e:
+                logger.warning(f"Building the identifier filter failed: {e}")
+            self._stopped.wait(self.refresh_interval)
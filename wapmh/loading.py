@@ -0,0 +1,179 @@
+import io
+import os
+import time
+import uuid
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from loguru import logger
+from rdflib import BNode, Graph
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+from rdflib.util import guess_format
+
+TURTLE_HEADER = (b"@prefix", b"@base", b"prefix", b"base", b"#")
+
+
+class BlankNodeLabels(dict):
+    """Map the blank node labels of a document to the same nodes in every chunk."""
+
+    def __init__(self, prefix: str):
+        super().__init__()
+        self.prefix = prefix
+
+    def get(self, label: str, default=None) -> BNode:
+        return BNode(f"{self.prefix}{label}")
+
+
+def turtle_header(path: str) -> tuple[bytes, int]:
+    """Get the prefix and base declarations at the beginning of a Turtle file.
+
+    Returns the declarations and the offset of the first statement.
+    """
+    header = []
+    offset = 0
+    with open(path, "rb") as file:
+        for line in file:
+            stripped = line.strip()
+            if stripped and not stripped.lower().startswith(TURTLE_HEADER):
+                break
+            header.append(line)
+            offset += len(line)
+    return b"".join(header), offset
+
+
+def chunk_ranges(
+    path: str, start: int, chunk_bytes: int, turtle: bool = False
+) -> list[tuple[int, int]]:
+    """Split a file into byte ranges of about `chunk_bytes` at statement boundaries.
+
+    N-Triples are split at line ends, Turtle at blank lines, which separate the
+    subject blocks in line-splittable exports.
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as file:
+        while start < size:
+            file.seek(min(start + chunk_bytes, size))
+            line = file.readline()
+            while turtle and line and line.strip():
+                line = file.readline()
+            end = file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+class TermTable:
+    """Collect triples as indexes into a table of their distinct terms.
+
+    This is much faster to send between processes than the triples, and the graph
+    that they are added to keeps a single instance of each term.
+    """
+
+    def __init__(self):
+        self.terms = {}
+        self.ids = array("I")
+
+    def triple(self, s, p, o):
+        for term in (s, p, o):
+            if (index := self.terms.get(term)) is None:
+                index = self.terms[term] = len(self.terms)
+            self.ids.append(index)
+
+
+def parse_chunk(
+    path: str, start: int, end: int, format: str, header: bytes, labels: str
+) -> tuple[list, bytes]:
+    """Parse a byte range of a file, this runs in a worker process.
+
+    Returns the distinct terms and the triples as term indexes.
+    """
+    with open(path, "rb") as file:
+        file.seek(start)
+        data = header + file.read(end - start)
+    table = TermTable()
+    if format == "nt":
+        W3CNTriplesParser(sink=table, bnode_context=BlankNodeLabels(labels)).parse(
+            io.StringIO(data.decode("utf-8"))
+        )
+    else:
+        for s, p, o in Graph().parse(data=data, format=format):
+            table.triple(s, p, o)
+    return list(table.terms), table.ids.tobytes()
+
+
+def add_chunk(graph: Graph, terms: list, ids: bytes) -> int:
+    """Add the triples of a parsed chunk to the graph and get their number."""
+    ids = memoryview(ids).cast("I")
+    add = graph.store.add
+    for i in range(0, len(ids), 3):
+        add((terms[ids[i]], terms[ids[i + 1]], terms[ids[i + 2]]), graph, False)
+    return len(ids) // 3
+
+
+def load_graph(
+    path: str,
+    workers: int = 0,
+    chunk_bytes: int = 64 * 1024 * 1024,
+    splittable_turtle: bool = False,
+    progress_interval: float = 10,
+) -> Graph:
+    """Load a graph file, large N-Triples or splittable Turtle files in parallel.
+
+    The file is split into byte ranges that are parsed in `workers` processes, their
+    triples are merged into a single graph. Other formats, or with 0 workers, the file
+    is parsed by a single parser.
+    Labelled blank nodes in Turtle files must not be used across subject blocks.
+    """
+    format = guess_format(path) or "turtle"
+    started = time.monotonic()
+    parallel = workers and (
+        format == "nt" or (format == "turtle" and splittable_turtle)
+    )
+    if not parallel:
+        graph = Graph().parse(source=path, format=format)
+        logger.info(
+            f"Loaded {len(graph)} triples from {path} in "
+            f"{time.monotonic() - started:.1f}s"
+        )
+        return graph
+
+    header, offset = turtle_header(path) if format == "turtle" else (b"", 0)
+    ranges = chunk_ranges(path, offset, chunk_bytes, turtle=format == "turtle")
+    total = os.path.getsize(path) - offset
+    labels = f"load{uuid.uuid4().hex[:8]}"
+
+    graph = Graph()
+    if header:
+        # the prefixes of the file are kept for serializations of the graph
+        for prefix, namespace in (
+            Graph().parse(data=header, format="turtle").namespaces()
+        ):
+            graph.bind(prefix, namespace, override=False)
+    loaded = 0
+    reported = started
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(parse_chunk, path, start, end, format, header, labels): end
+            - start
+            for start, end in ranges
+        }
+        for future in as_completed(futures):
+            add_chunk(graph, *future.result())
+            loaded += futures[future]
+            now = time.monotonic()
+            if now - reported >= progress_interval or loaded == total:
+                reported = now
+                elapsed = now - started
+                rate = loaded / elapsed
+                logger.info(
+                    f"Loaded {loaded / total:.0%} of {path} ({len(graph)} triples, "
+                    f"{loaded} of {total} bytes) in {elapsed:.1f}s, "
+                    f"{rate / 1024 / 1024:.1f} MiB/s, "
+                    f"about {(total - loaded) / rate:.0f}s left"
+                )
+    logger.info(
+        f"Loaded {len(graph)} triples from {path} in {len(ranges)} chunks with "
+        f"{workers} workers in {time.monotonic() - started:.1f}s"
+    )
+    return graph
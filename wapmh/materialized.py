@@ -0,0 +1,310 @@
+import json
+import sqlite3
+import threading
+from typing import Iterator
+
+from loguru import logger
+from xsdata.formats.dataclass.etree import etree
+
+from .adapters import MetadataAdapterRegistry, SerializedMetadata
+from .store import MetadataStore, StoreBackendException, header_key
+
+SCHEMA = """
+create table if not exists records (
+    identifier text primary key,
+    datestamp text not null,
+    sort_key text not null,
+    set_spec text not null default '[]'
+);
+create index if not exists records_order on records (sort_key, identifier);
+create table if not exists record_sets (
+    set_spec text not null,
+    identifier text not null,
+    primary key (set_spec, identifier)
+);
+create table if not exists sets (
+    set_spec text primary key,
+    set_name text
+);
+create table if not exists fragments (
+    identifier text not null,
+    prefix text not null,
+    xml blob not null,
+    primary key (identifier, prefix)
+);
+create table if not exists state (
+    key text primary key,
+    value text
+);
+"""
+
+
+def materialize(
+    store: MetadataStore,
+    registry: MetadataAdapterRegistry,
+    path: str,
+    full: bool = False,
+    batch_size: int = 1000,
+) -> int:
+    """Convert the records of the store with every registered adapter and save them.
+
+    The records are written with their headers and the serialized metadata per
+    metadataPrefix to the SQLite database at `path`.
+    Unless `full` is set, only the records with a datestamp since the day of the latest
+    datestamp of the previous run are converted. A full run removes the records and
+    sets that are no longer in the store.
+
+    returns the number of materialized records.
+    """
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript(SCHEMA)
+        since = None
+        if not full:
+            row = connection.execute(
+                "select value from state where key = 'latest_datestamp'"
+            ).fetchone()
+            since = row[0][:10] if row else None
+        else:
+            connection.execute("create temp table seen (identifier text primary key)")
+
+        adapters = {
+            prefix: registry.adapter(store, prefix)
+            for prefix in registry.listPrefixes()
+        }
+        if full:
+            connection.execute("delete from sets")
+        connection.executemany(
+            "insert or replace into sets values (?, ?)",
+            [(s["setSpec"], s["setName"]) for s in store.sets()],
+        )
+
+        count = 0
+        latest = None
+        kwargs = {"from": since} if since else {}
+        for record in store.records(**kwargs):
+            identifier = str(record["identifier"])
+            sort_key = header_key(record)[0]
+            set_specs = [str(set_spec) for set_spec in record.get("setSpec", [])]
+            connection.execute(
+                "insert or replace into records values (?, ?, ?, ?)",
+                (
+                    identifier,
+                    str(record.get("datestamp") or ""),
+                    sort_key,
+                    json.dumps(set_specs),
+                ),
+            )
+            connection.execute(
+                "delete from record_sets where identifier = ?", (identifier,)
+            )
+            connection.executemany(
+                "insert or ignore into record_sets values (?, ?)",
+                [(ancestor, identifier) for ancestor in _ancestors(set_specs)],
+            )
+            for prefix, adapter in adapters.items():
+                metadata = adapter.metadata(record["metadata"], identifier=identifier)
+                if metadata is None or metadata.other_element is None:
+                    continue
+                connection.execute(
+                    "insert or replace into fragments values (?, ?, ?)",
+                    (identifier, prefix, etree.tostring(metadata.other_element)),
+                )
+            if full:
+                connection.execute(
+                    "insert or ignore into seen values (?)", (identifier,)
+                )
+            latest = max(latest or sort_key, sort_key)
+            count += 1
+            if count % batch_size == 0:
+                connection.commit()
+                logger.info(f"Materialized {count} records")
+
+        if full:
+            # the records that were not seen in the run are gone from the store
+            unseen = "identifier not in (select identifier from seen)"
+            connection.execute(f"delete from record_sets where {unseen}")
+            connection.execute(f"delete from fragments where {unseen}")
+            removed = connection.execute(f"delete from records where {unseen}").rowcount
+            if removed:
+                logger.info(f"Removed {removed} records that are gone")
+        if latest:
+            connection.execute(
+                "insert or replace into state values ('latest_datestamp', ?)",
+                (max(latest, since or ""),),
+            )
+        connection.commit()
+        logger.info(f"Materialized {count} records to {path}")
+        return count
+    finally:
+        connection.close()
+
+
+def _ancestors(set_specs: list[str]) -> set[str]:
+    """Get the set specs including all their ancestors."""
+    ancestors = set()
+    for set_spec in set_specs:
+        parts = set_spec.split(":")
+        ancestors.update(":".join(parts[:i]) for i in range(1, len(parts) + 1))
+    return ancestors
+
+
+def _bound(value: str) -> str:
+    """Convert a from or until argument to a comparable sort key."""
+    if len(value) == 10:
+        return f"{value}T00:00:00"
+    return value.rstrip("Z")
+
+
+class MaterializedMetadataStore(MetadataStore):
+    """A store that serves the records as materialized by `materialize`.
+
+    The metadata is provided as SerializedMetadata, so the adapters do not need to
+    convert it again.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """Get the connection of the current thread."""
+        if (connection := getattr(self._local, "connection", None)) is None:
+            try:
+                connection = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            except sqlite3.Error as e:
+                raise StoreBackendException("Materialized store not available.", e)
+            self._local.connection = connection
+        return connection
+
+    def identifiers(self, **kwargs) -> Iterator[dict]:
+        conditions = []
+        parameters = []
+        if identifier := kwargs.get("identifier"):
+            conditions.append("identifier = ?")
+            parameters.append(identifier)
+        if from_value := kwargs.get("from"):
+            conditions.append("sort_key >= ?")
+            parameters.append(_bound(from_value))
+        if until := kwargs.get("until"):
+            conditions.append("sort_key <= ?")
+            parameters.append(_bound(until))
+        if set_value := kwargs.get("set"):
+            conditions.append(
+                "identifier in (select identifier from record_sets where set_spec = ?)"
+            )
+            parameters.append(set_value)
+
+        offset, limit = kwargs.get("offset"), kwargs.get("limit")
+        if (after := kwargs.get("after")) is not None:
+            conditions.append("(sort_key, identifier) > (?, ?)")
+            parameters += list(after)
+
+        sql = "select identifier, datestamp, set_spec from records"
+        if conditions:
+            sql += " where " + " and ".join(conditions)
+        if offset is not None or limit is not None or after is not None:
+            sql += " order by sort_key, identifier limit ? offset ?"
+            parameters += [-1 if limit is None else limit, offset or 0]
+
+        try:
+            rows = self.connection().execute(sql, parameters).fetchall()
+        except sqlite3.Error as e:
+            raise StoreBackendException("Materialized store not available.", e)
+        for identifier, datestamp, set_spec in rows:
+            yield {
+                "identifier": identifier,
+                "datestamp": datestamp,
+                "setSpec": json.loads(set_spec),
+            }
+
+    def records(self, **kwargs) -> Iterator[dict]:
+        headers = kwargs.get("headers")
+        if headers is None:
+            headers = list(self.identifiers(**kwargs))
+        fragments = self.fragments([str(header["identifier"]) for header in headers])
+        for header in headers:
+            yield {
+                **header,
+                "metadata": fragments.get(str(header["identifier"]))
+                or SerializedMetadata(),
+            }
+
+    def lookup(self, identifiers: list[str], batch_size: int = 500) -> Iterator[dict]:
+        for i in range(0, len(identifiers), batch_size):
+            batch = identifiers[i : i + batch_size]
+            try:
+                rows = self.connection().execute(
+                    "select identifier, datestamp, set_spec from records "
+                    f"where identifier in ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+                headers = {
+                    identifier: {
+                        "identifier": identifier,
+                        "datestamp": datestamp,
+                        "setSpec": json.loads(set_spec),
+                    }
+                    for identifier, datestamp, set_spec in rows
+                }
+            except sqlite3.Error as e:
+                raise StoreBackendException("Materialized store not available.", e)
+            yield from self.records(headers=[headers[x] for x in batch if x in headers])
+
+    def fragments(
+        self, identifiers: list[str], batch_size: int = 500
+    ) -> dict[str, SerializedMetadata]:
+        """Get the serialized metadata of the identifiers."""
+        fragments = {}
+        try:
+            for i in range(0, len(identifiers), batch_size):
+                batch = identifiers[i : i + batch_size]
+                rows = self.connection().execute(
+                    "select identifier, prefix, xml from fragments "
+                    f"where identifier in ({', '.join('?' * len(batch))})",
+                    batch,
+                )
+                for identifier, prefix, xml in rows:
+                    fragments.setdefault(identifier, SerializedMetadata())[prefix] = xml
+        except sqlite3.Error as e:
+            raise StoreBackendException("Materialized store not available.", e)
+        return fragments
+
+    def sets(self) -> list[dict]:
+        try:
+            rows = self.connection().execute(
+                "select distinct record_sets.set_spec, sets.set_name from record_sets "
+                "left join sets on record_sets.set_spec = sets.set_spec "
+                "order by record_sets.set_spec"
+            )
+            return [
+                {"setSpec": set_spec, "setName": set_name or set_spec}
+                for set_spec, set_name in rows
+            ]
+        except sqlite3.Error as e:
+            raise StoreBackendException("Materialized store not available.", e)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from .repository import (
+        create_sparql_store,
+        get_record_adapter_registry,
+        get_settings,
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Materialize the records to the MATERIALIZED_PATH."
+    )
+    parser.add_argument(
+        "--full", action="store_true", help="convert all records, not only new ones"
+    )
+    args = parser.parse_args()
+    settings = get_settings()
+    materialize(
+        create_sparql_store(settings),
+        get_record_adapter_registry(),
+        settings.materialized_path,
+        full=args.full,
+    )
@@ -0,0 +1,183 @@
+import base64
+import binascii
+import dataclasses
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Iterable
+
+from loguru import logger
+
+from .adapters import record_size
+from .cache import Cache
+from .concurrency import SingleFlight
+
+
+HEADER_BYTES = 256
+"""The estimated size of a serialized header, or of the envelope of a page."""
+
+
+class BadResumptionToken(Exception):
+    """Raised if a resumption token can not be decoded."""
+
+
+@dataclasses.dataclass(frozen=True)
+class ResumptionToken:
+    """The state of a list request that is continued with a resumption token.
+
+    The token is not stored on the server, the arguments of the initial request and the
+    cursor are encoded in the token value. A token of a result set (see
+    wapmh.result_sets) encodes just its id and the cursor, the arguments are kept with
+    the result set.
+    The cursor counts the items delivered before the page. `after` is the `header_key`
+    of the last of them, the page starts after it without counting the items again.
+    """
+
+    arguments: dict
+    cursor: int = 0
+    result_set: str = None
+    after: tuple[str, str] = None
+
+    list_arguments = ["metadataPrefix", "from", "until", "set"]
+    """The request arguments that are kept in a resumption token."""
+
+    @classmethod
+    def start(cls, **kwargs) -> "ResumptionToken":
+        """Get the token for the first page of a list request."""
+        return cls(
+            arguments={
+                key: kwargs[key]
+                for key in cls.list_arguments
+                if kwargs.get(key) is not None
+            }
+        )
+
+    def next(self, count: int, after: tuple[str, str] = None) -> "ResumptionToken":
+        """Get the token for the page that follows after `count` items.
+
+        after: the `header_key` of the last item.
+        """
+        return dataclasses.replace(self, cursor=self.cursor + count, after=after)
+
+    def encode(self) -> str:
+        if self.result_set:
+            values = {"resultSet": self.result_set, "cursor": self.cursor}
+        else:
+            values = {**self.arguments, "cursor": self.cursor}
+            if self.after:
+                values["after"] = list(self.after)
+        data = json.dumps(
+            values,
+            separators=(",", ":"),
+            sort_keys=True,
+        )
+        return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
+
+    @classmethod
+    def decode(
+        cls, value: str, metadata_prefixes: Iterable[str] = None
+    ) -> "ResumptionToken":
+        """Decode a token value.
+
+        metadata_prefixes: the registered prefixes, the metadataPrefix of a token that
+            is not of a result set must be one of them.
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(value.encode("ascii")))
+            cursor = data.pop("cursor")
+            result_set = data.pop("resultSet", None)
+            after = data.pop("after", None)
+        except (AttributeError, KeyError, TypeError, ValueError, binascii.Error):
+            raise BadResumptionToken(value)
+        if result_set is not None:
+            if not isinstance(result_set, str) or data:
+                raise BadResumptionToken(value)
+        if after is not None:
+            if (
+                not isinstance(after, list)
+                or len(after) != 2
+                or not all(isinstance(v, str) for v in after)
+            ):
+                raise BadResumptionToken(value)
+            after = tuple(after)
+        if (
+            not isinstance(cursor, int)
+            or cursor < 0
+            or not set(data).issubset(cls.list_arguments)
+            or not all(isinstance(v, str) for v in data.values())
+        ):
+            raise BadResumptionToken(value)
+        if (
+            result_set is None
+            and metadata_prefixes is not None
+            and data.get("metadataPrefix") not in metadata_prefixes
+        ):
+            raise BadResumptionToken(value)
+        return cls(arguments=data, cursor=cursor, result_set=result_set, after=after)
+
+
+class PageBudget:
+    """Limit a page by the size of its items and the time spent to compute them.
+
+    A budget of 0 is unlimited.
+    """
+
+    def __init__(self, max_bytes: int = 0, max_seconds: float = 0):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.bytes = 0
+        self.started = time.monotonic()
+
+    def spend(self, size: int) -> bool:
+        """Account for an item of `size` bytes, return True if the budget is exhausted."""
+        self.bytes += size
+        if self.max_bytes and self.bytes >= self.max_bytes:
+            return True
+        if self.max_seconds and time.monotonic() - self.started >= self.max_seconds:
+            return True
+        return False
+
+
+class Prefetcher:
+    """Compute the pages of list requests speculatively in the background.
+
+    Harvesters follow resumption tokens sequentially. When a page is delivered, the
+    page for its resumption token is computed on a worker thread and kept in a short
+    lived cache, so the follow-up request is served from memory. A request that arrives
+    while its page is still computed joins this computation.
+    The cache is bounded by the estimated size of the pages in bytes, `max_bytes`.
+    """
+
+    def __init__(self, workers: int, max_bytes: int, ttl: float):
+        self.workers = workers
+        self.cache = Cache(max_size=max_bytes, ttl=ttl, sizeof=page_size)
+        self.flight = SingleFlight()
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers else None
+
+    def get(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Get a prefetched page or compute it."""
+        if (page := self.cache.get(key)) is not None:
+            return page
+        return self.flight.do(key, compute)
+
+    def prefetch(self, key: Hashable, compute: Callable[[], Any]):
+        """Schedule the computation of a page."""
+        if self.executor is None or key in self.cache:
+            return
+        self.executor.submit(self._prefetch, key, compute)
+
+    def _prefetch(self, key: Hashable, compute: Callable[[], Any]):
+        try:
+            self.cache.set(key, self.flight.do(key, compute))
+        except Exception as e:
+            logger.warning(f"Prefetching of {key} failed: {e}")
+
+
+def page_size(page: tuple) -> int:
+    """Estimate the size of a page in bytes by the size of its headers and records."""
+    response, next_token = page
+    size = HEADER_BYTES
+    for value in response.values():
+        size += HEADER_BYTES * len(getattr(value, "header", None) or [])
+        size += sum(record_size(r) for r in getattr(value, "record", None) or [])
+    return size
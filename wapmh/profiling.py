@@ -0,0 +1,163 @@
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Iterable, Iterator
+
+from loguru import logger
+
+
+@dataclass
+class StageAllocations:
+    """The allocations of a stage of a request, e.g. querying the store."""
+
+    calls: int = 0
+    seconds: float = 0
+    peak: int = 0
+    """The highest memory allocated during the stage, relative to the request start."""
+    retained: int = 0
+    """The memory allocated during the stage that was not freed at its end."""
+
+
+@dataclass
+class RequestAllocations:
+    """The allocations of a request, in bytes."""
+
+    name: str
+    base: int = 0
+    peak: int = 0
+    seconds: float = 0
+    stages: dict[str, StageAllocations] = field(default_factory=dict)
+
+    def observe(self) -> tuple[int, int]:
+        """Get the current and peak traced memory since the last observation."""
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        self.peak = max(self.peak, peak - self.base)
+        return current, peak
+
+    def as_dict(self) -> dict:
+        profile = asdict(self)
+        del profile["base"]
+        return profile
+
+
+current = ContextVar("allocations", default=None)
+"""The allocations of the request that is currently processed, if profiling."""
+
+
+@contextmanager
+def stage(name: str):
+    """Account the allocations in the context to the stage of the current request.
+
+    A stage can be entered several times per request, e.g. once per record.
+    """
+    profile = current.get()
+    if profile is None or not tracemalloc.is_tracing():
+        yield
+        return
+    started = time.perf_counter()
+    start, _ = profile.observe()
+    try:
+        yield
+    finally:
+        end, peak = profile.observe()
+        allocations = profile.stages.setdefault(name, StageAllocations())
+        allocations.calls += 1
+        allocations.seconds += time.perf_counter() - started
+        allocations.peak = max(allocations.peak, peak - profile.base)
+        allocations.retained += end - start
+
+
+def stages(iterable: Iterable, name: str) -> Iterator:
+    """Account the allocations of getting each item of the iterable to the stage."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+class MemoryProfiler:
+    """Trace the memory allocations per request and per stage of the pipeline.
+
+    The peaks are taken from tracemalloc, which traces the whole process: requests
+    that are processed concurrently are accounted to each other. Exact numbers are
+    measured with a single request at a time, e.g. by the allocations benchmark.
+    """
+
+    def __init__(self, frames: int = 1, history: int = 100):
+        """
+        frames: the number of frames stored per allocation, for the top allocations.
+        history: the number of recent requests that are kept.
+        """
+        self.frames = frames
+        self.recent = deque(maxlen=history)
+        self.names = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def stop(self):
+        tracemalloc.stop()
+
+    @contextmanager
+    def request(self, name: str):
+        """Profile the request in the context, `name` groups it, e.g. by verb."""
+        if not tracemalloc.is_tracing():
+            yield None
+            return
+        profile = RequestAllocations(name)
+        profile.base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        started = time.perf_counter()
+        reset = current.set(profile)
+        try:
+            yield profile
+        finally:
+            current.reset(reset)
+            profile.observe()
+            profile.seconds = time.perf_counter() - started
+            self.record(profile)
+
+    def record(self, profile: RequestAllocations):
+        with self._lock:
+            self.recent.append(profile)
+            summary = self.names.setdefault(
+                profile.name, {"requests": 0, "max_peak": 0, "total_peak": 0}
+            )
+            summary["requests"] += 1
+            summary["max_peak"] = max(summary["max_peak"], profile.peak)
+            summary["total_peak"] += profile.peak
+        logger.debug(
+            f"{profile.name} request allocated a peak of {profile.peak} bytes: "
+            + ", ".join(f"{n} {s.peak}" for n, s in profile.stages.items())
+        )
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                name: {
+                    **summary,
+                    "mean_peak": summary["total_peak"] // summary["requests"],
+                }
+                for name, summary in self.names.items()
+            }
+
+    def top_allocations(self, count: int = 10) -> list[dict]:
+        """Get the source lines that hold the most memory currently."""
+        if not tracemalloc.is_tracing():
+            return []
+        statistics = tracemalloc.take_snapshot().statistics("lineno")
+        return [
+            {"line": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in statistics[:count]
+        ]
@@ -0,0 +1,123 @@
+import gc
+import os
+import threading
+import weakref
+from typing import Callable
+
+from loguru import logger
+
+from .store import MetadataStore
+
+
+class StoreReloader:
+    """Reload the metadata store without downtime when its source file changes.
+
+    The new store is created by `factory` in the calling (or the watcher) thread, while
+    the current store keeps serving requests. Afterwards `store` is replaced, requests
+    that already took the old store keep using it until they are finished.
+    At most two stores are alive at a time: a reload is skipped as long as the store
+    replaced by the previous reload is still referenced.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], MetadataStore],
+        path: str,
+        interval: float = 0,
+        store: MetadataStore = None,
+    ):
+        """
+        factory: creates a new store including its indexes.
+        path: the file that is watched for modifications.
+        interval: seconds between checks of the file, 0 to not watch the file.
+        store: the initial store, created with `factory` if not given.
+        """
+        self.factory = factory
+        self.path = path
+        self.interval = interval
+        self.mtime = self._mtime()
+        self.store = store if store is not None else factory()
+        self.reloads = 0
+        self.subscribers = []
+        self._retired = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback: Callable[[MetadataStore], None]):
+        """Call `callback` with the new store after every reload."""
+        self.subscribers.append(callback)
+
+    def _mtime(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def changed(self) -> bool:
+        mtime = self._mtime()
+        return mtime is not None and mtime != self.mtime
+
+    def reload(self) -> bool:
+        """Create a new store and replace the current one.
+
+        returns False if a reload is already running or the previous store is still in
+        use.
+        """
+        if not self._lock.acquire(blocking=False):
+            logger.info("Reload is already running")
+            return False
+        try:
+            if self._retired is not None:
+                gc.collect()
+                if self._retired() is not None:
+                    logger.warning("Skip reload, the previous store is still in use")
+                    return False
+            # a file that fails to load is not retried until it is modified again
+            self.mtime = self._mtime()
+            logger.info(f"Reloading the store from {self.path}")
+            store = self.factory()
+
+            retired, self.store = self.store, store
+            self.reloads += 1
+            for callback in self.subscribers:
+                try:
+                    callback(store)
+                except Exception as e:
+                    logger.warning(f"Reload subscriber failed: {e}")
+
+            if hasattr(retired, "close"):
+                retired.close()
+            try:
+                self._retired = weakref.ref(retired)
+            except TypeError:
+                self._retired = None
+            del retired
+            gc.collect()
+            logger.info(f"Reloaded the store from {self.path}")
+            return True
+        finally:
+            self._lock.release()
+
+    def reload_if_changed(self) -> bool:
+        return self.changed() and self.reload()
+
+    def start(self):
+        """Watch the file in a background thread and reload when it was modified."""
+        if not self.interval:
+            return
+        if self._thread is not None:
+            # it is started already
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.warning(f"Reloading the store failed: {e}")
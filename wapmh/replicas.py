@@ -0,0 +1,274 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.client import HTTPException
+from typing import Any, Callable
+
+from loguru import logger
+
+from .cancellation import Cancelled, CancellationToken, on_cancel, propagate
+from .store import StoreBackendException
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ReplicasUnavailable(StoreBackendException):
+    """All replicas are failing, `retry_after` is the time until one is tried again."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_transport_error(error: Exception) -> bool:
+    """Whether `error` means that the replica failed, not that the query is wrong.
+
+    Connection errors, timeouts and 5xx answers are failures of the replica, other
+    errors, e.g. a 4xx answer or a query that can not be parsed, would occur with
+    every replica.
+    """
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status >= 500
+    return isinstance(error, (OSError, HTTPException))
+
+
+class CircuitBreaker:
+    """Stop sending requests to a failing backend.
+
+    After `failure_threshold` consecutive failures the breaker opens and no requests are
+    allowed. After `reset_timeout` seconds a single probe request is allowed
+    (half-open), if it succeeds the breaker closes again, otherwise it opens again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self) -> float:
+        if self.state != OPEN:
+            return 0
+        return max(0, self.opened + self.reset_timeout - time.monotonic())
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """End a call that neither succeeded nor failed, e.g. a cancelled probe."""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened = time.monotonic()
+
+
+class Replica:
+    """A backend with its circuit breaker and an exponentially weighted latency."""
+
+    def __init__(self, name: str, backend: Any, breaker: CircuitBreaker):
+        self.name = name
+        self.backend = backend
+        self.breaker = breaker
+        self.latency = 0.0
+        self.in_flight = 0
+
+    def score(self) -> float:
+        # requests that are already running will delay a new one
+        return self.latency * (self.in_flight + 1)
+
+    def observe(self, latency: float, alpha: float = 0.3):
+        self.latency = (
+            latency
+            if not self.latency
+            else (alpha * latency + (1 - alpha) * self.latency)
+        )
+
+
+class ReplicaPool:
+    """Distribute calls over equivalent replicas of a backend.
+
+    Every call goes to the available replica with the lowest expected latency, if it
+    fails the next replica is tried. A hedged call is sent to a second replica as well,
+    if the first one did not answer within `hedge_after` seconds; the first result
+    is used.
+    The replicas are checked in the background every `health_interval` seconds, so
+    a recovered replica is used again without waiting for a request to probe it.
+    """
+
+    def __init__(
+        self,
+        backends: dict[str, Any],
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        hedge_after: float = 0,
+        health_check: Callable[[Any], Any] = None,
+        health_interval: float = 10,
+    ):
+        """
+        backends: maps a name of each replica (e.g. the endpoint URL) to its backend.
+        hedge_after: seconds until a hedged call is sent to a second replica, 0 to not
+            hedge calls.
+        health_check: is called with a backend, it fails if the backend is not healthy.
+        """
+        self.replicas = [
+            Replica(name, backend, CircuitBreaker(failure_threshold, reset_timeout))
+            for name, backend in backends.items()
+        ]
+        self.hedge_after = hedge_after
+        self.health_check = health_check
+        self.health_interval = health_interval
+        self.hedges = 0
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.replicas)))
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _acquire(self, exclude: set = ()) -> Replica | None:
+        candidates = sorted(
+            (r for r in self.replicas if r not in exclude), key=lambda r: r.score()
+        )
+        for replica in candidates:
+            if replica.breaker.allow():
+                with self._lock:
+                    replica.in_flight += 1
+                return replica
+        return None
+
+    def _run(self, replica: Replica, fn: Callable[[Any], Any]) -> Any:
+        started = time.monotonic()
+        try:
+            result = fn(replica.backend)
+        except Cancelled:
+            # the replica did not answer wrong, but a probe must be allowed again
+            replica.breaker.release()
+            raise
+        except Exception as e:
+            if is_transport_error(e):
+                replica.breaker.failure()
+            else:
+                # the replica answered, the query is wrong
+                replica.breaker.success()
+            raise
+        else:
+            replica.breaker.success()
+            replica.observe(time.monotonic() - started)
+            return result
+        finally:
+            with self._lock:
+                replica.in_flight -= 1
+
+    def call(self, fn: Callable[[Any], Any], hedge: bool = False) -> Any:
+        """Call `fn` with the backend of a replica and return its result.
+
+        Calls that fail with a transport error are repeated with the other replicas.
+        """
+        tried = set()
+        error = None
+        while replica := self._acquire(tried):
+            tried.add(replica)
+            try:
+                if hedge and self.hedge_after:
+                    return self._hedged(replica, fn, tried)
+                return self._run(replica, fn)
+            except Cancelled:
+                raise
+            except Exception as e:
+                if not is_transport_error(e):
+                    raise
+                logger.warning(f"Replica {replica.name} failed: {e}")
+                error = e
+        if error is not None:
+            raise error
+        retry_after = min(r.breaker.retry_after() for r in self.replicas)
+        raise ReplicasUnavailable("All replicas are unavailable.", int(retry_after) + 1)
+
+    def _hedged(self, replica: Replica, fn: Callable[[Any], Any], tried: set) -> Any:
+        # every call has its own token, so the slower one is cancelled when the
+        # other one answered, both are cancelled if the request is cancelled
+        tokens = {}
+
+        def submit(replica: Replica):
+            token = CancellationToken()
+            future = self.executor.submit(propagate(self._run, token), replica, fn)
+            tokens[future] = token
+            return future
+
+        def cancel_all():
+            for token in list(tokens.values()):
+                token.cancel()
+
+        with on_cancel(cancel_all):
+            futures = {submit(replica)}
+            done, _ = wait(futures, timeout=self.hedge_after)
+            if not done and (second := self._acquire(tried)):
+                tried.add(second)
+                self.hedges += 1
+                futures.add(submit(second))
+            error = None
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        for slower in futures:
+                            tokens[slower].cancel()
+                        return future.result()
+                    error = future.exception()
+            raise error
+
+    def check(self):
+        """Check the health of every replica whose breaker allows a request."""
+        for replica in self.replicas:
+            if not replica.breaker.allow():
+                continue
+            with self._lock:
+                replica.in_flight += 1
+            try:
+                self._run(replica, self.health_check)
+            except Exception as e:
+                logger.warning(f"Health check of replica {replica.name} failed: {e}")
+
+    def start(self):
+        """Check the health of the replicas in a background thread."""
+        if not self.health_check or not self.health_interval:
+            return
+        if self._thread is not None:
+            # it is started already
+            return
+        self._thread = threading.Thread(target=self._check_periodically, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _check_periodically(self):
+        while not self._stopped.wait(self.health_interval):
+            self.check()
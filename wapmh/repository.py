@@ -1,24 +1,45 @@
+import asyncio
 import dataclasses
-from contextlib import asynccontextmanager
+import heapq
+import hmac
+from contextlib import asynccontextmanager, nullcontext
+from datetime import datetime, timezone
 from functools import lru_cache
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Literal
+from urllib.parse import urlencode
 
 import fastapi_xml.response
-from fastapi import FastAPI, Request
+from fastapi import Body, Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi_xml import XmlAppResponse
+from loguru import logger
 from query_collection import TemplateQueryCollection
 from rdflib import Graph
-from rdflib.plugins.stores.sparqlstore import SPARQLStore
 from stringcase import snakecase
 from xsdata.models.datatype import XmlDateTime
 
-from . import config
+from . import cancellation, config, profiling, streaming
+from .admission import AdmissionController, AdmissionRejected
 from .adapters import (
     MetadataAdapterRegistry,
     OaiDcMetadataAdapter,
     RdfMetadataAdapter,
     RequestAdapter,
+    record_size,
 )
+from .cache import Cache, StaleCache
+from .cancellation import (
+    Cancelled,
+    CancellableSPARQLStore,
+    CancellationToken,
+    abandoned,
+)
+from .changes import DELETED, ChangeTracker
+from .concurrency import SingleFlight
 from .model.oai_pmh import (
+    DeletedRecordType,
     DescriptionType,
     GetRecordType,
     HeaderType,
@@ -31,10 +52,29 @@ from .model.oai_pmh import (
     OaiPmh,
     OaiPmherrorcodeType,
     OaiPmherrorType,
+    RecordType,
     ResumptionTokenType,
     SetType,
+    StatusType,
+)
+from .diagnostics import QueryStatistics, TemplateStatistics
+from .federation import FederatedMetadataStore
+from .loading import load_graph
+from .materialized import MaterializedMetadataStore
+from .paging import BadResumptionToken, PageBudget, Prefetcher, ResumptionToken
+from .profiling import MemoryProfiler
+from .reload import StoreReloader
+from .replicas import ReplicaPool, ReplicasUnavailable
+from .result_sets import ResultSetStore
+from .shared_cache import TieredCache, create_backend
+from .store import (
+    MetadataStore,
+    SparqlMetadataStore,
+    StoreException,
+    encoded_size,
+    header_key,
 )
-from .store import MetadataStore, SparqlMetadataStore, StoreException
+from .warmup import Warmer
 
 
 @asynccontextmanager
@@ -42,12 +82,26 @@ async def lifespan(app: FastAPI):
     """Run at startup
     Initialize the Client and add it to request.state
     """
-    yield {"metadata_store": get_metadata_store()}
+    start_background_work()
+    reloader = get_store_reloader()
+    state = {
+        # a reloaded store is only referenced by the reloader, so it can be freed
+        "metadata_store": None if reloader else get_metadata_store(),
+        "reloader": reloader,
+        "admission": get_admission_controller(),
+        "change_tracker": get_change_tracker(),
+    }
+    warming = None
+    if warmer := get_warmer():
+        warmer.replay = lambda params: replay_request(params, state)
+        warming = asyncio.create_task(warmer.run(get_settings().warmup_at_start))
+    yield state
     """ Run on shutdown
         Close the connection
         Clear variables and release the resources
     """
-    pass
+    if warming is not None:
+        warming.cancel()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -63,12 +117,135 @@ def get_settings():
 
 @lru_cache
 def get_metadata_store():
+    """Get the store, if it is not reloaded, see `current_metadata_store`."""
+    return create_metadata_store()
+
+
+def create_metadata_store() -> MetadataStore:
     settings = get_settings()
+    if settings.materialized_path:
+        return MaterializedMetadataStore(settings.materialized_path)
+    if settings.shards:
+        return FederatedMetadataStore(
+            [
+                create_filtered_store(settings.model_copy(update=shard_source(shard)))
+                for shard in settings.shards
+            ],
+            # the admitted requests and the prefetching query the shards concurrently
+            concurrency=settings.list_concurrency
+            + settings.fast_concurrency
+            + settings.prefetch_workers,
+        )
+    return create_filtered_store(settings)
+
+
+def create_filtered_store(settings: config.Settings) -> SparqlMetadataStore:
+    store = create_sparql_store(settings)
+    if settings.identifier_filter:
+        store.start_identifier_filter(
+            refresh_interval=settings.identifier_filter_refresh,
+            error_rate=settings.identifier_filter_error_rate,
+        )
+    return store
+
+
+def shard_source(shard: str) -> dict:
+    """Get the settings for a shard, which is a SPARQL endpoint URL or a graph file."""
+    if shard.startswith(("http://", "https://")):
+        return {"sparql_endpoint": shard, "sparql_replicas": [], "graph_path": ""}
+    return {"sparql_endpoint": "", "sparql_replicas": [], "graph_path": shard}
+
+
+@lru_cache
+def get_store_reloader() -> StoreReloader | None:
+    """Get the reloader of the store if it is loaded from the GRAPH_PATH."""
+    settings = get_settings()
+    if settings.materialized_path or settings.shards or not settings.graph_path:
+        return None
+
+    def factory() -> MetadataStore:
+        store = create_metadata_store()
+        # build the indexes before the store is used
+        store.set_index()
+        return store
+
+    reloader = StoreReloader(
+        factory, settings.graph_path, interval=settings.reload_interval
+    )
+    # prefetched pages and cached responses belong to the old data
+    reloader.subscribe(lambda store: get_prefetcher().cache.clear())
+    if response_cache := get_response_cache():
+        reloader.subscribe(lambda store: response_cache.clear())
+    return reloader
+
+
+def start_background_work():
+    """Start the threads that watch the GRAPH_PATH and check the replicas.
+
+    They are started by the app in the process that serves it, so the workers forked
+    by wapmh.serve run them and the parent that loaded the store does not.
+    """
+    if reloader := get_store_reloader():
+        reloader.start()
+    store = current_metadata_store()
+    for shard in getattr(store, "shards", [store]):
+        if replicas := getattr(shard, "replicas", None):
+            replicas.start()
+
+
+def current_metadata_store() -> MetadataStore:
+    """Get the store that new requests are answered from."""
+    if reloader := get_store_reloader():
+        return reloader.store
+    return get_metadata_store()
+
+
+def request_store(request: Request) -> MetadataStore:
+    """Get the store that a request is answered from."""
+    if reloader := request.state.reloader:
+        return reloader.store
+    return request.state.metadata_store
+
+
+@lru_cache
+def get_change_tracker() -> ChangeTracker | None:
+    settings = get_settings()
+    if not settings.change_interval:
+        return None
+    tracker = ChangeTracker(
+        current_metadata_store(),
+        interval=settings.change_interval,
+        full_scan_every=settings.change_full_scan_every,
+    )
+
+    def apply_changes(changes: list):
+        store = current_metadata_store()
+        if isinstance(store, (SparqlMetadataStore, FederatedMetadataStore)):
+            store.apply_changes(changes)
+
+    tracker.subscribe(apply_changes)
+    if reloader := get_store_reloader():
+        # the differences between the old and the new data are reported as changes
+        reloader.subscribe(lambda store: setattr(tracker, "store", store))
+    tracker.start()
+    return tracker
+
+
+def create_sparql_store(settings: config.Settings) -> SparqlMetadataStore:
+    replicas = None
     if settings.graph_path:
-        graph = Graph().parse(source=settings.graph_path, format="turtle")
-    elif settings.sparql_endpoint:
-        store = SPARQLStore(query_endpoint=settings.sparql_endpoint)
-        graph = Graph(store=store)
+        graph = load_graph(
+            settings.graph_path,
+            workers=settings.load_workers,
+            chunk_bytes=settings.load_chunk_bytes,
+            splittable_turtle=settings.splittable_turtle,
+        )
+    elif settings.sparql_endpoint or settings.sparql_replicas:
+        endpoints = [settings.sparql_endpoint] if settings.sparql_endpoint else []
+        endpoints += settings.sparql_replicas
+        graph = Graph(store=CancellableSPARQLStore(query_endpoint=endpoints[0]))
+        if len(endpoints) > 1:
+            replicas = create_replica_pool(settings, endpoints)
     else:
         raise Exception(
             "No graph configured. You need to set a SPARQL_ENDPOINT or GRAPH_PATH."
@@ -78,7 +255,62 @@ def get_metadata_store():
         queries.loadFromDirectory(settings.query_path)
     else:
         raise Exception("No queries configured. You need to set a QUERY_PATH.")
-    return SparqlMetadataStore(graph=graph, queries=queries)
+    return SparqlMetadataStore(
+        graph=graph,
+        queries=queries,
+        partition_workers=settings.partition_workers,
+        partition_rows=settings.partition_rows,
+        set_queries=settings.set_queries,
+        replicas=replicas,
+        statistics=get_query_statistics(),
+        result_cache=(
+            Cache(settings.query_cache_size, settings.query_cache_ttl, encoded_size)
+            if settings.query_cache_size
+            else None
+        ),
+        work_cache=(
+            Cache(
+                settings.work_cache_size,
+                settings.work_cache_ttl,
+                lambda triples: len(triples) + 1,
+            )
+            if settings.work_cache_size
+            else None
+        ),
+    )
+
+
+@lru_cache
+def get_query_statistics() -> QueryStatistics:
+    return QueryStatistics(slow_seconds=get_settings().slow_query_seconds)
+
+
+def create_replica_pool(settings: config.Settings, endpoints: list[str]) -> ReplicaPool:
+    pool = ReplicaPool(
+        {
+            endpoint: Graph(store=CancellableSPARQLStore(query_endpoint=endpoint))
+            for endpoint in endpoints
+        },
+        failure_threshold=settings.replica_failure_threshold,
+        reset_timeout=settings.replica_reset_timeout,
+        hedge_after=settings.hedge_after,
+        health_check=lambda graph: graph.query("ASK {}").askAnswer,
+        health_interval=settings.health_interval,
+    )
+    return pool
+
+
+def get_admission_controller() -> AdmissionController:
+    # not cached, the lanes are bound to the event loop of the running app
+    settings = get_settings()
+    return AdmissionController(
+        list_concurrency=settings.list_concurrency,
+        fast_concurrency=settings.fast_concurrency,
+        queue_size=settings.queue_size,
+        queue_timeout=settings.queue_timeout,
+        client_rate=settings.client_rate,
+        client_burst=settings.client_burst,
+    )
 
 
 @lru_cache
@@ -89,6 +321,129 @@ def get_record_adapter_registry() -> MetadataAdapterRegistry:
     return registry
 
 
+@lru_cache
+def get_request_flight() -> SingleFlight:
+    return SingleFlight()
+
+
+@lru_cache
+def get_shared_cache_backend():
+    settings = get_settings()
+    if not settings.shared_cache:
+        return None
+    return create_backend(settings.shared_cache, settings.shared_cache_size)
+
+
+def shared_tier(cache: Cache, namespace: str) -> Cache | TieredCache:
+    """Share the values of a cache with the other workers, if SHARED_CACHE is set."""
+    if (backend := get_shared_cache_backend()) is None:
+        return cache
+    return TieredCache(
+        cache, backend, namespace, retry_after=get_settings().shared_cache_retry
+    )
+
+
+@lru_cache
+def get_response_cache() -> StaleCache | None:
+    settings = get_settings()
+    if not settings.response_cache_size:
+        return None
+    response_cache = StaleCache(
+        max_size=settings.response_cache_size,
+        ttl=settings.response_ttl,
+        stale_while_revalidate=settings.stale_while_revalidate,
+        stale_if_error=settings.stale_if_error,
+    )
+    response_cache.cache = shared_tier(response_cache.cache, "responses")
+    return response_cache
+
+
+def cached_response(key: tuple, compute: Callable[[], dict]) -> dict:
+    """Get the response from the response cache or compute it.
+
+    Concurrent identical requests are answered by a single computation.
+    """
+    if cache := get_response_cache():
+        return cache.get(key, compute)
+    return get_request_flight().do(key, compute)
+
+
+@lru_cache
+def get_prefetcher() -> Prefetcher:
+    settings = get_settings()
+    prefetcher = Prefetcher(
+        workers=settings.prefetch_workers,
+        max_bytes=settings.prefetch_bytes,
+        ttl=settings.prefetch_ttl,
+    )
+    prefetcher.cache = shared_tier(prefetcher.cache, "pages")
+    return prefetcher
+
+
+@lru_cache
+def get_memory_profiler() -> MemoryProfiler | None:
+    settings = get_settings()
+    if not settings.memory_profiling:
+        return None
+    profiler = MemoryProfiler(frames=settings.memory_profiling_frames)
+    profiler.start()
+    return profiler
+
+
+@lru_cache
+def get_result_sets() -> ResultSetStore | None:
+    settings = get_settings()
+    if not settings.result_set_path:
+        return None
+    return ResultSetStore(settings.result_set_path, ttl=settings.result_set_ttl)
+
+
+@lru_cache
+def get_warmer() -> Warmer | None:
+    """Get the warmer if access logs to replay are configured in WARMUP_LOGS."""
+    settings = get_settings()
+    if not settings.warmup_logs:
+        return None
+    warmer = Warmer(
+        replay=None,
+        logs=settings.warmup_logs,
+        count=settings.warmup_requests,
+        rate=settings.warmup_rate,
+        times=settings.warmup_times,
+    )
+    if reloader := get_store_reloader():
+        # the caches are cleared on reload, so they are warmed up again
+        reloader.subscribe(lambda store: warmer.trigger())
+    return warmer
+
+
+async def replay_request(params: dict, state: dict) -> int:
+    """Send a request through the OAI-PMH interface method and get its status code."""
+
+    async def receive():
+        # the warm-up never disconnects
+        await asyncio.Event().wait()
+
+    request = Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "http",
+            "server": ("localhost", 80),
+            "client": ("warmup", 0),
+            "root_path": "",
+            "path": "/",
+            "query_string": urlencode(params).encode(),
+            "headers": [],
+            "state": dict(state),
+            "app": app,
+        },
+        receive,
+    )
+    response = await oai_pmh(params["verb"], request)
+    return response.status_code
+
+
 @app.get("/", response_class=XmlAppResponse)
 async def oai_pmh(verb: str, request: Request = None) -> XmlAppResponse:
     """The OAI-PMH interface method.
@@ -107,16 +462,50 @@ async def oai_pmh(verb: str, request: Request = None) -> XmlAppResponse:
         if "metadataPrefix" not in query_params:
             query_params["metadataPrefix"] = "oai_dc"
 
+        # the store is taken once, a reload does not affect running requests
+        metadata_store = request_store(request)
+        verb_function = globals()[snakecase(verb)]
+        client = request.client.host if request.client else "unknown"
+
+        token = CancellationToken()
+        watcher = asyncio.create_task(cancel_on_disconnect(request, token))
+        reset = cancellation.current.set(token)
+        profiler = get_memory_profiler()
         try:
+            with profiler.request(verb) if profiler else nullcontext():
+                async with request.state.admission.admit(verb, client):
+                    response = await run_in_threadpool(
+                        cached_response,
+                        RequestAdapter.key(query_params),
+                        lambda: verb_function(metadata_store, **query_params),
+                    )
+                with profiling.stage("serialize"):
+                    return XmlAppResponse(
+                        OaiPmh(
+                            response_date=XmlDateTime.now(),
+                            request=RequestAdapter.request(request),
+                            **response,
+                        )
+                    )
+        except AdmissionRejected as e:
             return XmlAppResponse(
-                OaiPmh(
-                    response_date=XmlDateTime.now(),
-                    request=RequestAdapter.request(request),
-                    **globals()[snakecase(verb)](
-                        request.state.metadata_store, **query_params
-                    ),
-                )
+                status_code=503,
+                content=ApplicationErrorType(value=f"503 Service Unavailable: {e}"),
+                headers={"Retry-After": str(e.retry_after)},
+            )
+        except ReplicasUnavailable as e:
+            return XmlAppResponse(
+                status_code=503,
+                content=ApplicationErrorType(
+                    value="503 Service Unavailable: Store Unavailable"
+                ),
+                headers={"Retry-After": str(e.retry_after)},
             )
+        except Cancelled:
+            abandoned.count(requests=1)
+            logger.info(f"{verb} request of {client} was cancelled")
+            # the harvester is gone, nobody receives this
+            return Response(status_code=499)
         except StoreException:
             return XmlAppResponse(
                 status_code=500,
@@ -124,6 +513,9 @@ async def oai_pmh(verb: str, request: Request = None) -> XmlAppResponse:
                     value="500 Internal Server Error: Store Exception"
                 ),
             )
+        finally:
+            watcher.cancel()
+            cancellation.current.reset(reset)
     else:
         return XmlAppResponse(
             OaiPmh(
@@ -134,6 +526,256 @@ async def oai_pmh(verb: str, request: Request = None) -> XmlAppResponse:
         )
 
 
+async def cancel_on_disconnect(
+    request: Request, token: CancellationToken, interval: float = 0.5
+):
+    """Cancel the work for the request once the client disconnected."""
+    while not token.cancelled:
+        await asyncio.sleep(interval)
+        if await request.is_disconnected():
+            token.cancel()
+
+
+@app.post("/records")
+async def lookup_records(
+    identifiers: list[str] = Body(),
+    metadataPrefix: str = "oai_dc",
+    request: Request = None,
+):
+    """Get the records of a list of identifiers in batched backend queries.
+
+    The records are streamed as ListRecords response, deleted records are included
+    with their header only, like GetRecord returns them. The identifiers that do not
+    exist are listed in a `missing` element of the lookup namespace after the list.
+    It deviates from the OAI-PMH schema, which does not allow other elements in the
+    response, harvesters that validate the response must remove it first.
+    """
+    settings = get_settings()
+    if len(identifiers) > settings.lookup_max_identifiers:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.lookup_max_identifiers} identifiers allowed.",
+        )
+    registry = get_record_adapter_registry()
+    if metadataPrefix not in registry.listPrefixes():
+        return XmlAppResponse(
+            OaiPmh(
+                response_date=XmlDateTime.now(),
+                error=OaiPmherrorType(
+                    value="Unknown metadataPrefix",
+                    code=OaiPmherrorcodeType.CANNOT_DISSEMINATE_FORMAT,
+                ),
+            )
+        )
+    metadata_store = request_store(request)
+    records = iter(registry.adapter(metadata_store, metadataPrefix).lookup(identifiers))
+    client = request.client.host if request.client else "unknown"
+
+    def next_chunk(size: int = 100) -> tuple[str, list[str]]:
+        chunk = list(islice(records, size))
+        return (
+            "".join(streaming.record(record) for record in chunk),
+            [str(record.header.identifier) for record in chunk],
+        )
+
+    async def stream():
+        yield streaming.document_start(str(request.url), "ListRecords")
+        token = CancellationToken()
+        cancellation.current.set(token)
+        found = set()
+        try:
+            async with request.state.admission.admit("ListRecords", client):
+                while True:
+                    xml, chunk = await run_in_threadpool(next_chunk)
+                    if not chunk:
+                        break
+                    found.update(chunk)
+                    yield xml
+        except BaseException:
+            # a failure truncates the document, so the client can not miss it
+            token.cancel()
+            raise
+        tracker = get_change_tracker()
+        missing = []
+        for identifier in identifiers:
+            if identifier in found:
+                continue
+            if tracker and (tombstone := tracker.tombstones.get(identifier)):
+                yield streaming.record(
+                    deleted_record(
+                        {"identifier": identifier, "datestamp": tombstone.datestamp}
+                    )
+                )
+            else:
+                missing.append(identifier)
+        yield "</ListRecords>"
+        if missing:
+            yield streaming.missing(missing)
+        yield "</OAI-PMH>"
+
+    return StreamingResponse(stream(), media_type="application/xml")
+
+
+@app.get("/export/context")
+async def export_context() -> dict:
+    """The JSON-LD context that the exported records refer to."""
+    return {"@context": streaming.EXPORT_CONTEXT}
+
+
+@app.get("/export")
+async def export_records(
+    format: Literal["jsonld", "ntriples"] = "jsonld",
+    from_value: str = Query(None, alias="from"),
+    until: str = None,
+    set: str = None,
+    request: Request = None,
+):
+    """Stream all records as newline delimited JSON, one record per line.
+
+    The metadata is the record graph as compact JSON-LD or as N-Triples. The response
+    is gzipped if the client accepts it. The records are read with the same paging as
+    ListRecords and are in the same order.
+    """
+    settings = get_settings()
+    metadata_store = request_store(request)
+    arguments = {
+        key: value
+        for key, value in {"from": from_value, "until": until, "set": set}.items()
+        if value
+    }
+    context = str(request.url_for("export_context"))
+    client = request.client.host if request.client else "unknown"
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    after, done = None, False
+
+    def next_page() -> str:
+        # each page continues after the last header, so the store does not count
+        # the records of the earlier pages again
+        nonlocal after, done
+        if done:
+            return ""
+        headers = list(
+            metadata_store.identifiers(
+                **arguments, after=after, limit=settings.export_page_size
+            )
+        )
+        done = len(headers) < settings.export_page_size
+        if headers:
+            after = header_key(headers[-1])
+        return "".join(
+            streaming.ndjson_record(record, format, context)
+            for record in metadata_store.records(headers=headers)
+        )
+
+    async def stream():
+        gzip = streaming.GzipStream() if compress else None
+        token = CancellationToken()
+        cancellation.current.set(token)
+        try:
+            async with request.state.admission.admit("ListRecords", client):
+                while lines := await run_in_threadpool(next_page):
+                    yield gzip.chunk(lines) if gzip else lines
+        except BaseException:
+            # a failure aborts the response, so the client can not miss it
+            token.cancel()
+            raise
+        if gzip:
+            yield gzip.end()
+
+    return StreamingResponse(
+        stream(),
+        media_type="application/x-ndjson",
+        headers={"Content-Encoding": "gzip"} if compress else None,
+    )
+
+
+@app.get("/metrics")
+async def metrics() -> dict:
+    metrics = {"abandoned": abandoned.as_dict()}
+    shared = {
+        name: cache.as_dict()
+        for name, cache in [
+            ("responses", getattr(get_response_cache(), "cache", None)),
+            ("pages", get_prefetcher().cache),
+        ]
+        if isinstance(cache, TieredCache)
+    }
+    if shared:
+        metrics["shared_cache"] = shared
+    return metrics
+
+
+def require_admin(request: Request):
+    """Allow only requests with the ADMIN_TOKEN as bearer token.
+
+    The admin endpoints are not available at all, unless ADMIN_TOKEN is set.
+    """
+    token = get_settings().admin_token
+    if not token:
+        raise HTTPException(status_code=404, detail="No ADMIN_TOKEN configured.")
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(
+        credentials.encode(), token.encode()
+    ):
+        raise HTTPException(
+            status_code=401,
+            detail="The admin token is missing or wrong.",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+@app.get("/memory", dependencies=[Depends(require_admin)])
+async def memory_profile(recent: int = 10, top: int = 0) -> dict:
+    """Get the peak allocations per verb and of the recent requests.
+
+    top: the number of source lines holding the most memory to include, taking the
+        snapshot for them is slow.
+    """
+    if not (profiler := get_memory_profiler()):
+        raise HTTPException(status_code=404, detail="MEMORY_PROFILING is disabled.")
+    profile = {
+        "verbs": profiler.summary(),
+        "recent": [p.as_dict() for p in list(profiler.recent)[-recent:]],
+    }
+    if top:
+        profile["top"] = await run_in_threadpool(profiler.top_allocations, top)
+    return profile
+
+
+@app.post("/warmup", dependencies=[Depends(require_admin)])
+async def warmup() -> dict:
+    """Replay the frequent requests of the access logs in WARMUP_LOGS now."""
+    if not (warmer := get_warmer()):
+        raise HTTPException(status_code=404, detail="No WARMUP_LOGS configured.")
+    return await warmer.warm()
+
+
+@app.post("/reload", dependencies=[Depends(require_admin)])
+async def reload_store(request: Request = None) -> dict:
+    """Reload the data from the GRAPH_PATH and swap the store once it is loaded."""
+    if not (reloader := request.state.reloader):
+        raise HTTPException(status_code=404, detail="No GRAPH_PATH configured.")
+    reloaded = await run_in_threadpool(reloader.reload)
+    return {"reloaded": reloaded, "reloads": reloader.reloads}
+
+
+@app.get("/queries", dependencies=[Depends(require_admin)])
+async def query_statistics(
+    count: int = 10, by: str = "total_seconds", request: Request = None
+) -> list[dict]:
+    """List the query templates with the highest `by` statistic and their plans."""
+    if by not in TemplateStatistics.__dataclass_fields__ and by != "mean_seconds":
+        raise HTTPException(status_code=400, detail=f"Unknown statistic {by}.")
+    store = request_store(request)
+    store = getattr(store, "shards", [store])[0]
+    templates = get_query_statistics().top(count, by)
+    if isinstance(store, SparqlMetadataStore):
+        # parsing the templates takes a while and waits for the parse lock
+        for stats in templates:
+            stats["plan"] = await run_in_threadpool(store.explain, stats["name"])
+    return templates
+
+
 def get_record(
     metadata_store: MetadataStore, metadataPrefix: str, identifier: str, **kwargs
 ) -> dict:
@@ -142,6 +784,16 @@ def get_record(
     if record := adapter.record(identifier=identifier):
         return {"get_record": GetRecordType(record=record)}
 
+    tracker = get_change_tracker()
+    if tracker and (tombstone := tracker.tombstones.get(identifier)):
+        return {
+            "get_record": GetRecordType(
+                record=deleted_record(
+                    {"identifier": identifier, "datestamp": tombstone.datestamp}
+                )
+            )
+        }
+
     return {
         "error": OaiPmherrorType(
             value="Record not found", code=OaiPmherrorcodeType.ID_DOES_NOT_EXIST
@@ -149,6 +801,17 @@ def get_record(
     }
 
 
+def deleted_record(header: dict) -> RecordType:
+    """Get the record of a deleted header, it has no metadata."""
+    return RecordType(
+        header=HeaderType(
+            identifier=header["identifier"],
+            datestamp=header["datestamp"],
+            status=StatusType.DELETED,
+        )
+    )
+
+
 def identify(metadata_store: MetadataStore, **kwargs) -> dict:
     """Implements the Identify verb."""
     settings = get_settings()
@@ -159,7 +822,7 @@ def identify(metadata_store: MetadataStore, **kwargs) -> dict:
             protocol_version="2.0",
             admin_email=settings.admin_emails,
             earliest_datestamp="",
-            deleted_record="",
+            deleted_record=DeletedRecordType.TRANSIENT if get_change_tracker() else "",
             granularity="",
             compression=[""],
             description=[DescriptionType(settings.description)],
@@ -170,23 +833,38 @@ def identify(metadata_store: MetadataStore, **kwargs) -> dict:
 def list_identifiers(
     metadata_store: MetadataStore,
     metadataPrefix: str,
+    resumptionToken: str = None,
     **kwargs,
 ) -> dict:
     """Implements the ListIdentifiers verb."""
+    return list_page(
+        identifiers_page,
+        metadata_store,
+        resumptionToken,
+        metadataPrefix=metadataPrefix,
+        **kwargs,
+    )
+    # TODO: return an error in case of an empty result
+
+
+def identifiers_page(
+    metadata_store: MetadataStore, token: ResumptionToken
+) -> tuple[dict, ResumptionToken | None]:
+    headers, next_token = page_headers(metadata_store, token)
     return {
         "list_identifiers": ListIdentifiersType(
             header=[
                 HeaderType(
                     identifier=rec.get("identifier"),
                     datestamp=rec.get("datestamp"),
-                    set_spec=[],
+                    set_spec=rec.get("setSpec", []),
+                    status=StatusType.DELETED if rec.get("status") == DELETED else None,
                 )
-                for rec in metadata_store.identifiers(**kwargs)
+                for rec in headers
             ],
-            resumption_token=None,
+            resumption_token=resumption_token_type(token, next_token),
         )
-    }
-    # TODO: return an error in case of an empty result
+    }, next_token
 
 
 def list_metadata_formats(
@@ -208,25 +886,261 @@ def list_metadata_formats(
     }
 
 
-def list_records(metadata_store: MetadataStore, metadataPrefix: str, **kwargs) -> dict:
+def list_records(
+    metadata_store: MetadataStore,
+    metadataPrefix: str,
+    resumptionToken: str = None,
+    **kwargs,
+) -> dict:
     """Implements the ListRecords verb."""
-    adapter = get_record_adapter_registry().adapter(metadata_store, metadataPrefix)
-    return {"list_records": ListRecordsType(record=list(adapter.records(**kwargs)))}
+    return list_page(
+        records_page,
+        metadata_store,
+        resumptionToken,
+        metadataPrefix=metadataPrefix,
+        **kwargs,
+    )
     # TODO: return an error in case of an empty result
 
 
-def list_sets(metadata_store: MetadataStore, **kwargs) -> dict:
-    """Implements the ListSets verb."""
+def records_page(
+    metadata_store: MetadataStore, token: ResumptionToken
+) -> tuple[dict, ResumptionToken | None]:
+    settings = get_settings()
+    headers, next_token = page_headers(metadata_store, token)
+    adapter = get_record_adapter_registry().adapter(
+        metadata_store, token.arguments["metadataPrefix"]
+    )
+
+    # records are converted one by one, the page is cut early if the budget is spent
+    records = []
+    budget = PageBudget(settings.page_bytes, settings.page_seconds)
+    live = [header for header in headers if header.get("status") != DELETED]
+    for position, record in with_deleted_records(
+        headers, adapter.records(headers=live)
+    ):
+        records.append(record)
+        # measuring the size serializes the metadata, only do it for a byte budget
+        size = record_size(record) if budget.max_bytes else 0
+        if budget.spend(size) and position + 1 < len(headers):
+            # continue after the header of the record, records may be missing
+            next_token = token.next(position + 1, after=header_key(headers[position]))
+            break
 
     return {
-        "error": OaiPmherrorType(
-            value="Record not found", code=OaiPmherrorcodeType.NO_SET_HIERARCHY
+        "list_records": ListRecordsType(
+            record=records,
+            resumption_token=resumption_token_type(token, next_token),
         )
-    }
+    }, next_token
+
+
+def with_deleted_records(
+    headers: list[dict], records: Iterable[RecordType]
+) -> Iterator[tuple[int, RecordType]]:
+    """Insert the records of the deleted headers into the records of the others.
+
+    Yields the position of the header of each record. A header without record, e.g.
+    because it was removed after the headers were queried, is skipped.
+    records: the records of the headers that are not deleted, in the same order.
+    """
+    records = iter(records)
+    record = None
+    for position, header in enumerate(headers):
+        if header.get("status") == DELETED:
+            yield position, deleted_record(header)
+            continue
+        if record is None:
+            record = next(records, None)
+        if record is not None and str(record.header.identifier) == str(
+            header["identifier"]
+        ):
+            yield position, record
+            record = None
+
+
+def deleted_headers(arguments: dict, after: tuple = None) -> list[dict]:
+    """Get the headers of the records that the change tracker found to be deleted.
+
+    The set membership of deleted records is not known, so a set has none.
+    """
+    tracker = get_change_tracker()
+    if tracker is None or arguments.get("set"):
+        return []
+    return tracker.deleted_headers(arguments.get("from"), arguments.get("until"), after)
+
+
+def list_page(
+    page_function, metadata_store: MetadataStore, resumptionToken: str, **kwargs
+) -> dict:
+    """Get a page of a list verb and prefetch the page of its resumption token.
+
+    page_function: computes the response and the next token for a resumption token.
+    """
+    prefetcher = get_prefetcher()
+    try:
+        if resumptionToken:
+            token = ResumptionToken.decode(
+                resumptionToken, get_record_adapter_registry().listPrefixes()
+            )
+            if token.result_set:
+                token = resolve_result_set(token)
+        else:
+            if kwargs.get("set") and (
+                error := set_error(metadata_store, kwargs["set"])
+            ):
+                return error
+            token = ResumptionToken.start(**kwargs)
+            if result_sets := get_result_sets():
+                token = snapshot(metadata_store, result_sets, token)
+        response, next_token = prefetcher.get(
+            (page_function.__name__, token.encode()),
+            lambda: page_function(metadata_store, token),
+        )
+    except BadResumptionToken:
+        return {
+            "error": OaiPmherrorType(
+                value="Invalid or expired resumption token",
+                code=OaiPmherrorcodeType.BAD_RESUMPTION_TOKEN,
+            )
+        }
+
+    if next_token:
+        prefetcher.prefetch(
+            (page_function.__name__, next_token.encode()),
+            lambda: page_function(metadata_store, next_token),
+        )
+    return response
+
+
+def set_error(metadata_store: MetadataStore, set_spec: str) -> dict | None:
+    """Get the error for a set argument that the store does not know, if any."""
+    specs = {s["setSpec"] for s in metadata_store.sets()}
+    if not specs:
+        return {
+            "error": OaiPmherrorType(
+                value="The repository does not support sets",
+                code=OaiPmherrorcodeType.NO_SET_HIERARCHY,
+            )
+        }
+    if set_spec not in specs:
+        return {
+            "error": OaiPmherrorType(
+                value=f"Unknown set {set_spec}",
+                code=OaiPmherrorcodeType.NO_RECORDS_MATCH,
+            )
+        }
+    return None
+
+
+def snapshot(
+    metadata_store: MetadataStore, result_sets: ResultSetStore, token: ResumptionToken
+) -> ResumptionToken:
+    """Store the headers of a new list request in a result set.
+
+    Returns the token of the result set, or the token unchanged if the headers fit on
+    a single page.
+    """
+    limit = int(get_settings().limit)
+    with profiling.stage("store"):
+        headers = heapq.merge(
+            metadata_store.identifiers(**token.arguments, offset=0),
+            deleted_headers(token.arguments),
+            key=header_key,
+        )
+        first = list(islice(headers, limit + 1))
+        if len(first) <= limit:
+            return token
+        result_set = result_sets.create(token.arguments, chain(first, headers))
+    return dataclasses.replace(token, result_set=result_set.id)
+
+
+def resolve_result_set(token: ResumptionToken) -> ResumptionToken:
+    """Get the token with the arguments of its result set, if it did not expire."""
+    result_sets = get_result_sets()
+    result_set = result_sets.get(token.result_set) if result_sets else None
+    if result_set is None:
+        raise BadResumptionToken(token.result_set)
+    return dataclasses.replace(token, arguments=result_set.arguments)
+
+
+def page_headers(
+    metadata_store: MetadataStore, token: ResumptionToken
+) -> tuple[list[dict], ResumptionToken | None]:
+    """Get the headers of the page at the token's cursor and the next token."""
+    limit = int(get_settings().limit)
+    if token.result_set:
+        # the page is cut from the result set, the store is not queried
+        result_set = get_result_sets().get(token.result_set)
+        if result_set is None:
+            raise BadResumptionToken(token.result_set)
+        headers = result_set.headers(token.cursor, limit + 1)
+    else:
+        # the page continues after the last header, the offset is only needed for
+        # tokens without it
+        with profiling.stage("store"):
+            headers = list(
+                metadata_store.identifiers(
+                    **token.arguments,
+                    after=token.after,
+                    offset=None if token.after else token.cursor,
+                    limit=limit + 1,
+                )
+            )
+        if token.after or not token.cursor:
+            # tokens with just an offset do not account for deleted headers
+            headers = list(
+                heapq.merge(
+                    headers,
+                    deleted_headers(token.arguments, token.after),
+                    key=header_key,
+                )
+            )[: limit + 1]
+    if len(headers) > limit:
+        return headers[:limit], token.next(limit, after=header_key(headers[limit - 1]))
+    return headers, None
+
+
+def resumption_token_type(
+    token: ResumptionToken, next_token: ResumptionToken | None
+) -> ResumptionTokenType | None:
+    """Get the resumptionToken element of a page.
+
+    The last page of an incomplete list has an empty resumptionToken.
+    """
+    if next_token and next_token.result_set:
+        result_set = get_result_sets().get(next_token.result_set)
+        return ResumptionTokenType(
+            value=next_token.encode(),
+            cursor=token.cursor,
+            complete_list_size=result_set.count,
+            expiration_date=XmlDateTime.from_datetime(
+                datetime.fromtimestamp(int(result_set.expires), timezone.utc)
+            ),
+        )
+    if next_token:
+        return ResumptionTokenType(value=next_token.encode(), cursor=token.cursor)
+    if token.cursor:
+        return ResumptionTokenType(value="", cursor=token.cursor)
+    return None
+
+
+def list_sets(metadata_store: MetadataStore, **kwargs) -> dict:
+    """Implements the ListSets verb."""
+    sets = metadata_store.sets()
+    if not sets:
+        return {
+            "error": OaiPmherrorType(
+                value="Record not found", code=OaiPmherrorcodeType.NO_SET_HIERARCHY
+            )
+        }
 
     return {
         "list_sets": ListSetsType(
-            set=[SetType()], resumption_token=ResumptionTokenType()
+            set=[
+                SetType(set_spec=set_dict["setSpec"], set_name=set_dict["setName"])
+                for set_dict in sets
+            ]
         )
     }
 
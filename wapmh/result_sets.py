@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+import uuid
+from array import array
+from typing import Iterable
+
+from loguru import logger
+
+from .cache import Cache
+
+
+class ResultSet:
+    """The headers of a list request, stored in a file at the time of the request.
+
+    The headers are lines of tab separated datestamp, identifier, set specs and
+    status; the
+    offsets of the lines are stored in a second file, so a page is read directly.
+    The arguments of the request, the expiry and the count are in a third file.
+    """
+
+    def __init__(self, path: str, id: str):
+        self.id = id
+        self.path = os.path.join(path, f"{id}.headers")
+        self.index_path = os.path.join(path, f"{id}.index")
+        with open(os.path.join(path, f"{id}.json"), "rb") as file:
+            meta = json.load(file)
+        self.arguments = meta["arguments"]
+        self.expires = meta["expires"]
+        self.count = meta["count"]
+
+    @property
+    def expired(self) -> bool:
+        return self.expires < time.time()
+
+    def headers(self, offset: int, limit: int) -> list[dict]:
+        """Get the headers at `offset`, at most `limit` of them."""
+        if offset >= self.count:
+            return []
+        end = min(offset + limit, self.count)
+        offsets = array("Q")
+        with open(self.index_path, "rb") as index:
+            index.seek(offset * offsets.itemsize)
+            offsets.frombytes(index.read(offsets.itemsize))
+        headers = []
+        with open(self.path, "rb") as file:
+            file.seek(offsets[0])
+            for _ in range(end - offset):
+                datestamp, identifier, set_specs, *status = (
+                    file.readline().decode("utf-8").rstrip("\n").split("\t")
+                )
+                header = {"identifier": identifier, "datestamp": datestamp or None}
+                if set_specs:
+                    header["setSpec"] = set_specs.split(" ")
+                if status and status[0]:
+                    header["status"] = status[0]
+                headers.append(header)
+        return headers
+
+
+class ResultSetStore:
+    """Keep the result sets of list requests on disk until they expire.
+
+    Resumption tokens refer to a result set and an offset in it, so all pages of a
+    harvest are cut from the same list of headers, even if the data changes meanwhile.
+    The directory can be shared by the workers of a host.
+    """
+
+    def __init__(self, path: str, ttl: float = 86400):
+        """
+        path: the directory of the result set files.
+        ttl: the seconds until a result set expires.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.cache = Cache(max_size=1000, ttl=ttl)
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def create(self, arguments: dict, headers: Iterable[dict]) -> ResultSet:
+        """Store the headers of a list request in a new result set."""
+        self.expire()
+        id = uuid.uuid4().hex
+        offsets = array("Q")
+        with open(os.path.join(self.path, f"{id}.headers"), "wb") as file:
+            for header in headers:
+                offsets.append(file.tell())
+                set_specs = " ".join(str(s) for s in header.get("setSpec") or [])
+                file.write(
+                    f"{header.get('datestamp') or ''}\t{header['identifier']}\t"
+                    f"{set_specs}\t{header.get('status') or ''}\n".encode("utf-8")
+                )
+        with open(os.path.join(self.path, f"{id}.index"), "wb") as index:
+            offsets.tofile(index)
+        meta_path = os.path.join(self.path, f"{id}.json")
+        with open(meta_path + ".tmp", "w") as file:
+            json.dump(
+                {
+                    "arguments": arguments,
+                    "expires": time.time() + self.ttl,
+                    "count": len(offsets),
+                },
+                file,
+            )
+        # the result set is complete when its meta file exists
+        os.replace(meta_path + ".tmp", meta_path)
+        result_set = ResultSet(self.path, id)
+        self.cache.set(id, result_set)
+        return result_set
+
+    def get(self, id: str) -> ResultSet | None:
+        """Get a result set, None if it does not exist or expired."""
+        result_set = self.cache.get(id)
+        if result_set is None:
+            if not id.isalnum():
+                return None
+            try:
+                result_set = ResultSet(self.path, id)
+            except (OSError, ValueError, KeyError):
+                return None
+            self.cache.set(id, result_set)
+        return None if result_set.expired else result_set
+
+    def expire(self):
+        """Delete the files of expired result sets."""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            for name in os.listdir(self.path):
+                id, extension = os.path.splitext(name)
+                if extension != ".json":
+                    continue
+                try:
+                    if not ResultSet(self.path, id).expired:
+                        continue
+                    os.remove(os.path.join(self.path, name))
+                    os.remove(os.path.join(self.path, f"{id}.headers"))
+                    os.remove(os.path.join(self.path, f"{id}.index"))
+                except (OSError, ValueError, KeyError):
+                    continue
+                self.cache.pop(id)
+                logger.debug(f"Result set {id} expired")
+        finally:
+            self._lock.release()
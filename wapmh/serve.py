@@ -0,0 +1,177 @@
+"""Serve the repository with several worker processes that share the loaded store.
+
+The store and its indexes are loaded once in the parent process, then the workers are
+forked. The loaded objects are moved to the permanent generation of the garbage
+collector with `gc.freeze`, so collections in the workers do not write to them and their
+memory pages stay shared copy-on-write. Reference counting still writes to the objects
+that a request touches, so some pages become private over time.
+
+Background work (change tracking, reloading, health checks of replicas) is started in
+every worker when it starts the app, the parent only loads the store. After a reload the
+worker holds its own copy of the new data.
+"""
+
+import gc
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+from loguru import logger
+
+from . import repository
+from .store import MetadataStore, SparqlMetadataStore
+
+
+def load() -> MetadataStore:
+    """Load the store and its indexes and freeze them for the garbage collector."""
+    store = repository.current_metadata_store()
+    if isinstance(store, SparqlMetadataStore):
+        store.set_index()
+        if identifier_filter := store.identifier_filter:
+            # no thread may hold a lock while forking, the thread's first build is
+            # waited for, unless it was stopped before it started
+            identifier_filter.stop(wait=True)
+            if identifier_filter.bloom is None:
+                identifier_filter.build()
+    gc.collect()
+    gc.freeze()
+    return store
+
+
+def bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    return sock
+
+
+def fork_worker(sock: socket.socket, store: MetadataStore, **config) -> int:
+    """Fork a worker process that serves the app on the socket.
+
+    returns the pid of the worker.
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+    code = 0
+    try:
+        if isinstance(store, SparqlMetadataStore) and store.identifier_filter:
+            # the filter of the parent is shared until the first refresh
+            store.identifier_filter.start(
+                delay=store.identifier_filter.refresh_interval
+            )
+        server = uvicorn.Server(uvicorn.Config(repository.app, **config))
+        server.run(sockets=[sock])
+    except Exception:
+        logger.exception("Worker failed")
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def memory_usage(pid: int) -> dict[str, int]:
+    """Get the memory usage of a process in kB from /proc/<pid>/smaps_rollup.
+
+    Rss is the resident memory including shared pages, Pss divides the shared pages
+    among the processes sharing them.
+    """
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            key, _, value = line.partition(":")
+            if value.strip().endswith("kB"):
+                usage[key] = int(value.split()[0])
+    return {
+        "rss": usage.get("Rss", 0),
+        "pss": usage.get("Pss", 0),
+        "shared": usage.get("Shared_Clean", 0) + usage.get("Shared_Dirty", 0),
+        "private": usage.get("Private_Clean", 0) + usage.get("Private_Dirty", 0),
+    }
+
+
+def report_memory(pids: list[int]):
+    for pid in pids:
+        try:
+            usage = memory_usage(pid)
+        except OSError:
+            continue
+        logger.info(
+            f"Worker {pid}: rss {usage['rss']} kB, pss {usage['pss']} kB, "
+            f"shared {usage['shared']} kB, private {usage['private']} kB"
+        )
+
+
+def serve(
+    workers: int = 2,
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    memory_report: float = 0,
+):
+    """Load the store and serve it with `workers` forked processes.
+
+    Workers that exit unexpectedly are replaced. If `memory_report` is set, the memory
+    usage of the workers is logged every `memory_report` seconds.
+    """
+    started = time.monotonic()
+    store = load()
+    logger.info(f"Loaded the store in {time.monotonic() - started:.1f}s")
+    sock = bind(host, port)
+    config = {"host": host, "port": port}
+    pids = {fork_worker(sock, store, **config) for _ in range(workers)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    reported = time.monotonic()
+    while pids:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.5)
+            if memory_report and time.monotonic() - reported >= memory_report:
+                report_memory(sorted(pids))
+                reported = time.monotonic()
+            continue
+        pids.discard(pid)
+        if not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting")
+            pids.add(fork_worker(sock, store, **config))
+    sock.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Serve the repository with workers that share the loaded store."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--memory-report",
+        type=float,
+        default=0,
+        metavar="SECONDS",
+        help="log the memory usage of the workers periodically",
+    )
+    args = parser.parse_args()
+    serve(
+        workers=args.workers,
+        host=args.host,
+        port=args.port,
+        memory_report=args.memory_report,
+    )
@@ -0,0 +1,131 @@
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator
+
+ARRAY_LIMIT = 4096
+"""Containers with more values than this are converted to bitsets."""
+
+
+class Bitmap:
+    """A compressed bitmap of non-negative integers.
+
+    Similar to roaring bitmaps the values are split by their upper bits into containers
+    of 2^16 values. A sparse container is a sorted array of the lower 16 bits, a dense
+    container is a bitset of 8 KiB.
+    """
+
+    def __init__(self, values: Iterable[int] = ()):
+        self.containers = {}
+        for value in values:
+            self.add(value)
+
+    def add(self, value: int):
+        high, low = value >> 16, value & 0xFFFF
+        container = self.containers.get(high)
+        if container is None:
+            self.containers[high] = array("H", [low])
+        elif isinstance(container, array):
+            i = bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return
+            container.insert(i, low)
+            if len(container) > ARRAY_LIMIT:
+                bitset = bytearray(8192)
+                for low in container:
+                    bitset[low >> 3] |= 1 << (low & 7)
+                self.containers[high] = bitset
+        else:
+            container[low >> 3] |= 1 << (low & 7)
+
+    def __contains__(self, value: int) -> bool:
+        container = self.containers.get(value >> 16)
+        if container is None:
+            return False
+        low = value & 0xFFFF
+        if isinstance(container, array):
+            i = bisect_left(container, low)
+            return i < len(container) and container[i] == low
+        return bool(container[low >> 3] & (1 << (low & 7)))
+
+    def __iter__(self) -> Iterator[int]:
+        for high in sorted(self.containers):
+            container = self.containers[high]
+            if isinstance(container, array):
+                for low in container:
+                    yield high << 16 | low
+            else:
+                for byte_index, byte in enumerate(container):
+                    for bit in range(8):
+                        if byte & (1 << bit):
+                            yield high << 16 | byte_index << 3 | bit
+
+    def __len__(self) -> int:
+        return sum(
+            len(container)
+            if isinstance(container, array)
+            else sum(byte.bit_count() for byte in container)
+            for container in self.containers.values()
+        )
+
+
+class SetIndex:
+    """A precomputed index of the set membership of records.
+
+    Every identifier gets an ordinal number, the members of a set are kept as bitmap of
+    these ordinals. Sets are hierarchical, the members of the set `a:b` are also
+    members of the set `a`.
+    """
+
+    def __init__(self):
+        self.ordinals = {}
+        self.names = {}
+        self.bitmaps = {}
+        self.combinations = [()]
+        """The distinct combinations of set specs that records are assigned to."""
+        self.leaves = array("I")
+        """The combination of the sets each ordinal is assigned to (without ancestors)."""
+        self._combination_ids = {(): 0}
+
+    def add(self, set_spec: str, identifier: str, set_name: str = None):
+        """Add the record with the identifier to the set and its ancestor sets."""
+        ordinal = self.ordinals.setdefault(identifier, len(self.ordinals))
+        if ordinal == len(self.leaves):
+            self.leaves.append(0)
+        leaves = self.combinations[self.leaves[ordinal]]
+        if set_spec not in leaves:
+            # most records share their combination of sets with many others
+            combination = tuple(sorted(leaves + (sys.intern(set_spec),)))
+            combination_id = self._combination_ids.get(combination)
+            if combination_id is None:
+                combination_id = len(self.combinations)
+                self.combinations.append(combination)
+                self._combination_ids[combination] = combination_id
+            self.leaves[ordinal] = combination_id
+        if set_name:
+            self.names[set_spec] = set_name
+        parts = set_spec.split(":")
+        for i in range(1, len(parts) + 1):
+            self.bitmaps.setdefault(":".join(parts[:i]), Bitmap()).add(ordinal)
+
+    def sets(self) -> list[dict]:
+        """Get the setSpec and setName of all sets."""
+        return [
+            {"setSpec": set_spec, "setName": self.names.get(set_spec, set_spec)}
+            for set_spec in sorted(self.bitmaps)
+        ]
+
+    def contains(self, set_spec: str, identifier: str) -> bool:
+        bitmap = self.bitmaps.get(set_spec)
+        ordinal = self.ordinals.get(identifier)
+        return bitmap is not None and ordinal is not None and ordinal in bitmap
+
+    def sets_of(self, identifier: str) -> list[str]:
+        """Get the specs of the sets the record is assigned to (without ancestors)."""
+        ordinal = self.ordinals.get(identifier)
+        if ordinal is None:
+            return []
+        return list(self.combinations[self.leaves[ordinal]])
+
+    def __len__(self) -> int:
+        return len(self.bitmaps)
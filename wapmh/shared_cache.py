@@ -0,0 +1,471 @@
+import dataclasses
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import Any, Hashable
+from urllib.parse import urlsplit
+
+from loguru import logger
+from xsdata.formats.dataclass.etree import etree
+from xsdata.models.datatype import XmlDate, XmlDateTime
+
+from .cache import Cache
+from .model import oai_pmh
+from .paging import ResumptionToken
+
+ELEMENT = type(etree.Element("element"))
+XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+
+class SharedCacheError(Exception):
+    """The shared cache tier is not available or answered with an error."""
+
+
+def _types() -> dict[str, type]:
+    types = {cls.__name__: cls for cls in (ResumptionToken, XmlDate, XmlDateTime)}
+    for value in vars(oai_pmh).values():
+        if isinstance(value, type) and value is not Enum:
+            if dataclasses.is_dataclass(value) or issubclass(value, Enum):
+                types.setdefault(value.__name__, value)
+    return types
+
+
+TYPES = _types()
+"""The types that values in the shared tier may have, besides JSON types."""
+
+
+def _encode(value: Any) -> Any:
+    # a value that is not a JSON type is an object, tagged with the name of its type
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        # e.g. a datestamp Literal
+        return str(value)
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    if isinstance(value, (XmlDate, XmlDateTime)):
+        # they are tuples as well
+        return {"date": type(value).__name__, "value": str(value)}
+    if isinstance(value, tuple):
+        return {"tuple": [_encode(item) for item in value]}
+    if isinstance(value, dict):
+        if not all(isinstance(key, str) for key in value):
+            raise TypeError("Only dicts with str keys can be shared.")
+        return {"dict": {key: _encode(item) for key, item in value.items()}}
+    if isinstance(value, ELEMENT):
+        # the metadata of records are elements
+        return {"xml": etree.tostring(value, encoding="unicode")}
+    name = type(value).__name__
+    if TYPES.get(name) is not type(value):
+        raise TypeError(f"Values of type {name} can not be shared.")
+    if isinstance(value, Enum):
+        return {"enum": name, "value": value.value}
+    return {
+        "dataclass": name,
+        "fields": {
+            field.name: _encode(getattr(value, field.name))
+            for field in dataclasses.fields(value)
+            if field.init
+        },
+    }
+
+
+def _decode(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "tuple" in value:
+        return tuple(_decode(item) for item in value["tuple"])
+    if "dict" in value:
+        return {key: _decode(item) for key, item in value["dict"].items()}
+    if "xml" in value:
+        return etree.fromstring(value["xml"], XML_PARSER)
+    if "enum" in value:
+        return TYPES[value["enum"]](value["value"])
+    if "date" in value:
+        return TYPES[value["date"]].from_string(value["value"])
+    cls = TYPES[value["dataclass"]]
+    return cls(**{key: _decode(item) for key, item in value["fields"].items()})
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize a cached value, a TypeError is raised if it can not be shared.
+
+    The values are JSON, so reading them from a shared tier that others can write to
+    does not execute any code.
+    """
+    return json.dumps(_encode(value), separators=(",", ":")).encode()
+
+
+def loads(data: bytes) -> Any:
+    """Deserialize a cached value, a ValueError is raised if it is malformed."""
+    try:
+        return _decode(json.loads(data))
+    except (KeyError, TypeError, AttributeError, etree.XMLSyntaxError) as e:
+        raise ValueError(f"Malformed shared cache value: {e}") from e
+
+
+def digest(key: Hashable) -> bytes:
+    """Get a fixed size digest of a key, it is the same in every process."""
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).digest()
+
+
+class MmapBackend:
+    """A cache in a memory mapped file shared by the worker processes of a host.
+
+    The file, e.g. in /dev/shm, holds a hash index and a ring buffer of values. Values
+    are appended to the ring buffer, so if it is full the oldest values are evicted
+    first, regardless of how many they are. An index slot is overwritten by a later key
+    with the same hash. Access is serialized by a lock on the file.
+    """
+
+    HEADER = struct.Struct("<8sQQQQ")  # magic, capacity, slots, position, generation
+    SLOT = struct.Struct("<16sQIQd")  # digest, position, length, generation, expires
+    MAGIC = b"WAPMHC01"
+
+    def __init__(self, path: str, size: int):
+        """
+        path: the file, every process that opens it shares the cache.
+        size: the capacity of the ring buffer in bytes.
+        """
+        self.path = path
+        self.capacity = size
+        self.slots = max(1024, size // 4096)
+        self.total_size = self.HEADER.size + self.slots * self.SLOT.size + size
+        self._pid = None
+        self._file = None
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        # a forked worker needs its own open file, otherwise the locks are shared
+        if self._pid == os.getpid():
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._file = os.fdopen(fd, "r+b")
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != self.total_size:
+                os.ftruncate(fd, self.total_size)
+            self._map = mmap.mmap(fd, self.total_size)
+            magic, capacity, slots, _, _ = self.HEADER.unpack_from(self._map)
+            if (magic, capacity, slots) != (self.MAGIC, self.capacity, self.slots):
+                self._map[: self.HEADER.size + self.slots * self.SLOT.size] = bytes(
+                    self.HEADER.size + self.slots * self.SLOT.size
+                )
+                self.HEADER.pack_into(
+                    self._map, 0, self.MAGIC, self.capacity, self.slots, 0, 0
+                )
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self, operation: int):
+        with self._lock:
+            self._open()
+            fcntl.flock(self._file.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _slot_offset(self, key: bytes) -> int:
+        index = int.from_bytes(key[:8], "little") % self.slots
+        return self.HEADER.size + index * self.SLOT.size
+
+    def _data(self, position: int, length: int) -> bytes:
+        start = self.HEADER.size + self.slots * self.SLOT.size
+        offset = position % self.capacity
+        end = min(offset + length, self.capacity)
+        data = self._map[start + offset : start + end]
+        if len(data) < length:
+            data += self._map[start : start + length - len(data)]
+        return data
+
+    def get(self, key: bytes) -> bytes | None:
+        with self._locked(fcntl.LOCK_SH):
+            _, _, _, end, generation = self.HEADER.unpack_from(self._map)
+            slot = self.SLOT.unpack_from(self._map, self._slot_offset(key))
+            slot_key, position, length, slot_generation, expires = slot
+            if (
+                slot_key != key
+                or slot_generation != generation
+                or expires < time.time()
+                # the value was overwritten by later values
+                or end - position > self.capacity
+            ):
+                return None
+            return self._data(position, length)
+
+    def set(self, key: bytes, value: bytes, ttl: float):
+        if len(value) > self.capacity // 4:
+            return
+        with self._locked(fcntl.LOCK_EX):
+            magic, capacity, slots, position, generation = self.HEADER.unpack_from(
+                self._map
+            )
+            start = self.HEADER.size + self.slots * self.SLOT.size
+            offset = position % self.capacity
+            first = min(len(value), self.capacity - offset)
+            self._map[start + offset : start + offset + first] = value[:first]
+            self._map[start : start + len(value) - first] = value[first:]
+            self.SLOT.pack_into(
+                self._map,
+                self._slot_offset(key),
+                key,
+                position,
+                len(value),
+                generation,
+                time.time() + ttl,
+            )
+            self.HEADER.pack_into(
+                self._map, 0, magic, capacity, slots, position + len(value), generation
+            )
+
+    def clear(self):
+        """Invalidate the values of all processes."""
+        with self._locked(fcntl.LOCK_EX):
+            *header, generation = self.HEADER.unpack_from(self._map)
+            self.HEADER.pack_into(self._map, 0, *header, generation + 1)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = self._pid = None
+
+
+class RedisBackend:
+    """A cache in a server that speaks the Redis protocol (RESP), e.g. Redis or Valkey.
+
+    It is shared by the workers of all hosts. The server evicts values by its own
+    memory policy, e.g. maxmemory with allkeys-lru. Clearing the cache increments a
+    generation that is part of the keys, so the old values are not deleted but expire.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 6379,
+        db: int = 0,
+        password: str = None,
+        prefix: str = "wapmh:",
+        timeout: float = 1,
+    ):
+        self.address = (host, port)
+        self.db = db
+        self.password = password
+        self.prefix = prefix.encode()
+        self.timeout = timeout
+        self._generation = None
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs) -> "RedisBackend":
+        """Create a backend from a URL like redis://:password@host:port/db."""
+        parts = urlsplit(url)
+        return cls(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(parts.path.strip("/") or 0),
+            password=parts.password,
+            **kwargs,
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or connection[0] != os.getpid():
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            connection = (os.getpid(), sock, sock.makefile("rb"))
+            self._local.connection = connection
+            if self.password:
+                self._send(connection, b"AUTH", self.password)
+            if self.db:
+                self._send(connection, b"SELECT", self.db)
+        return connection
+
+    def command(self, *args) -> Any:
+        """Send a command and get its reply, the connection is reset on errors."""
+        try:
+            return self._send(self._connection(), *args)
+        except (OSError, SharedCacheError):
+            self._reset()
+            raise
+
+    def _reset(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection[2].close()
+            connection[1].close()
+
+    def _send(self, connection: tuple, *args) -> Any:
+        _, sock, reader = connection
+        request = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            request.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        sock.sendall(b"".join(request))
+        return self._reply(reader)
+
+    def _reply(self, reader) -> Any:
+        line = reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise SharedCacheError("Connection closed by the cache server.")
+        kind, value = line[:1], line[1:-2]
+        if kind == b"+":
+            return value
+        if kind == b"-":
+            raise SharedCacheError(value.decode())
+        if kind == b":":
+            return int(value)
+        if kind == b"$":
+            if int(value) < 0:
+                return None
+            data = reader.read(int(value) + 2)
+            return data[:-2]
+        if kind == b"*":
+            if int(value) < 0:
+                return None
+            return [self._reply(reader) for _ in range(int(value))]
+        raise SharedCacheError(f"Unexpected reply from the cache server: {line!r}")
+
+    def _key(self, key: bytes) -> bytes:
+        if self._generation is None or self._generation[1] < time.monotonic():
+            # other hosts may clear the cache, the generation is read again every second
+            generation = self.command(b"GET", self.prefix + b"generation") or b"0"
+            self._generation = (generation, time.monotonic() + 1)
+        return self.prefix + self._generation[0] + b":" + key.hex().encode()
+
+    def get(self, key: bytes) -> bytes | None:
+        return self.command(b"GET", self._key(key))
+
+    def set(self, key: bytes, value: bytes, ttl: float):
+        self.command(b"SET", self._key(key), value, b"PX", max(1, int(ttl * 1000)))
+
+    def clear(self):
+        generation = self.command(b"INCR", self.prefix + b"generation")
+        self._generation = (str(generation).encode(), time.monotonic() + 1)
+
+    def close(self):
+        self._reset()
+
+
+def create_backend(url: str, size: int):
+    """Create a shared cache backend from a URL, redis:// or file:// for a mmap file."""
+    parts = urlsplit(url)
+    if parts.scheme in ("redis", "valkey"):
+        return RedisBackend.from_url(url)
+    if parts.scheme == "file":
+        return MmapBackend(parts.path, size)
+    raise ValueError(f"Unsupported shared cache URL: {url}")
+
+
+class TieredCache:
+    """A local cache in front of a cache that is shared with other workers.
+
+    Values that are missing locally are read from the shared tier, values that are set
+    are written to both. The shared tier stores the values serialized to JSON. If the
+    shared tier fails, only the local cache is used for `retry_after` seconds.
+    It can be used in place of a Cache.
+    """
+
+    def __init__(
+        self,
+        local: Cache,
+        shared,
+        namespace: str,
+        retry_after: float = 30,
+    ):
+        """
+        local: the cache of the worker, its ttl is used for the shared values as well.
+        shared: the backend of the shared tier.
+        namespace: is part of the keys, to separate the caches in the shared tier.
+        """
+        self.local = local
+        self.shared = shared
+        self.namespace = namespace
+        self.retry_after = retry_after
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._unavailable_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    def _shared(self, operation, *args) -> Any:
+        if not self.available:
+            return None
+        try:
+            return operation(*args)
+        except (OSError, SharedCacheError) as e:
+            self.errors += 1
+            self._unavailable_until = time.monotonic() + self.retry_after
+            logger.warning(
+                f"Shared cache is unavailable, using the local cache for "
+                f"{self.retry_after}s: {e}"
+            )
+            return None
+
+    def _digest(self, key: Hashable) -> bytes:
+        return digest((self.namespace, key))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        data = self._shared(self.shared.get, self._digest(key))
+        if data is None:
+            self.misses += 1
+            return default
+        try:
+            value = loads(data)
+        except ValueError as e:
+            # e.g. a value written by an older version
+            logger.warning(f"Ignoring a value of the shared cache: {e}")
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.local.set(key, value)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self.local.set(key, value)
+        if self.available:
+            try:
+                data = dumps(value)
+            except TypeError as e:
+                logger.debug(f"Not sharing the value of {key}: {e}")
+                return
+            self._shared(self.shared.set, self._digest(key), data, self.local.ttl)
+
+    def clear(self):
+        self.local.clear()
+        self._shared(self.shared.clear)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self.local)
+
+    def as_dict(self) -> dict:
+        return {
+            "available": self.available,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
@@ -1,10 +1,30 @@
+import heapq
 import importlib.resources
+import json
+import math
+import re
+import threading
+import time
 from abc import ABC, abstractmethod
-from typing import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+from typing import Iterable, Iterator
 
 from query_collection import TemplateQueryCollection
 from rdflib import Graph, Literal, URIRef
-from rdflib.namespace import DC
+from rdflib.namespace import DC, DCTERMS, XSD
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+from rdflib.plugins.stores.sparqlstore import SPARQLStore
+from rdflib.util import from_n3
+
+from .cache import Cache
+from .cancellation import Cancelled, check, propagate
+from .concurrency import SingleFlight
+from .diagnostics import QueryStatistics
+from .filters import IdentifierFilter
+from .sets import SetIndex
 
 
 class MetadataStore(ABC):
@@ -15,7 +35,11 @@ class MetadataStore(ABC):
         kwargs: are the named arguments that can be used to restrict the records to be returned.
             If the field identifier is specifeid, the exact record is yielded or nothing.
             If the fields from or until are specifeid the records are restricted according to their date property.
-            If the field set is specifeid … not yet implemented.
+            If the field set is specifeid the records are restricted to the members of the set.
+            If the fields offset or limit are specified, the identifiers are sorted by
+            (datestamp, identifier) and only the respective slice is yielded.
+            If the field after is specified with a `header_key`, only the identifiers
+            after it in this order are yielded, the offset is counted from there.
 
         returns an iterator of identifier dicts.
         These are the same as returned by records, just the metadata might not be included.
@@ -28,12 +52,32 @@ class MetadataStore(ABC):
         kwargs: are the named arguments that can be used to restrict the records to be returned.
             If the field identifier is specifeid, the exact record is yielded or nothing.
             If the fields from or until are specifeid the records are restricted according to their date property.
-            If the field set is specifeid … not yet implemented.
+            If the field set is specifeid the records are restricted to the members of the set.
+            If the fields offset or limit are specified, the records are sorted by
+            (datestamp, identifier) and only the respective slice is yielded.
+            If the field headers is specified with a list of identifier dicts, the
+            records for these headers are yielded in the same order.
 
         returns an iterator of record dicts.
         These are the same as returned by identifiers, but the metadata is required.
         """
 
+    def lookup(self, identifiers: list[str]) -> Iterator[dict]:
+        """This method returns the record dicts of a list of identifiers.
+
+        The records are yielded in the order of the identifiers, unknown identifiers
+        are skipped. Stores should override it to retrieve the records in batches.
+        """
+        for identifier in identifiers:
+            yield from self.records(identifier=identifier)
+
+    def sets(self) -> list[dict]:
+        """This method returns the set dicts with the fields setSpec and setName.
+
+        An empty list means, that the store does not support sets.
+        """
+        return []
+
 
 class MockMetadataStore(MetadataStore):
     """Sample metadata store (you would replace this with your actual database or storage)"""
@@ -50,6 +94,20 @@ class MockMetadataStore(MetadataStore):
     identifiers = records
 
     def _records(self, **kwargs):
+        if (headers := kwargs.get("headers")) is not None:
+            by_identifier = {rec["identifier"]: rec for rec in self.metadata_store}
+            for header in headers:
+                if rec := by_identifier.get(str(header["identifier"])):
+                    yield rec
+            return
+        yield from page(
+            self._matching(**kwargs),
+            kwargs.get("offset"),
+            kwargs.get("limit"),
+            kwargs.get("after"),
+        )
+
+    def _matching(self, **kwargs):
         identifier = kwargs.get("identifier")
         from_value = kwargs.get("from")
         until = kwargs.get("until")
@@ -72,25 +130,221 @@ class MockMetadataStore(MetadataStore):
         return g
 
 
+def header_key(header: dict) -> tuple:
+    """Get a key to sort header dicts in (datestamp, identifier) order."""
+    datestamp = header.get("datestamp")
+    if isinstance(datestamp, Literal):
+        datestamp = datestamp.toPython()
+    if isinstance(datestamp, str) and "T" in datestamp:
+        # e.g. the datestamps of the materialized store
+        try:
+            datestamp = datetime.fromisoformat(datestamp)
+        except ValueError:
+            pass
+    if getattr(datestamp, "tzinfo", None):
+        datestamp = datestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    if hasattr(datestamp, "isoformat"):
+        datestamp = datestamp.isoformat()
+    return (str(datestamp or ""), str(header.get("identifier")))
+
+
+_parse_lock = threading.Lock()
+_parsed_queries = threading.local()
+
+
+def prepare(query: dict, cache: bool = True) -> dict:
+    """Replace the query string in the arguments of a template query by a parsed query.
+
+    The SPARQL parser of rdflib is not thread safe, so each query string is parsed
+    while holding a lock and the parsed query is reused, unless `cache` is False for
+    queries that are used only once. A parsed query is not shared by threads, its
+    expressions keep the bindings of their evaluation, so each thread parses it once.
+    This is only needed for queries that are evaluated by rdflib on local graphs.
+    """
+    query_object = query["query_object"]
+    if not isinstance(query_object, str):
+        return query
+    namespaces = tuple(sorted((query.get("initNs") or {}).items()))
+    key = (query_object, namespaces)
+    if not hasattr(_parsed_queries, "queries"):
+        _parsed_queries.queries = {}
+    parsed_queries = _parsed_queries.queries
+    if cache and key in parsed_queries:
+        return {**query, "query_object": parsed_queries[key]}
+    with _parse_lock:
+        parsed = prepareQuery(query_object, initNs=dict(namespaces))
+    if cache:
+        parsed_queries[key] = parsed
+    return {**query, "query_object": parsed}
+
+
+def with_values(query: str, values: dict[str, list]) -> str:
+    """Append a VALUES clause to a query, `values` maps variables to their values."""
+    variables = " ".join(f"?{variable}" for variable in values)
+    rows = " ".join(
+        f"({' '.join(term.n3() for term in row)})" for row in zip(*values.values())
+    )
+    return f"{query}\nVALUES ({variables}) {{ {rows} }}\n"
+
+
+WHERE = re.compile(r"\bwhere\s*\{", re.IGNORECASE)
+
+
+def with_bindings(query: str, bindings: dict) -> str:
+    """Bind variables of a query by a VALUES block at the start of its WHERE clause.
+
+    Unlike a trailing VALUES clause, the values are joined before the filters of the
+    clause, as with initBindings. The query stays a plain string that a SPARQL
+    endpoint evaluates on its own.
+    """
+    if not bindings:
+        return query
+    match = WHERE.search(query) or re.search(r"\{", query)
+    if match is None:
+        raise ValueError("The query has no WHERE clause to bind variables in.")
+    variables = " ".join(f"?{variable}" for variable in bindings)
+    row = " ".join(term.n3() for term in bindings.values())
+    block = f"\n    VALUES ({variables}) {{ ({row}) }}"
+    return query[: match.end()] + block + query[match.end() :]
+
+
+def page(
+    headers: Iterable[dict],
+    offset: int = None,
+    limit: int = None,
+    after: tuple = None,
+) -> Iterable:
+    """Get a slice of the headers in (datestamp, identifier) order.
+
+    after: a `header_key`, the slice starts after it.
+    If neither offset, limit nor after is given, the headers are returned unchanged.
+    """
+    if offset is None and limit is None and after is None:
+        return headers
+    headers = sorted(headers, key=header_key)
+    if after is not None:
+        after = tuple(after)
+        headers = [header for header in headers if header_key(header) > after]
+    offset = offset or 0
+    end = None if limit is None else offset + limit
+    return headers[offset:end]
+
+
+HEDGED_QUERIES = {
+    "identifiedHeaderSelect",
+    "recordConstruct",
+    "recordPageConstruct",
+    "workConstruct",
+}
+"""The queries of single records, they are hedged if the store has replicas."""
+
+SET_BATCH_ROWS = 1000
+"""The rows that are queried at once for a page of a set, most rows may be skipped."""
+
+RECORD_BATCH_SIZE = 500
+"""The records whose metadata is queried at once."""
+
+
 class SparqlMetadataStore(MetadataStore):
-    def __init__(self, graph: Graph, queries: TemplateQueryCollection):
+    def __init__(
+        self,
+        graph: Graph,
+        queries: TemplateQueryCollection,
+        partition_workers: int = 0,
+        partition_rows: int = 10000,
+        set_queries: list[str] = None,
+        replicas=None,
+        statistics: QueryStatistics = None,
+        result_cache: Cache = None,
+        work_cache: Cache = None,
+    ):
+        """
+        partition_workers: if set, date ranges are split into sub-ranges that are
+            queried concurrently by this number of workers. It applies to headers
+            queried with from (and until) but no page limit, i.e. the `snapshot` of a
+            new list request and pages of tokens that only have an offset. Pages that
+            are queried with `pagedHeadersSelect`, if the queries define it, are not
+            partitioned.
+        partition_rows: the number of rows a sub-range should contain at most.
+        set_queries: the names of the query templates that define the sets, each
+            selects the variables ?setSpec, ?identifier and optionally ?setName.
+        replicas: a ReplicaPool of graphs equivalent to `graph`, the queries are sent
+            to them instead.
+        statistics: collects the execution statistics of the queries, it can be shared
+            by several stores.
+        result_cache: caches the results of the queries by template and bindings,
+            serialized by `encode_result`, its sizeof must be `encoded_size`.
+        work_cache: if set, the records are queried without the works they are part
+            of with `recordPageConstruct`. The works are queried with `workConstruct`
+            and their triples are cached by IRI, to be shared by all their records.
+        """
         self.graph = graph
+        self.replicas = replicas
+        self.statistics = statistics or QueryStatistics()
+        self.result_cache = result_cache
+        self.work_cache = work_cache
         self.queries = queries
+        self.flight = SingleFlight()
+        self.partition_workers = partition_workers
+        self.partition_rows = partition_rows
+        self.rows_per_day = None
+        self.set_queries = set_queries or []
+        self._set_index = None
+        self.identifier_filter = None
 
     def records(self, **kwargs):
-        for header in self.identifiers(**kwargs):
-            yield {**header, "metadata": self.metadata(header["identifier"])}
+        if kwargs.get("identifier"):
+            for header in self.identifiers(**kwargs):
+                check()
+                yield {**header, "metadata": self.metadata(header["identifier"])}
+            return
+        headers = kwargs.get("headers")
+        if headers is None:
+            headers = self.identifiers(**kwargs)
+        # the records of a page are queried at once, with the works they share
+        headers = iter(headers)
+        while batch := list(islice(headers, RECORD_BATCH_SIZE)):
+            check()
+            identifiers = [Literal(header["identifier"]) for header in batch]
+            graph = self.records_graph(identifiers)
+            for header, identifier in zip(batch, identifiers):
+                metadata = record_graph(graph, identifier)
+                metadata.namespace_manager = self.graph.namespace_manager
+                yield {**header, "metadata": metadata}
 
     def identifiers(self, **kwargs):
         identifier = kwargs.get("identifier")
         from_value = kwargs.get("from")
         until = kwargs.get("until")
         set_value = kwargs.get("set")
+        offset, limit, after = (kwargs.get(k) for k in ("offset", "limit", "after"))
 
-        headersSelect = None
-        if identifier:
-            headersSelect = self.queries.get("identifiedHeaderSelect").p(
-                identifier=Literal(identifier)
+        if (
+            not identifier
+            and limit is not None
+            and not offset
+            and self.queries.get("pagedHeadersSelect")
+        ):
+            rows = self.keyset_identifiers(from_value, until, set_value, after, limit)
+            # the rows are the filtered page already
+            set_value = offset = limit = after = None
+        elif identifier:
+            if self.identifier_filter and not self.identifier_filter.might_contain(
+                identifier
+            ):
+                # the identifier is definitely unknown, no need to ask the backend
+                rows = []
+            else:
+                rows = self.query(
+                    "identifiedHeaderSelect", identifier=Literal(identifier)
+                )
+        elif (
+            self.partition_workers
+            and _parse_date(from_value)
+            and (until is None or _parse_date(until))
+        ):
+            rows = self.partitioned_identifiers(
+                _parse_date(from_value), _parse_date(until)
             )
         elif from_value or until:
             dateRange = {}
@@ -98,29 +352,457 @@ class SparqlMetadataStore(MetadataStore):
                 dateRange["from"] = Literal(from_value)
             if until:
                 dateRange["until"] = Literal(until)
-            headersSelect = self.queries.get("dateRangeHeadersSelect").p(**dateRange)
+            rows = self.query("dateRangeHeadersSelect", **dateRange)
+        else:
+            rows = self.query("allHeadersSelect")
+
+        set_index = self.set_index()
+        if set_index and set_value:
+            rows = [
+                row
+                for row in rows
+                if set_index.contains(set_value, str(row["identifier"]))
+            ]
+        rows = page(rows, offset, limit, after)
+        if set_index:
+            # only the headers of the page get their set specs
+            rows = (
+                {**row, "setSpec": set_index.sets_of(str(row["identifier"]))}
+                for row in rows
+            )
+        yield from rows
+
+    def keyset_identifiers(
+        self,
+        from_value: str | None,
+        until: str | None,
+        set_value: str | None,
+        after: tuple | None,
+        limit: int,
+    ) -> list[dict]:
+        """Query the `limit` headers that follow the `header_key` after.
+
+        Ordering and slicing are left to the backend with the pagedHeadersSelect
+        template, which gets the key as ?afterDatestamp and ?afterIdentifier. The key is
+        in UTC. Headers of other sets than `set_value` are skipped, the query is
+        repeated after the last header until the page is full.
+        """
+        set_index = self.set_index() if set_value else None
+        batch = max(limit, SET_BATCH_ROWS) if set_index else limit
+        bindings = {}
+        if from_value:
+            bindings["from"] = Literal(from_value)
+        if until:
+            bindings["until"] = Literal(until)
+        headers = []
+        while len(headers) < limit:
+            if after is not None:
+                after = tuple(after)
+                bindings["afterDatestamp"] = Literal(
+                    f"{after[0]}Z", datatype=XSD.dateTime
+                )
+                bindings["afterIdentifier"] = Literal(after[1])
+            rows = self.query("pagedHeadersSelect", limit=batch, **bindings)
+            page_rows = sorted(
+                (row for row in rows if after is None or header_key(row) > after),
+                key=header_key,
+            )
+            headers += [
+                row
+                for row in page_rows
+                if not set_index
+                or set_index.contains(set_value, str(row["identifier"]))
+            ]
+            if len(rows) < batch or not page_rows:
+                break
+            after = header_key(page_rows[-1])
+        return headers[:limit]
+
+    def sets(self) -> list[dict]:
+        if set_index := self.set_index():
+            return set_index.sets()
+        return []
+
+    def set_index(self) -> SetIndex | None:
+        """Get the set index, it is built on first use."""
+        if not self.set_queries:
+            return None
+        if self._set_index is None:
+            self._set_index = self.flight.do("set_index", self.build_set_index)
+        return self._set_index
+
+    def build_set_index(self) -> SetIndex:
+        """Build the set index from the set queries."""
+        set_index = SetIndex()
+        for name in self.set_queries:
+            for row in self.query(name):
+                set_index.add(
+                    str(row["setSpec"]),
+                    str(row["identifier"]),
+                    str(row["setName"]) if row.get("setName") else None,
+                )
+        return set_index
+
+    def start_identifier_filter(
+        self, refresh_interval: float = 3600, error_rate: float = 0.001
+    ):
+        """Keep a filter of all identifiers to answer requests for unknown ones."""
+        self.identifier_filter = IdentifierFilter(
+            lambda: [str(row["identifier"]) for row in self.query("allHeadersSelect")],
+            refresh_interval=refresh_interval,
+            error_rate=error_rate,
+        )
+        self.identifier_filter.start()
+
+    def close(self):
+        """Stop the background work of the store."""
+        if self.identifier_filter:
+            self.identifier_filter.stop()
+        if self.replicas:
+            self.replicas.stop()
+
+    def apply_changes(self, changes: list):
+        """Update the indexes of the store with the changes of a ChangeTracker."""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if self.work_cache is not None:
+            self.work_cache.clear()
+        if self.identifier_filter:
+            for change in changes:
+                self.identifier_filter.add(change.identifier)
+        if self._set_index is not None:
+            self.refresh_sets()
+
+    def refresh_sets(self):
+        """Rebuild the set index and replace the current one."""
+        if self.set_queries:
+            self._set_index = self.build_set_index()
+
+    def partitioned_identifiers(
+        self, from_date: date, until_date: date | None = None
+    ) -> list[dict]:
+        """Query the headers of a date range split into sub-ranges.
+
+        The sub-ranges are queried concurrently and the results are merged in
+        (datestamp, identifier) order. The number of sub-ranges is estimated from the
+        rows per day observed in previous requests. If the query of a sub-range fails
+        (e.g. due to a timeout of the backend) it is split further.
+        If `until_date` is None, the last sub-range is open ended.
+        """
+        end_date = until_date or date.today()
+        days = (end_date - from_date).days
+        if self.rows_per_day:
+            count = math.ceil(days * self.rows_per_day / self.partition_rows)
         else:
-            headersSelect = self.queries.get("allHeadersSelect").p()
+            count = self.partition_workers
+        count = max(1, min(count, days))
+        step = math.ceil(days / count) if days > 0 else 0
+        if step:
+            count = math.ceil(days / step)
+
+        boundaries = [from_date + timedelta(days=step * i) for i in range(count)]
+        ranges = list(zip(boundaries, boundaries[1:] + [until_date]))
+
+        with ThreadPoolExecutor(max_workers=self.partition_workers) as executor:
+            partitions = list(
+                executor.map(propagate(lambda r: self._range_headers(*r)), ranges)
+            )
 
+        if days > 0:
+            observed = sum(len(rows) for rows in partitions) / days
+            if self.rows_per_day:
+                observed = (self.rows_per_day + observed) / 2
+            self.rows_per_day = observed
+
+        # sub-ranges overlap at their boundaries, so skip duplicate headers
+        merged = []
+        for header in heapq.merge(
+            *(sorted(rows, key=header_key) for rows in partitions), key=header_key
+        ):
+            if not merged or header_key(merged[-1]) != header_key(header):
+                merged.append(header)
+        return merged
+
+    def _range_headers(self, from_date: date, until_date: date | None) -> list[dict]:
+        dateRange = {"from": Literal(from_date.isoformat())}
+        if until_date:
+            dateRange["until"] = Literal(until_date.isoformat())
         try:
-            for row in self.graph.query(**headersSelect):
-                yield row.asdict()
-        except Exception as e:
-            raise StoreBackendException("Backend not available or invalid query.", e)
+            return self.query("dateRangeHeadersSelect", **dateRange)
+        except StoreBackendException:
+            if until_date is None or (until_date - from_date).days < 2:
+                raise
+            middle = from_date + timedelta(days=(until_date - from_date).days // 2)
+            return self._range_headers(from_date, middle) + self._range_headers(
+                middle, until_date
+            )
+
+    def lookup(
+        self, identifiers: list[str], batch_size: int = RECORD_BATCH_SIZE
+    ) -> Iterator[dict]:
+        """Get the records of the identifiers with a query per batch of identifiers.
+
+        The records are yielded in the order of the identifiers, unknown identifiers
+        are skipped.
+        """
+        set_index = self.set_index()
+        for i in range(0, len(identifiers), batch_size):
+            check()
+            batch = identifiers[i : i + batch_size]
+            if self.identifier_filter:
+                batch = [x for x in batch if self.identifier_filter.might_contain(x)]
+            if not batch:
+                continue
+            rows = self.query(
+                "identifiedHeaderSelect",
+                values={"identifier": [Literal(x) for x in batch]},
+            )
+            if not rows:
+                continue
+            graph = self.records_graph([row["identifier"] for row in rows])
+            headers = {str(row["identifier"]): row for row in rows}
+            for identifier in batch:
+                if (header := headers.get(identifier)) is None:
+                    continue
+                if set_index:
+                    header = {**header, "setSpec": set_index.sets_of(identifier)}
+                metadata = record_graph(graph, header["identifier"])
+                metadata.namespace_manager = self.graph.namespace_manager
+                yield {**header, "metadata": metadata}
+
+    def records_graph(self, identifiers: list[Literal]) -> Graph:
+        """Get the graph of several records with a single query.
+
+        With a work cache, the works are taken from it and only the missing ones are
+        queried, see `with_works`.
+        """
+        values = {"identifier": identifiers}
+        if self.work_cache is not None:
+            return self.with_works(self.query("recordPageConstruct", values=values))
+        return self.query("recordConstruct", values=values)
 
     def metadata(self, identifier):
+        if self.work_cache is not None:
+            metadata = self.with_works(
+                self.query("recordPageConstruct", identifier=Literal(identifier))
+            )
+        else:
+            metadata = self.query("recordConstruct", identifier=Literal(identifier))
+        # hack, construct result only contain the default namespace_manager
+        # overwrite it to have all namespaces as defined on the store
+        metadata.namespace_manager = self.graph.namespace_manager
+        return metadata
+
+    def with_works(self, pages: Graph) -> Graph:
+        """Get a graph of the pages and of the works they are part of.
+
+        Like recordConstruct, pages that are not part of a described work are left out.
+        """
+        works = self.works(set(pages.objects(None, DCTERMS.isPartOf)))
+        graph = Graph()
+        for page in set(pages.subjects(DCTERMS.isPartOf, None)):
+            page_works = [works[w] for w in pages.objects(page, DCTERMS.isPartOf)]
+            if any(page_works):
+                for triple in pages.triples((page, None, None)):
+                    graph.add(triple)
+                for triples in page_works:
+                    for triple in triples:
+                        graph.add(triple)
+        return graph
+
+    def works(self, works: Iterable[URIRef]) -> dict[URIRef, tuple]:
+        """Get the triples that describe the works from the work cache or the backend."""
+        found = {}
+        missing = []
+        for work in works:
+            if (triples := self.work_cache.get(work)) is None:
+                missing.append(work)
+            else:
+                found[work] = triples
+        if len(missing) == 1:
+            graph = self.query("workConstruct", work=missing[0])
+        elif missing:
+            graph = self.query("workConstruct", values={"work": missing})
+        for work in missing:
+            found[work] = tuple(graph.triples((work, None, None)))
+            self.work_cache.set(work, found[work])
+        return found
+
+    def query(
+        self, name: str, values: dict[str, list] = None, limit: int = None, **bindings
+    ):
+        """Execute the query template `name` with the given bindings.
+
+        The result of a SELECT query is returned as list of row dicts, the result of a
+        CONSTRUCT or DESCRIBE query as graph.
+        `values` maps variables to lists of values, that are added to the query as
+        VALUES clause to query several solutions at once.
+        `limit` is added to the query as LIMIT clause.
+        Concurrent executions of the same template with the same bindings are coalesced
+        into a single backend request and all callers share the result.
+        If the store has a result cache, results of queries without `values` are taken
+        from it, each caller gets its own copy.
+        """
+        key = (name, tuple(sorted(bindings.items())))
+        if limit is not None:
+            key += (limit,)
+            bindings = {**bindings, "limit": limit}
+        if values:
+            key += tuple((variable, tuple(v)) for variable, v in values.items())
+            bindings = {**bindings, "values": values}
+        elif self.result_cache is not None:
+            if (cached := self.result_cache.get(key)) is not None:
+                self.statistics.hit(name)
+                return decode_result(cached)
+            return self.flight.do(
+                key, lambda: self._execute_cached(key, name, bindings)
+            )
+        return self.flight.do(key, lambda: self._execute(name, **bindings))
+
+    def _execute_cached(self, key: tuple, name: str, bindings: dict):
+        result = self._execute(name, **bindings)
+        self.result_cache.set(key, encode_result(result))
+        return result
+
+    def _execute(
+        self, name: str, values: dict[str, list] = None, limit: int = None, **bindings
+    ):
+        check()
+        started = time.monotonic()
+        result = error = None
         try:
-            recordConstruct = self.queries.get("recordConstruct")
-            metadata = self.graph.query(
-                **(recordConstruct.p(identifier=Literal(identifier)))
-            ).graph
-            # hack, construct result only contain the default namespace_manager
-            # overwrite it to have all namespaces as defined on the store
-            metadata.namespace_manager = self.graph.namespace_manager
-            return metadata
+            result = self._evaluate(name, values, limit, **bindings)
+            return result
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if limit is not None:
+                bindings = {**bindings, "limit": limit}
+            if values:
+                bindings = {
+                    **bindings,
+                    **{v: f"{len(values[v])} values" for v in values},
+                }
+            self.statistics.record(
+                name, bindings, time.monotonic() - started, result, error
+            )
+
+    def _evaluate(
+        self, name: str, values: dict[str, list] = None, limit: int = None, **bindings
+    ):
+        try:
+            template = self.queries.get(name)
+            remote = isinstance(self.graph.store, SPARQLStore)
+            if remote and isinstance(template.query_object, str):
+                # initBindings would make rdflib parse and evaluate the query itself
+                query = template.p()
+                query_object = with_bindings(query["query_object"], bindings)
+                query = {**query, "query_object": query_object}
+            else:
+                query = template.p(**bindings)
+            # the solution modifiers precede a trailing VALUES clause
+            if limit is not None:
+                query = {
+                    **query,
+                    "query_object": f"{query['query_object']}\nLIMIT {limit}\n",
+                }
+            if values:
+                query_object = with_values(query["query_object"], values)
+                query = {**query, "query_object": query_object}
+            if not remote:
+                query = prepare(query, cache=not values)
+            if self.replicas:
+                return self.replicas.call(
+                    lambda graph: _result(graph.query(**query)),
+                    hedge=name in HEDGED_QUERIES,
+                )
+            return _result(self.graph.query(**query))
+        except (StoreException, Cancelled):
+            raise
         except Exception as e:
             raise StoreBackendException("Backend not available or invalid query.", e)
 
+    def explain(self, name: str) -> str | None:
+        """Get the query plan of a template, if the backend supports it.
+
+        Only the algebra of queries on local graphs is available, remote SPARQL
+        endpoints do not offer a standard way to explain a query.
+        """
+        if isinstance(self.graph.store, SPARQLStore):
+            return None
+        query = prepare(self.queries.get(name).p())["query_object"]
+        return format_algebra(query.algebra)
+
+
+def format_algebra(node, indent: str = "    ") -> str:
+    """Format the algebra of a parsed query like pprintAlgebra of rdflib.
+
+    pprintAlgebra prints to stdout, which can only be captured for the whole process.
+    """
+    if not isinstance(node, CompValue):
+        return f"{node}\n"
+    lines = [f"{node.name}(\n"]
+    for key in node:
+        lines.append(f"{indent}{key} = {format_algebra(node[key], indent + '    ')}")
+    lines.append(f"{indent})\n")
+    return "".join(lines)
+
+
+def record_graph(graph: Graph, identifier: Literal) -> Graph:
+    """Get the part of a graph with several records that describes one record.
+
+    These are the triples of the resources with the identifier and of the resources
+    they refer to (e.g. the website of an archived web page).
+    """
+    record = Graph()
+    for resource in graph.subjects(DC.identifier, identifier):
+        for _, p, o in graph.triples((resource, None, None)):
+            record.add((resource, p, o))
+            if o != resource:
+                for triple in graph.triples((o, None, None)):
+                    record.add(triple)
+    return record
+
+
+def encode_result(result) -> tuple[bool, bytes]:
+    """Serialize a query result for the result cache.
+
+    A graph is serialized as N-Triples, rows as JSON lists of the N3 terms of the
+    variables. The cache holds just these bytes and no rdflib objects.
+    """
+    if isinstance(result, Graph):
+        return True, result.serialize(format="nt", encoding="utf-8")
+    variables = list(dict.fromkeys(variable for row in result for variable in row))
+    rows = [
+        [row[v].n3() if row.get(v) is not None else None for v in variables]
+        for row in result
+    ]
+    return False, json.dumps([variables, rows], ensure_ascii=False).encode("utf-8")
+
+
+def decode_result(cached: tuple[bool, bytes]):
+    """Get a new result from a result serialized by `encode_result`."""
+    is_graph, data = cached
+    if is_graph:
+        return Graph().parse(data=data, format="nt")
+    variables, rows = json.loads(data)
+    return [
+        {v: from_n3(term) for v, term in zip(variables, row) if term is not None}
+        for row in rows
+    ]
+
+
+def encoded_size(cached: tuple[bool, bytes]) -> int:
+    """Get the size of a serialized result in the result cache."""
+    return len(cached[1])
+
+
+def _result(result):
+    if result.type in ("CONSTRUCT", "DESCRIBE"):
+        return result.graph
+    return [row.asdict() for row in result]
+
 
 class MockSparqlMetadataStore(SparqlMetadataStore):
     def __init__(self):
@@ -132,9 +814,18 @@ class MockSparqlMetadataStore(SparqlMetadataStore):
                 self.__module__, "../example/queries"
             ) as query_path,
         ):
-            self.graph = Graph().parse(source=graph_path, format="turtle")
-            self.queries = TemplateQueryCollection(initNs=dict(self.graph.namespaces()))
-            self.queries.loadFromDirectory(query_path)
+            graph = Graph().parse(source=graph_path, format="turtle")
+            queries = TemplateQueryCollection(initNs=dict(graph.namespaces()))
+            queries.loadFromDirectory(query_path)
+        super().__init__(graph=graph, queries=queries)
+
+
+def _parse_date(value: str | None) -> date | None:
+    """Parse a day granularity datestamp, None if it is not given or more granular."""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
 
 
 class StoreException(Exception):
@@ -0,0 +1,134 @@
+import json
+import zlib
+from dataclasses import dataclass
+from typing import Any
+from xml.sax.saxutils import escape
+
+from rdflib import Graph
+from rdflib.plugins.serializers.jsonld import from_rdf
+
+from fastapi_xml.decoder import DEFAULT_XML_CONTEXT
+from xsdata.formats.dataclass.serializers import XmlSerializer
+from xsdata.formats.dataclass.serializers.config import SerializerConfig
+from xsdata.models.datatype import XmlDateTime
+
+from .adapters import SerializedMetadata
+from .model.oai_pmh import OaiPmherrorType, RecordType
+
+OAI_NAMESPACE = "http://www.openarchives.org/OAI/2.0/"
+
+
+@dataclass
+class StreamedRecord(RecordType):
+    """A record that is serialized on its own as record element of a list."""
+
+    class Meta:
+        name = "record"
+        namespace = OAI_NAMESPACE
+
+
+@dataclass
+class StreamedError(OaiPmherrorType):
+    class Meta:
+        name = "error"
+        namespace = OAI_NAMESPACE
+
+
+serializer = XmlSerializer(
+    context=DEFAULT_XML_CONTEXT, config=SerializerConfig(xml_declaration=False)
+)
+
+
+def render(element: Any) -> str:
+    """Serialize an element without XML declaration, to be embedded in a stream."""
+    return serializer.render(element, ns_map={None: OAI_NAMESPACE})
+
+
+def document_start(request_url: str, verb: str) -> str:
+    """Get the beginning of an OAI-PMH response up to the opening verb element."""
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f'<OAI-PMH xmlns="{OAI_NAMESPACE}">'
+        f"<responseDate>{XmlDateTime.now()}</responseDate>"
+        f"<request>{escape(request_url)}</request><{verb}>"
+    )
+
+
+def record(record: RecordType) -> str:
+    return render(StreamedRecord(**vars(record)))
+
+
+def error(value: str, code: str) -> str:
+    return render(StreamedError(value=value, code=code))
+
+
+LOOKUP_NAMESPACE = "urn:wapmh:lookup"
+"""The namespace of the identifiers that a lookup did not find."""
+
+
+def missing(identifiers: list[str]) -> str:
+    """Get the element that lists the identifiers a lookup did not find.
+
+    It is not part of OAI-PMH, so the element has its own namespace.
+    """
+    items = "".join(
+        f"<identifier>{escape(identifier)}</identifier>" for identifier in identifiers
+    )
+    return f'<missing xmlns="{LOOKUP_NAMESPACE}">{items}</missing>'
+
+
+EXPORT_CONTEXT = {
+    "bibo": "http://purl.org/ontology/bibo/",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "dcterms": "http://purl.org/dc/terms/",
+    "foaf": "http://xmlns.com/foaf/0.1/",
+    "lv": "http://purl.org/lobid/lv#",
+    "rdau": "http://rdaregistry.info/Elements/u/",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+}
+"""The JSON-LD context of exported records, it compacts the IRIs of the archive data."""
+
+
+def record_graph(metadata: Any) -> Graph | None:
+    """Get the graph of a record's metadata, materialized metadata is parsed again."""
+    if isinstance(metadata, SerializedMetadata):
+        if xml := metadata.get("rdf"):
+            return Graph().parse(data=xml, format="xml")
+        return None
+    return metadata
+
+
+def ndjson_record(record: dict, format: str, context: str) -> str:
+    """Serialize a record as a line of JSON with its metadata as JSON-LD or N-Triples.
+
+    context: the URL of the JSON-LD context, it is referenced instead of embedded.
+    """
+    graph = record_graph(record.get("metadata"))
+    metadata = None
+    if graph is not None and format == "ntriples":
+        metadata = graph.serialize(format="nt")
+    elif graph is not None:
+        metadata = from_rdf(graph, EXPORT_CONTEXT)
+        metadata["@context"] = context
+    line = {
+        "identifier": str(record["identifier"]),
+        "datestamp": str(record.get("datestamp") or ""),
+        "setSpec": [str(set_spec) for set_spec in record.get("setSpec", [])],
+        "metadata": metadata,
+    }
+    return json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class GzipStream:
+    """Compress a stream of chunks, each chunk can be decompressed on arrival."""
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, wbits=31)
+
+    def chunk(self, data: str) -> bytes:
+        return self._compressor.compress(data.encode()) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def end(self) -> bytes:
+        return self._compressor.flush()
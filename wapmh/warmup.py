@@ -0,0 +1,136 @@
+import asyncio
+import glob
+import gzip
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from urllib.parse import parse_qsl, urlsplit
+
+from loguru import logger
+
+ACCESS_LOG_REQUEST = re.compile(r'"GET (?P<target>/\S*) HTTP/[\d.]+"')
+"""Matches the request line in uvicorn and common/combined log format lines."""
+
+
+def request_params(line: str) -> dict | None:
+    """Get the parameters of the OAI-PMH request in an access log line."""
+    match = ACCESS_LOG_REQUEST.search(line)
+    if match is None:
+        return None
+    target = urlsplit(match["target"])
+    if target.path != "/":
+        return None
+    params = dict(parse_qsl(target.query))
+    # resumption tokens belong to a single harvest, they are not replayed
+    if "verb" not in params or "resumptionToken" in params:
+        return None
+    return params
+
+
+def frequent_requests(patterns: list[str], count: int) -> list[dict]:
+    """Get the parameters of the `count` most frequent requests in the access logs.
+
+    patterns: glob patterns of the log files, e.g. including rotated (gzipped) logs.
+    """
+    counter = Counter()
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", errors="replace") as log:
+                for line in log:
+                    if params := request_params(line):
+                        counter[tuple(sorted(params.items()))] += 1
+    return [dict(params) for params, _ in counter.most_common(count)]
+
+
+def seconds_until(times: list[str], now: datetime = None) -> float | None:
+    """Get the seconds until the next of the daily times (HH:MM) or None if none."""
+    if not times:
+        return None
+    now = now or datetime.now()
+    upcoming = []
+    for value in times:
+        hour, minute = map(int, value.split(":"))
+        at = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        upcoming.append(at if at > now else at + timedelta(days=1))
+    return (min(upcoming) - now).total_seconds()
+
+
+class Warmer:
+    """Replay the most frequent requests of the access logs to warm up the caches.
+
+    The requests are sent one after another at `rate` requests per second through the
+    same code path as requests of harvesters, so the response cache, the prefetched
+    pages and the prepared queries are filled. A warm-up runs at startup, at the daily
+    `times` and after `trigger` is called, e.g. when the data was reloaded.
+    """
+
+    def __init__(
+        self,
+        replay: Callable[[dict], Awaitable[int]],
+        logs: list[str],
+        count: int = 100,
+        rate: float = 10,
+        times: list[str] = (),
+    ):
+        """
+        replay: sends a request with the parameters and returns the status code.
+        logs: glob patterns of the access log files.
+        count: the number of distinct requests that are replayed.
+        """
+        self.replay = replay
+        self.logs = logs
+        self.count = count
+        self.rate = rate
+        self.times = list(times)
+        self.runs = 0
+        self._loop = None
+        self._triggered = asyncio.Event()
+
+    async def warm(self) -> dict:
+        """Replay the frequent requests once and get a summary."""
+        requests = await asyncio.to_thread(frequent_requests, self.logs, self.count)
+        started = time.monotonic()
+        failed = 0
+        for index, params in enumerate(requests):
+            if index and self.rate:
+                await asyncio.sleep(1 / self.rate)
+            try:
+                status = await self.replay(params)
+            except Exception as e:
+                logger.warning(f"Warm-up request {params} failed: {e}")
+                status = None
+            failed += status != 200
+        self.runs += 1
+        summary = {
+            "requests": len(requests),
+            "failed": failed,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        logger.info(f"Warm-up finished: {summary}")
+        return summary
+
+    def trigger(self):
+        """Start a warm-up soon, this can be called from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._triggered.set)
+
+    async def run(self, at_start: bool = True):
+        """Warm up at startup, on schedule and when triggered until cancelled."""
+        self._loop = asyncio.get_running_loop()
+        if at_start:
+            self._triggered.set()
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._triggered.wait(), timeout=seconds_until(self.times)
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._triggered.clear()
+            try:
+                await self.warm()
+            except Exception as e:
+                logger.warning(f"Warm-up failed: {e}")